@@ -1,18 +1,25 @@
 # This script demonstrates how to create a Chroma vector store from a text file
-# and persist it to disk. The script checks if the vector store already exists
-# in the persistent directory and initializes it if it does not exist.
+# and persist it to disk. By default the store is synchronized incrementally:
+# a manifest of file and chunk hashes is used to embed only new or changed
+# chunks and to delete chunks whose source files changed or disappeared.
 
 # Instructor: Omar Santos @santosomar
 
 # importing the required libraries
 import os
+import shutil
 
-from langchain.text_splitter import CharacterTextSplitter
-from langchain_community.document_loaders import TextLoader, UnstructuredMarkdownLoader
 from langchain_community.vectorstores import Chroma
 from langchain_openai import OpenAIEmbeddings
 from langchain_openai import OpenAI
 
+from utils.embedding_cache import CachedEmbeddings
+from utils.embedding_executor import EmbeddingExecutor
+from utils.incremental_ingest import MANIFEST_FILENAME, incremental_ingest
+from utils.offset_splitter import paragraph_splitter
+from utils.parallel_loader import load_and_split_files
+from utils.streaming_pipeline import StreamingIngestionPipeline, vector_store_writer
+
 
 # Defining the directory containing the relevant data 
 # In this example, the text file contains information about SSRF vulnerabilities
@@ -25,47 +32,46 @@ files_to_load = [
 ]
 persistent_directory = os.path.join(current_dir, "db", "chroma_db_security")
 
-# Checking if the Chroma vector store already exists
-if not os.path.exists(persistent_directory):
-    print("Persistent directory does not exist. Initializing vector store...")
-
-    # Initialize the text splitter
-    text_splitter = CharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
-    # A list to hold all document chunks
-    all_chunks = []
-
-    print("\n--- Loading and Processing Documents ---")
-    # Loop through each file
-    for file_path in files_to_load:
-        # Ensuring that the text file exists
-        if not os.path.exists(file_path):
-            print(f"Warning: The file {file_path} does not exist. Skipping.")
-            continue
-
+# Incremental ingestion keeps a manifest of file and chunk hashes next to the
+# vector store, so only new or changed chunks are embedded on each run and
+# chunks from changed or deleted files are removed. Set this to False to use
+# the original "build once" behavior.
+incremental_ingestion = True
+manifest_path = os.path.join(persistent_directory, MANIFEST_FILENAME)
+
+# Initialize the text splitter
+# Splits on paragraphs like CharacterTextSplitter(chunk_size=1000, chunk_overlap=100),
+# but tracks the position of every chunk in its file (start_index/end_index metadata)
+# instead of building intermediate strings (see utils/offset_splitter.py).
+text_splitter = paragraph_splitter(chunk_size=1000, chunk_overlap=100)
+
+# Number of worker processes used to load and split the files in parallel.
+# Parsing is CPU-bound, so by default one worker per CPU core is used.
+# Set this to 1 to load the files one by one in this process.
+max_workers = os.cpu_count()
+
+
+def split_files(file_paths):
+    """
+    Loads and splits the files in parallel and prints per-file progress.
+    Yields (file_path, chunks) pairs in the same order as file_paths.
+    """
+    for file_path, docs, error in load_and_split_files(
+        file_paths, text_splitter, max_workers=max_workers
+    ):
         print(f"\n-> Processing: {os.path.basename(file_path)}")
-        # Use the appropriate loader based on file extension
-        if file_path.endswith(".md"):
-            loader = UnstructuredMarkdownLoader(file_path)
-        else:
-            loader = TextLoader(file_path)
-
-        # Load and split the document
-        documents = loader.load()
-        docs = text_splitter.split_documents(documents)
-        all_chunks.extend(docs)
+        if error:
+            print(f"Warning: Could not load {file_path}: {error}. Skipping.")
+            continue
 
         # Display information about the chunks for the current document
         print(f"Number of chunks: {len(docs)}")
         if docs:
             print(f"Sample chunk:\n{docs[0].page_content}\n")
+        yield file_path, docs
 
-    print("\n--- Summary ---")
-    print(f"Total documents processed: {len(files_to_load)}")
-    print(f"Total document chunks created: {len(all_chunks)}")
-
-    if not all_chunks:
-        raise ValueError("No documents were loaded. Please check the file paths.")
 
+def main():
     # Creating embeddings
     # Define the embedding model (in this case, OpenAI's text-embedding-3-small. 
     # Note: You can also use other embedding models such as HuggingFace's SentenceTransformers, Cohere, or 
@@ -73,18 +79,85 @@ if not os.path.exists(persistent_directory):
     # Models" white paper at:
     # https://sec.cloudapps.cisco.com/security/center/resources/selecting-embedding-models 
     # for some tips on selecting an embedding model.)
-    print("\n--- Creating embeddings ---")
-    embeddings = OpenAIEmbeddings(
-        model="text-embedding-3-small"
-    )  # Update to a valid embedding model if needed
-    print("\n--- Finished creating embeddings ---")
-
-    # Creating the vector store/database
-    print("\n--- Creating vector store ---")
-    db = Chroma.from_documents(
-        all_chunks, embeddings, persist_directory=persistent_directory
-    )
-    print("\n--- Finished creating vector store ---")
-
-else:
-    print("Vector store already exists. No need to initialize.")
+    # The embeddings are wrapped in a persistent cache (db/embedding_cache.sqlite3), so
+    # chunks that were already embedded by this or any other script are not sent to
+    # the API again.
+    # Cache misses go through an EmbeddingExecutor, which packs chunks into requests
+    # by token count, sends several requests concurrently within the RPM/TPM budget
+    # of your OpenAI account, and retries rate-limited requests with backoff.
+    executor = EmbeddingExecutor(
+        OpenAIEmbeddings(model="text-embedding-3-small", chunk_size=2048, max_retries=0),
+        max_concurrency=4,
+        requests_per_minute=3000,
+        tokens_per_minute=1_000_000,
+    )  # Update to a valid embedding model and your account's rate limits if needed
+    embeddings = CachedEmbeddings(executor)
+
+    if incremental_ingestion:
+        print("\n--- Synchronizing vector store with the source files ---")
+        db = Chroma(persist_directory=persistent_directory, embedding_function=embeddings)
+        stats = incremental_ingest(db, files_to_load, split_files, manifest_path)
+
+        print("\n--- Summary ---")
+        print(f"Files unchanged: {stats['files_unchanged']}")
+        print(f"Files added or changed: {stats['files_changed']}")
+        print(f"Files removed: {stats['files_removed']}")
+        print(f"Chunks embedded and added: {stats['chunks_added']}")
+        print(f"Chunks deleted: {stats['chunks_deleted']}")
+        print(f"Chunks kept: {stats['chunks_kept']}")
+        embeddings.print_stats()
+        executor.print_stats()
+
+    # Checking if the Chroma vector store already exists
+    elif not os.path.exists(persistent_directory):
+        print("Persistent directory does not exist. Initializing vector store...")
+
+        # Ensuring that the text files exist
+        existing_files = []
+        for file_path in files_to_load:
+            if not os.path.exists(file_path):
+                print(f"Warning: The file {file_path} does not exist. Skipping.")
+                continue
+            existing_files.append(file_path)
+        if not existing_files:
+            raise ValueError("No documents were loaded. Please check the file paths.")
+
+        # Creating the vector store/database
+        # Instead of collecting every chunk in memory and embedding them all at once,
+        # the chunks are streamed through a pipeline with bounded queues: batches are
+        # embedded while the next files are still being loaded and are written to
+        # the store as soon as they are ready.
+        print("\n--- Loading, embedding and storing documents ---")
+        db = Chroma(persist_directory=persistent_directory, embedding_function=embeddings)
+        pipeline = StreamingIngestionPipeline(
+            embeddings, vector_store_writer(db), batch_size=64, embed_workers=2
+        )
+        chunks = (chunk for _, docs in split_files(existing_files) for chunk in docs)
+        try:
+            stats = pipeline.run(chunks)
+
+            print("\n--- Summary ---")
+            print(f"Total documents processed: {len(files_to_load)}")
+            print(f"Total document chunks created: {stats['chunks']}")
+            print(f"Total time: {stats['total_seconds']:.2f}s")
+
+            if not stats["chunks"]:
+                raise ValueError("No documents were loaded. Please check the file paths.")
+        except BaseException:
+            # Do not leave an empty or partial store behind: the next run would find
+            # the directory and skip the ingestion
+            shutil.rmtree(persistent_directory, ignore_errors=True)
+            raise
+
+        print("\n--- Finished creating vector store ---")
+        embeddings.print_stats()
+        executor.print_stats()
+
+    else:
+        print("Vector store already exists. No need to initialize.")
+
+
+# The entry point must be guarded because the worker processes that load the
+# files re-import this module on some platforms.
+if __name__ == "__main__":
+    main()
@@ -8,25 +8,80 @@ import os
 from langchain_chroma import Chroma 
 from langchain_openai import OpenAIEmbeddings
 
+from utils.batch_retrieval import BatchRetriever
+from utils.embedding_cache import DEFAULT_CACHE_PATH
+from utils.flat_index import open_flat_store
+from utils.hnsw_index import open_hnsw_store
+from utils.quantized_index import open_quantized_store
+from utils.query_cache import QueryEmbeddingCache
+
 # Define the persistent directory
 current_dir = os.path.dirname(os.path.abspath(__file__))
 persistent_directory = os.path.join(current_dir, "db", "chroma_db_security")
 
 # Define the embedding model (in this case, OpenAI's text-embedding-3-small. 
 # Note: You can also use other embedding models such as HuggingFace's SentenceTransformers, Cohere, or any other embedding model that is more appropriate for your use case. Refer to the "Selecting Embedding Models" white paper at https://sec.cloudapps.cisco.com/security/center/resources/selecting-embedding-models for some tips on selecting an embedding model.)
-embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
+# Repeated questions are answered from the query embedding cache (in memory, with
+# the shared SQLite cache as a disk tier) instead of calling the embedding API again.
+embeddings = QueryEmbeddingCache(
+    OpenAIEmbeddings(model="text-embedding-3-small"), disk_store=DEFAULT_CACHE_PATH
+)
+
+# Retrieval backend: "chroma" opens the Chroma store directly. "flat" opens a
+# memory-mapped NumPy copy of it (utils/flat_index.py) that loads in milliseconds
+# and does exact search. "hnsw" opens a copy with an HNSW graph
+# (utils/hnsw_index.py) for approximate search on very large stores. "int8" and
+# "pq" keep only quantized codes in memory (utils/quantized_index.py) and re-rank
+# the best candidates with the full vectors read from disk. The copies are
+# exported from the Chroma store on first use and refreshed whenever the Chroma
+# store changes.
+vector_backend = "chroma"
 
 # Load the existing vector store with the embedding function
-db = Chroma(persist_directory=persistent_directory,
-            embedding_function=embeddings)
+if vector_backend == "flat":
+    db = open_flat_store(persistent_directory, embeddings)
+elif vector_backend == "hnsw":
+    db = open_hnsw_store(persistent_directory, embeddings, ef_search=64)
+elif vector_backend in ("int8", "pq"):
+    db = open_quantized_store(persistent_directory, embeddings, method=vector_backend)
+else:
+    db = Chroma(persist_directory=persistent_directory,
+                embedding_function=embeddings)
 
 # Define the user's question
 query = "What is SSRF? Provide an example of an SSRF attack."
 
+# Optional metadata filter, to search only part of the knowledge base, e.g.:
+#   {"source": os.path.join(current_dir, "data", "ssrf.txt")}   one source file
+#   {"issuer_name": {"$contains": "Let's Encrypt"}}              one certificate issuer
+#   {"not_after": {"$gte": "2024-11-01"}}                        a date range
+# The flat, HNSW and quantized stores look the matching chunks up in secondary
+# metadata indexes and only score those (see utils/metadata_index.py); Chroma
+# applies the same filter syntax itself ($contains on metadata is not supported
+# by Chroma).
+search_filter = None
+
+# Search type: "similarity_score_threshold" returns the 5 most similar chunks above
+# a relevance score of 0.5. Because the chunks overlap, those are often slices of
+# the same passage; "mmr" (maximal marginal relevance) fetches the 20 most similar
+# chunks, keeps those above the same relevance score of 0.5, and picks 5 of them
+# that are both relevant and different from each other (lambda_mult: 1 = relevance
+# only, 0 = diversity only). An off-topic question returns no chunks either way.
+# BatchRetriever (utils/batch_retrieval.py) applies the threshold before the
+# vectorized MMR of utils/mmr.py, like the retriever of basic_rag_part3.py.
+search_type = "mmr"
+
 # Retrieve relevant documents based on the query
-retriever = db.as_retriever(
-    search_type="similarity_score_threshold",
-    search_kwargs={"k": 5, "score_threshold": 0.5},
+if search_filter and hasattr(db, "explain_filter"):
+    print(f"Filter plan: {db.explain_filter(search_filter)}")
+retriever = BatchRetriever(
+    vector_store=db,
+    k=5,
+    score_threshold=0.5,
+    search_type="mmr" if search_type == "mmr" else "similarity",
+    fetch_k=20,
+    lambda_mult=0.5,
+    filter=search_filter,
 )
 relevant_docs = retriever.invoke(query)
 
@@ -36,3 +91,5 @@ for i, doc in enumerate(relevant_docs, 1):
     print(f"Document {i}:\n{doc.page_content}\n")
     if doc.metadata:
         print(f"Source: {doc.metadata.get('source', 'Unknown')}\n")
+
+embeddings.print_stats()
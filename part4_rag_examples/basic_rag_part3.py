@@ -8,9 +8,20 @@ import os
 from langchain_chroma import Chroma
 from langchain_openai import OpenAIEmbeddings, ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.runnables import RunnablePassthrough
 from langchain_core.output_parsers import StrOutputParser
 
+from utils.answer_cache import SemanticAnswerCache, pipeline_namespace, store_content_version
+from utils.batch_retrieval import BatchRetriever, retrieval_step
+from utils.context_compressor import CompressingRetriever, ExtractiveCompressor
+from utils.context_packer import ContextPacker
+from utils.embedding_cache import DEFAULT_CACHE_PATH, CachedEmbeddings
+from utils.flat_index import open_flat_store
+from utils.hnsw_index import open_hnsw_store
+from utils.quantized_index import open_quantized_store
+from utils.query_cache import QueryEmbeddingCache
+from utils.reranker import CrossEncoderReranker, RerankingRetriever
+from utils.streaming_rag import StreamingRAG
+
 # --- 1. Setup the Environment ---
 # Define the persistent directory for the Chroma vector store
 current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -18,17 +29,81 @@ persistent_directory = os.path.join(current_dir, "db", "chroma_db_security")
 
 # --- 2. Load the Vector Store ---
 # Initialize the embedding model
-embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
+# Repeated questions are answered from the query embedding cache (in memory, with
+# the shared SQLite cache as a disk tier) instead of calling the embedding API again.
+embeddings = QueryEmbeddingCache(
+    OpenAIEmbeddings(model="text-embedding-3-small"), disk_store=DEFAULT_CACHE_PATH
+)
+
+# Retrieval backend: "chroma" opens the Chroma store directly. "flat" opens a
+# memory-mapped NumPy copy of it (utils/flat_index.py) that loads in milliseconds
+# and does exact search. "hnsw" opens a copy with an HNSW graph
+# (utils/hnsw_index.py) for approximate search on very large stores. "int8" and
+# "pq" keep only quantized codes in memory (utils/quantized_index.py) and re-rank
+# the best candidates with the full vectors read from disk. The copies are
+# exported from the Chroma store on first use and refreshed whenever the Chroma
+# store changes.
+vector_backend = "chroma"
 
 # Load the existing vector store
-db = Chroma(persist_directory=persistent_directory, embedding_function=embeddings)
+if vector_backend == "flat":
+    db = open_flat_store(persistent_directory, embeddings)
+elif vector_backend == "hnsw":
+    db = open_hnsw_store(persistent_directory, embeddings, ef_search=64)
+elif vector_backend in ("int8", "pq"):
+    db = open_quantized_store(persistent_directory, embeddings, method=vector_backend)
+else:
+    db = Chroma(persist_directory=persistent_directory, embedding_function=embeddings)
 
 # --- 3. Create the Retriever ---
 # A retriever is a component that fetches relevant documents from the vector store based on a query.
-retriever = db.as_retriever(
-    search_type="similarity_score_threshold",
-    search_kwargs={"k": 5, "score_threshold": 0.5},
-)
+# BatchRetriever works like db.as_retriever(search_type="similarity_score_threshold"),
+# but when several questions are passed to rag_chain.batch() it embeds them in one
+# request and searches them in one batched operation (see utils/batch_retrieval.py).
+# With search_type="mmr", the chunks above the score threshold among the 20 most
+# similar are re-ranked with maximal marginal relevance (utils/mmr.py), so the 5
+# chunks passed to the LLM are not overlapping slices of the same passage.
+#
+# Optional second stage: with use_reranker = True, the vector search returns 20
+# candidates and a small cross-encoder running on the CPU keeps the 4 that best
+# answer the question (utils/reranker.py). Fewer, better chunks make the LLM call
+# cheaper and faster. If scoring takes longer than latency_budget_ms, the
+# candidates are used in the order of the vector search. Requires the
+# sentence-transformers package (the model is downloaded on first use).
+use_reranker = False
+
+search_settings = {
+    "k": 20 if use_reranker else 5,
+    "score_threshold": 0.5,
+    "search_type": "mmr",
+    "fetch_k": 40 if use_reranker else 20,
+    "lambda_mult": 0.5,
+}
+retriever = BatchRetriever(vector_store=db, **search_settings)
+reranker = None
+if use_reranker:
+    reranker = CrossEncoderReranker(top_n=4, batch_size=16, latency_budget_ms=300)
+    retriever = RerankingRetriever(retriever=retriever, reranker=reranker)
+
+# Optional context compression: the chunks are about 1000 characters and only a few
+# of their sentences usually answer the question. With use_context_compression =
+# True, the compressor keeps the sentences closest to the question, with one
+# neighbouring sentence on each side, up to half of the tokens of the chunks (see
+# utils/context_compressor.py). The sentences are scored with the same embedding
+# model as the retrieval: sentence vectors are kept in the shared embedding cache,
+# so each sentence is embedded once, and the question vector comes from the query
+# cache. Turned off by default, like the reranker: check the answers on your own
+# questions before enabling it.
+use_context_compression = False
+context_compressor = None
+if use_context_compression:
+    context_compressor = ExtractiveCompressor(
+        CachedEmbeddings(embeddings, store=embeddings.disk_store),
+        ratio=0.5,
+        neighbours=1,
+        model_name="gpt-4.1-mini",
+    )
+    retriever = CompressingRetriever(retriever=retriever, compressor=context_compressor)
 
 # --- 4. Define the RAG Chain ---
 # Define the prompt template for the RAG chain
@@ -46,25 +121,99 @@ prompt = ChatPromptTemplate.from_template(prompt_template)
 llm = ChatOpenAI(model="gpt-4.1-mini")
 
 # Helper function to format the retrieved documents
+# Instead of joining every chunk, the context packer merges overlapping chunks of
+# the same file (they share chunk_overlap=100 characters) and keeps the context
+# within a budget of 2000 tokens, best chunks first (see utils/context_packer.py).
+context_packer = ContextPacker(max_tokens=2000, model_name="gpt-4.1-mini")
+
+
 def format_docs(docs):
-    return "\n\n".join(doc.page_content for doc in docs)
+    return context_packer.pack(docs)
 
 # Create the RAG chain using LangChain Expression Language (LCEL)
+# retrieval_step() maps the question to {"context": ..., "question": ...} like
+# {"context": retriever | format_docs, "question": RunnablePassthrough()}, but keeps
+# the retrieval batched in rag_chain.batch(questions).
 rag_chain = (
-    {"context": retriever | format_docs, "question": RunnablePassthrough()}
+    retrieval_step(retriever, format_docs)
     | prompt
     | llm
     | StrOutputParser()
 )
 
-# --- 5. Invoke the Chain and Get the Answer ---
+# --- 5. Add the Semantic Answer Cache ---
+# A question that is nearly identical to one answered before (cosine similarity of
+# at least 0.95) is answered from the cache in milliseconds instead of running
+# retrieval and the LLM again. Cached answers are dropped automatically when the
+# vector store is re-ingested (see utils/answer_cache.py). The namespace is a hash
+# of the settings that shape an answer (LLM, prompt, retrieval and context), so
+# changing any of them does not serve answers of the previous pipeline.
+answer_cache = SemanticAnswerCache(
+    embeddings,
+    version_fn=lambda: store_content_version(persistent_directory),
+    similarity_threshold=0.95,
+    namespace=pipeline_namespace(
+        "basic_rag_part3",
+        llm=llm.model_name,
+        prompt=prompt_template,
+        vector_backend=vector_backend,
+        search=search_settings,
+        use_reranker=use_reranker,
+        reranker=(reranker.model_name, reranker.top_n) if reranker is not None else None,
+        use_context_compression=use_context_compression,
+        compressor=(
+            (context_compressor.model_id, context_compressor.ratio, context_compressor.neighbours)
+            if context_compressor is not None
+            else None
+        ),
+        context_max_tokens=context_packer.max_tokens,
+    ),
+)
+cached_rag_chain = answer_cache.wrap(rag_chain)
+
+# --- 6. Streaming Answers ---
+# invoke() waits for the whole answer. StreamingRAG runs the same retrieval, context
+# and prompt, sends the retrieved sources first and then the answer token by token,
+# so the first words appear in well under a second even when the full answer takes
+# several. It records the retrieval latency, the time to the first token and the
+# generation time of every question (see utils/streaming_rag.py); use
+# streaming_rag.astream() in an async server.
+streaming_rag = StreamingRAG(retriever, format_docs, prompt, llm, answer_cache=answer_cache)
+stream_answer = True
+
+# --- 7. Invoke the Chain and Get the Answer ---
 if __name__ == "__main__":
     # Define the user's question
     query = "What is SSRF? Provide an example of an SSRF attack."
 
-    # Invoke the RAG chain with the query
-    response = rag_chain.invoke(query)
-
-    # Print the response
-    print("\n--- AI-Generated Answer ---")
-    print(response)
+    if stream_answer:
+        # Print the sources, then the answer as it is generated
+        for event in streaming_rag.stream(query):
+            if event["type"] == "sources":
+                print(f"\n--- Sources ({event['retrieval_ms']:.0f} ms) ---")
+                for source in event["sources"]:
+                    print(f"{source['source']} (score: {source['score']})")
+                print("\n--- AI-Generated Answer ---")
+            elif event["type"] == "token":
+                print(event["text"], end="", flush=True)
+            else:
+                metrics = event["metrics"]
+                print(
+                    f"\n\nTime to first token: {metrics['ttft_ms']:.0f} ms, "
+                    f"total: {metrics['total_ms']:.0f} ms"
+                )
+        streaming_rag.print_stats()
+    else:
+        # Invoke the RAG chain with the query (through the answer cache)
+        response = cached_rag_chain.invoke(query)
+
+        # Print the response
+        print("\n--- AI-Generated Answer ---")
+        print(response)
+    answer_cache.print_stats()
+    embeddings.print_stats()
+    context_packer.print_stats()
+    if reranker is not None:
+        reranker.print_stats()
+    if context_compressor is not None:
+        context_compressor.print_stats()
@@ -0,0 +1,95 @@
+# This script answers a list of questions in batches with the RAG chain of
+# basic_rag_part3.py, e.g., for nightly jobs that ask thousands of questions against
+# db/chroma_db_security.
+#
+# Each batch of questions is embedded with one embedding request and searched with
+# one batched operation (utils/batch_retrieval.py); the LLM calls of the batch run
+# concurrently. With --retrieve-only, only the top-k chunks and their relevance
+# scores are written, without any LLM call.
+#
+# The questions file has one question per line (or is a JSON list of strings). The
+# results are written as JSON Lines, one line per question.
+#
+# Examples:
+#   python batch_rag.py questions.txt --output answers.jsonl
+#   python batch_rag.py questions.txt --batch-size 256 --retrieve-only --output hits.jsonl
+#   python batch_rag.py questions.txt --batch-size 64 --max-concurrency 16
+
+# Instructor: Omar Santos @santosomar
+
+import argparse
+import json
+import time
+
+from basic_rag_part3 import (
+    context_compressor,
+    context_packer,
+    embeddings,
+    rag_chain,
+    reranker,
+    retriever,
+)
+
+
+def load_questions(path):
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".json"):
+            return json.load(f)
+        return [line.strip() for line in f if line.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Answer many questions in batches.")
+    parser.add_argument("questions", help="Text file with one question per line, or a JSON list.")
+    parser.add_argument("--output", default="batch_answers.jsonl")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--max-concurrency", type=int, default=8, help="Concurrent LLM calls.")
+    parser.add_argument("--retrieve-only", action="store_true", help="Skip the LLM.")
+    args = parser.parse_args()
+
+    questions = load_questions(args.questions)
+    start = time.perf_counter()
+    with open(args.output, "w", encoding="utf-8") as f:
+        for offset in range(0, len(questions), args.batch_size):
+            batch = questions[offset:offset + args.batch_size]
+            if args.retrieve_only:
+                for question, hits in zip(batch, retriever.retrieve_batch(batch)):
+                    record = {
+                        "question": question,
+                        "results": [
+                            {
+                                "id": document.id,
+                                "source": document.metadata.get("source"),
+                                "score": round(float(score), 4),
+                                "content": document.page_content,
+                            }
+                            for document, score in hits
+                        ],
+                    }
+                    f.write(json.dumps(record) + "\n")
+            else:
+                answers = rag_chain.batch(
+                    batch, config={"max_concurrency": args.max_concurrency}, return_exceptions=True
+                )
+                for question, answer in zip(batch, answers):
+                    if isinstance(answer, Exception):
+                        record = {"question": question, "error": repr(answer)}
+                    else:
+                        record = {"question": question, "answer": answer}
+                    f.write(json.dumps(record) + "\n")
+            done = offset + len(batch)
+            elapsed = time.perf_counter() - start
+            print(f"{done}/{len(questions)} questions, {done / elapsed:.1f} questions/s")
+
+    print(f"\nResults written to {args.output}")
+    embeddings.print_stats()
+    if not args.retrieve_only:
+        context_packer.print_stats()
+    if reranker is not None:
+        reranker.print_stats()
+    if context_compressor is not None:
+        context_compressor.print_stats()
+
+
+if __name__ == "__main__":
+    main()
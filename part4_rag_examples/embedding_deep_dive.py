@@ -1,11 +1,16 @@
 import os
 
 from langchain.embeddings import HuggingFaceEmbeddings
-from langchain.text_splitter import CharacterTextSplitter
-from langchain_community.document_loaders import TextLoader
-from langchain_community.vectorstores import Chroma
+from langchain_chroma import Chroma
 from langchain_openai import OpenAIEmbeddings
 
+from utils.embedding_cache import CachedEmbeddings
+from utils.embedding_executor import EmbeddingExecutor
+from utils.flat_index import open_flat_store
+from utils.hybrid_search import HybridRetriever, open_bm25_index
+from utils.json_records import JSONRecordLoader
+from utils.near_dedup import deduplicate_documents
+
 # Define the directory containing the text file and the persistent directory
 current_dir = os.path.dirname(os.path.abspath(__file__))
 file_path = os.path.join(current_dir, "data", "tesla.json")
@@ -17,13 +22,23 @@ if not os.path.exists(file_path):
         f"The file {file_path} does not exist. Please check the path."
     )
 
-# Read the text content from the file
-loader = TextLoader(file_path)
-documents = loader.load()
-
-# Split the document into chunks
-text_splitter = CharacterTextSplitter(chunk_size=1000, chunk_overlap=0)
-docs = text_splitter.split_documents(documents)
+# Stream the certificate records from the JSON file and create one chunk per record.
+# Unlike TextLoader + CharacterTextSplitter, this never reads the whole file into
+# memory, never cuts a record in half, and copies fields such as issuer_name,
+# name_value and not_after into the chunk metadata.
+loader = JSONRecordLoader(file_path)
+docs = list(loader.lazy_load())
+
+# Optionally collapse near-duplicate chunks (e.g., certificate records that only
+# differ by ID and timestamps) before embedding them. Each kept chunk lists the
+# chunks it replaced in its "merged_sources" metadata.
+deduplicate_chunks = True
+if deduplicate_chunks:
+    docs, dedup_stats = deduplicate_documents(docs, threshold=0.8)
+    print(
+        f"Near-duplicate removal: {dedup_stats['input_chunks']} -> "
+        f"{dedup_stats['output_chunks']} chunks"
+    )
 
 # Display information about the split documents
 print("\n--- Document Chunks Information ---")
@@ -50,7 +65,15 @@ def create_vector_store(docs, embeddings, store_name):
 # Note: The cost of using OpenAI embeddings will depend on your OpenAI API usage and pricing plan.
 # Pricing: https://openai.com/api/pricing/
 print("\n--- Using OpenAI Embeddings ---")
-openai_embeddings = OpenAIEmbeddings(model="text-embedding-ada-002")
+# Embeddings are served from the shared on-disk cache when the same chunk was embedded before.
+# Cache misses are sent in token-packed, concurrent, rate-limited requests with retries.
+openai_executor = EmbeddingExecutor(
+    OpenAIEmbeddings(model="text-embedding-ada-002", chunk_size=2048, max_retries=0),
+    max_concurrency=4,
+    requests_per_minute=3000,
+    tokens_per_minute=1_000_000,
+)
+openai_embeddings = CachedEmbeddings(openai_executor)
 create_vector_store(docs, openai_embeddings, "chroma_db_openai")
 
 # 2. Hugging Face Transformers
@@ -59,27 +82,62 @@ create_vector_store(docs, openai_embeddings, "chroma_db_openai")
 # Note: Running Hugging Face models locally on your machine incurs no direct cost other than using your computational resources.
 # Note: Find other models at https://huggingface.co/models?other=embeddings
 print("\n--- Using Hugging Face Transformers ---")
-huggingface_embeddings = HuggingFaceEmbeddings(
-    model_name="sentence-transformers/all-mpnet-base-v2"
+huggingface_embeddings = CachedEmbeddings(
+    HuggingFaceEmbeddings(model_name="sentence-transformers/all-mpnet-base-v2")
 )
 create_vector_store(docs, huggingface_embeddings, "chroma_db_huggingface")
 
 print("Embedding demonstrations for OpenAI and Hugging Face completed.")
+openai_embeddings.print_stats()
+openai_executor.print_stats()
+huggingface_embeddings.print_stats()
 
 
 # Function to query a vector store
-def query_vector_store(store_name, query, embedding_function):
+# Retrieval backend: "chroma" opens the Chroma store directly. "flat" opens a
+# memory-mapped NumPy copy of it (utils/flat_index.py) that loads in milliseconds
+# and does exact search; the copy is exported from the Chroma store on first use
+# and refreshed whenever the Chroma store changes.
+vector_backend = "chroma"
+
+# Hybrid retrieval: when True, the vector search is combined with a BM25 keyword
+# index (utils/hybrid_search.py) that matches exact tokens such as hostnames, IP
+# addresses and CVE IDs, and both result lists are fused with reciprocal rank
+# fusion. The keyword index is built next to the vector store on first use.
+use_hybrid_search = True
+
+# Metadata filters (e.g., {"source": ...} or {"issuer_name": {"$in": [...]}}) are
+# passed to query_vector_store() as search_filter. The flat store answers them with
+# secondary metadata indexes (utils/metadata_index.py), so only the matching chunks
+# are scored; Chroma applies the same filter syntax itself.
+
+
+def query_vector_store(store_name, query, embedding_function, search_filter=None):
     persistent_directory = os.path.join(db_dir, store_name)
     if os.path.exists(persistent_directory):
         print(f"\n--- Querying the Vector Store {store_name} ---")
-        db = Chroma(
-            persist_directory=persistent_directory,
-            embedding_function=embedding_function,
-        )
-        retriever = db.as_retriever(
-            search_type="similarity_score_threshold",
-            search_kwargs={"k": 3, "score_threshold": 0.1},
-        )
+        if vector_backend == "flat":
+            db = open_flat_store(persistent_directory, embedding_function)
+        else:
+            db = Chroma(
+                persist_directory=persistent_directory,
+                embedding_function=embedding_function,
+            )
+        if use_hybrid_search:
+            retriever = HybridRetriever(
+                vector_store=db,
+                lexical_index=open_bm25_index(persistent_directory, db),
+                k=3,
+                filter=search_filter,
+            )
+        else:
+            search_kwargs = {"k": 3, "score_threshold": 0.1}
+            if search_filter:
+                search_kwargs["filter"] = search_filter
+            retriever = db.as_retriever(
+                search_type="similarity_score_threshold",
+                search_kwargs=search_kwargs,
+            )
         relevant_docs = retriever.invoke(query)
         # Display the relevant results with metadata
         print(f"\n--- Relevant Documents for {store_name} ---")
@@ -98,4 +156,16 @@ query = "what hosts are in Amazon?"
 query_vector_store("chroma_db_openai", query, openai_embeddings)
 query_vector_store("chroma_db_huggingface", query, huggingface_embeddings)
 
+# Search only the certificates issued by Amazon
+amazon_issuers = [
+    "C=US, O=Amazon, CN=Amazon RSA 2048 M02",
+    "C=US, O=Amazon, CN=Amazon RSA 2048 M03",
+]
+query_vector_store(
+    "chroma_db_openai",
+    query,
+    openai_embeddings,
+    search_filter={"issuer_name": {"$in": amazon_issuers}},
+)
+
 print("Querying demonstrations completed.")
@@ -0,0 +1,270 @@
+# This script benchmarks the ingestion flows of basic_rag_part1.py and
+# text_splitting_deep_dive.py stage by stage (load, split, embed, write), so you can
+# see where the time and memory of an ingest actually go.
+#
+# The chunks are embedded with a deterministic local embedder (HashingEmbeddings),
+# so no network access or API key is needed and the results are reproducible. Each
+# stage reports its wall time, chunks per second and peak RSS, and the results are
+# written to a JSON file that can be compared against a previous run with --baseline.
+#
+# Examples:
+#   python ingestion_benchmark.py
+#   python ingestion_benchmark.py --synthetic-files 500 --synthetic-kb 64 --output big.json
+#   python ingestion_benchmark.py --baseline benchmark_results.json
+#   python ingestion_benchmark.py --embedding-latency 0.2   # simulate a remote API
+
+# Instructor: Omar Santos @santosomar
+
+import argparse
+import json
+import os
+import random
+import shutil
+import tempfile
+
+from langchain_chroma import Chroma
+
+from utils.benchmarking import StageTimer, environment_info
+from utils.local_embeddings import HashingEmbeddings
+from utils.offset_splitter import paragraph_splitter
+from utils.parallel_loader import load_file
+from utils.splitters import splitting_configurations
+from utils.streaming_pipeline import iter_batches, vector_store_writer
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+data_dir = os.path.join(current_dir, "data")
+
+# The same inputs used by basic_rag_part1.py and text_splitting_deep_dive.py
+part1_files = [
+    os.path.join(data_dir, "ssrf.txt"),
+    os.path.join(data_dir, "llm_cheatsheet.md"),
+]
+splitting_files = [os.path.join(data_dir, "tesla.json")]
+
+
+def make_synthetic_corpus(directory, num_files, file_kb, seed=42):
+    """
+    Creates a synthetic corpus by shuffling the paragraphs of the sample data.
+
+    :param directory: Directory where the files are written.
+    :param num_files: Number of files to create.
+    :param file_kb: Approximate size of each file in kilobytes.
+    :param seed: Random seed, so the same arguments create the same corpus.
+    :return: The list of created file paths.
+    """
+    paragraphs = []
+    for file_path in part1_files:
+        with open(file_path, "r", encoding="utf-8") as f:
+            paragraphs += [p.strip() for p in f.read().split("\n\n") if p.strip()]
+
+    rng = random.Random(seed)
+    file_paths = []
+    for i in range(num_files):
+        parts, size = [], 0
+        while size < file_kb * 1024:
+            paragraph = rng.choice(paragraphs)
+            parts.append(paragraph)
+            size += len(paragraph) + 2
+        file_path = os.path.join(directory, f"synthetic_{i:05d}.txt")
+        with open(file_path, "w", encoding="utf-8") as f:
+            f.write("\n\n".join(parts))
+        file_paths.append(file_path)
+    return file_paths
+
+
+def run_flow(name, file_paths, text_splitter, embeddings, work_dir, batch_size):
+    """
+    Runs load -> split -> embed -> write as separate, individually measured stages.
+
+    :return: A dictionary with the flow name, chunk count and per-stage results.
+    """
+    stages = []
+
+    with StageTimer("load") as stage:
+        documents = [doc for file_path in file_paths for doc in load_file(file_path)]
+    stage.items = len(documents)
+    stages.append(stage)
+
+    with StageTimer("split") as stage:
+        chunks = text_splitter.split_documents(documents)
+    stage.items = len(chunks)
+    stages.append(stage)
+
+    with StageTimer("embed") as stage:
+        vectors = []
+        for batch in iter_batches([chunk.page_content for chunk in chunks], batch_size):
+            vectors += embeddings.embed_documents(batch)
+    stage.items = len(vectors)
+    stages.append(stage)
+
+    persist_directory = os.path.join(work_dir, name)
+    with StageTimer("write") as stage:
+        db = Chroma(
+            collection_name="benchmark",
+            persist_directory=persist_directory,
+            embedding_function=embeddings,
+        )
+        write = vector_store_writer(db)
+        for start in range(0, len(chunks), batch_size):
+            batch = chunks[start:start + batch_size]
+            write(
+                batch,
+                vectors[start:start + batch_size],
+                [str(i) for i in range(start, start + len(batch))],
+            )
+    stage.items = len(chunks)
+    stages.append(stage)
+
+    total = sum(s.wall_seconds for s in stages)
+    return {
+        "flow": name,
+        "files": len(file_paths),
+        "chunks": len(chunks),
+        "total_seconds": round(total, 6),
+        "stages": [s.as_dict() for s in stages],
+    }
+
+
+def print_results(results):
+    for flow in results["flows"]:
+        if "skipped" in flow:
+            print(f"\n{flow['flow']}: skipped ({flow['skipped']})")
+            continue
+        print(
+            f"\n{flow['flow']}: {flow['files']} files, {flow['chunks']} chunks, "
+            f"{flow['total_seconds']:.3f}s"
+        )
+        print(f"  {'stage':<8}{'seconds':>10}{'items/s':>12}{'peak RSS MB':>14}")
+        for stage in flow["stages"]:
+            rate = stage["items_per_second"]
+            print(
+                f"  {stage['stage']:<8}{stage['wall_seconds']:>10.3f}"
+                f"{(rate if rate is not None else 0):>12.1f}{stage['peak_rss_mb']:>14.1f}"
+            )
+
+
+def compare_with_baseline(results, baseline_path):
+    """Prints the relative change of every stage against a previous results file."""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    previous = {
+        (flow["flow"], stage["stage"]): stage
+        for flow in baseline.get("flows", [])
+        for stage in flow.get("stages", [])
+    }
+    print(f"\n--- Comparison with {baseline_path} ---")
+    for flow in results["flows"]:
+        for stage in flow.get("stages", []):
+            old = previous.get((flow["flow"], stage["stage"]))
+            if not old or not old["wall_seconds"]:
+                continue
+            time_change = (stage["wall_seconds"] / old["wall_seconds"] - 1) * 100
+            rss_change = stage["peak_rss_mb"] - old["peak_rss_mb"]
+            print(
+                f"{flow['flow']:<40}{stage['stage']:<8}"
+                f"time {time_change:+7.1f}%   peak RSS {rss_change:+8.1f} MB"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the ingestion flows stage by stage with a local embedder."
+    )
+    parser.add_argument(
+        "--flows",
+        default="part1,splitting",
+        help="Comma-separated flows to run: part1 (basic_rag_part1.py) and/or "
+        "splitting (text_splitting_deep_dive.py).",
+    )
+    parser.add_argument(
+        "--synthetic-files",
+        type=int,
+        default=0,
+        help="Run the flows over a synthetic corpus with this many files instead of the sample data.",
+    )
+    parser.add_argument(
+        "--synthetic-kb", type=int, default=32, help="Size of each synthetic file in KB."
+    )
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--embedding-dim", type=int, default=384)
+    parser.add_argument(
+        "--embedding-latency",
+        type=float,
+        default=0.0,
+        help="Simulated latency in seconds per embedding request.",
+    )
+    parser.add_argument("--output", default=os.path.join(current_dir, "benchmark_results.json"))
+    parser.add_argument("--baseline", help="A previous results file to compare against.")
+    args = parser.parse_args()
+
+    embeddings = HashingEmbeddings(
+        size=args.embedding_dim, latency_seconds=args.embedding_latency
+    )
+    flows = [flow.strip() for flow in args.flows.split(",") if flow.strip()]
+    work_dir = tempfile.mkdtemp(prefix="rag_benchmark_")
+    results = {
+        "environment": environment_info(),
+        "arguments": vars(args),
+        "embedding_model": embeddings.model,
+        "flows": [],
+    }
+
+    try:
+        if args.synthetic_files:
+            print(
+                f"--- Creating synthetic corpus: {args.synthetic_files} files x "
+                f"{args.synthetic_kb} KB ---"
+            )
+            corpus_dir = os.path.join(work_dir, "corpus")
+            os.makedirs(corpus_dir)
+            synthetic = make_synthetic_corpus(
+                corpus_dir, args.synthetic_files, args.synthetic_kb
+            )
+            inputs = {"part1": synthetic, "splitting": synthetic}
+        else:
+            inputs = {"part1": part1_files, "splitting": splitting_files}
+
+        if "part1" in flows:
+            print("\n--- Benchmarking the basic_rag_part1.py flow ---")
+            results["flows"].append(
+                run_flow(
+                    "basic_rag_part1/paragraph",
+                    inputs["part1"],
+                    paragraph_splitter(chunk_size=1000, chunk_overlap=100),
+                    embeddings,
+                    work_dir,
+                    args.batch_size,
+                )
+            )
+
+        if "splitting" in flows:
+            print("\n--- Benchmarking the text_splitting_deep_dive.py flows ---")
+            for name, splitter in splitting_configurations().items():
+                flow_name = f"text_splitting_deep_dive/{name}"
+                if isinstance(splitter, str):
+                    results["flows"].append({"flow": flow_name, "skipped": splitter})
+                    continue
+                results["flows"].append(
+                    run_flow(
+                        flow_name,
+                        inputs["splitting"],
+                        splitter,
+                        embeddings,
+                        work_dir,
+                        args.batch_size,
+                    )
+                )
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print_results(results)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    if args.baseline:
+        compare_with_baseline(results, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
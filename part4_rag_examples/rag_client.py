@@ -0,0 +1,132 @@
+# This script is a client and load tester for the RAG service of rag_service.py.
+# It uses only the Python standard library, so it runs anywhere, including next to a
+# service started with --stub for offline load tests.
+#
+# The load test sends --requests questions from --concurrency threads, cycling
+# through the questions file (repeated questions exercise the coalescing of the
+# service), and reports the throughput, the latency percentiles, and the
+# counters of the service.
+#
+# Examples:
+#   python rag_client.py ask "What is SSRF? Provide an example of an SSRF attack."
+#   python rag_client.py stats
+#   python rag_client.py load questions.txt --requests 1000 --concurrency 64
+
+# Instructor: Omar Santos @santosomar
+
+import argparse
+import json
+import statistics
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+
+def call(url, path, payload=None, timeout=120):
+    """
+    Sends a request to the service and returns the decoded JSON response.
+
+    :param url: Base URL of the service, e.g., http://127.0.0.1:8765.
+    :param path: "/ask", "/stats" or "/health".
+    :param payload: The JSON body of a POST request, or None for a GET request.
+    :param timeout: Timeout in seconds.
+    """
+    data = json.dumps(payload).encode("utf-8") if payload is not None else None
+    request = urllib.request.Request(
+        url.rstrip("/") + path, data=data, headers={"Content-Type": "application/json"}
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        # Error responses also have a JSON body
+        return json.loads(e.read() or b"{}")
+
+
+def ask(url, question, timeout=120):
+    """Asks the service a question and returns its response dictionary."""
+    return call(url, "/ask", {"question": question}, timeout)
+
+
+def load_questions(path):
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".json"):
+            return json.load(f)
+        return [line.strip() for line in f if line.strip()]
+
+
+def load_test(url, questions, requests=100, concurrency=16, timeout=120):
+    """
+    Sends ``requests`` questions with ``concurrency`` threads and measures them.
+
+    :return: A dictionary with the throughput, client-side latency percentiles and
+        the number of errors and coalesced answers.
+    """
+
+    def timed_ask(question):
+        start = time.perf_counter()
+        try:
+            response = ask(url, question, timeout)
+        except OSError as e:
+            response = {"error": repr(e)}
+        return time.perf_counter() - start, response
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(
+            executor.map(timed_ask, (questions[i % len(questions)] for i in range(requests)))
+        )
+    elapsed = time.perf_counter() - start
+    latencies = sorted(seconds * 1000 for seconds, _ in results)
+
+    def percentile(fraction):
+        return round(latencies[min(int(fraction * len(latencies)), len(latencies) - 1)], 1)
+
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "seconds": round(elapsed, 2),
+        "requests_per_s": round(requests / elapsed, 1),
+        "errors": sum("error" in response for _, response in results),
+        "coalesced": sum(bool(response.get("coalesced")) for _, response in results),
+        "mean_ms": round(statistics.mean(latencies), 1),
+        "p50_ms": percentile(0.50),
+        "p95_ms": percentile(0.95),
+        "p99_ms": percentile(0.99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Client and load tester for rag_service.py.")
+    parser.add_argument("--url", default="http://127.0.0.1:8765")
+    parser.add_argument("--timeout", type=float, default=120)
+    commands = parser.add_subparsers(dest="command", required=True)
+    ask_parser = commands.add_parser("ask", help="Ask one question.")
+    ask_parser.add_argument("question")
+    commands.add_parser("stats", help="Print the counters of the service.")
+    load_parser = commands.add_parser("load", help="Run a load test.")
+    load_parser.add_argument("questions", help="Text file with one question per line, or a JSON list.")
+    load_parser.add_argument("--requests", type=int, default=100)
+    load_parser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args()
+
+    if args.command == "ask":
+        response = ask(args.url, args.question, args.timeout)
+        if "error" in response:
+            print(f"Error: {response['error']}")
+        else:
+            print(response["answer"])
+            print(f"\n({response['latency_ms']:.0f} ms, coalesced: {response['coalesced']})")
+    elif args.command == "stats":
+        print(json.dumps(call(args.url, "/stats", timeout=args.timeout), indent=2))
+    else:
+        report = load_test(
+            args.url, load_questions(args.questions), args.requests, args.concurrency, args.timeout
+        )
+        print(json.dumps(report, indent=2))
+        print("Service:", json.dumps(call(args.url, "/stats", timeout=args.timeout)))
+
+
+if __name__ == "__main__":
+    main()
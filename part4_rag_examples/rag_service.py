@@ -0,0 +1,122 @@
+# This script runs a long-lived local RAG service, so questions are answered by a
+# warm process instead of starting a script for every question.
+#
+# By default it serves the chain of basic_rag_part3.py (through its semantic answer
+# cache): the embeddings client, the vector store and the chain are created once at
+# startup, and one retrieval warms up the store. Questions are answered
+# concurrently, up to --max-concurrency at a time, and identical questions that
+# arrive while one of them is being answered share its execution (see
+# utils/rag_service.py).
+#
+# With --stub, the service runs offline for load testing: a HashingEmbeddings model
+# (utils/local_embeddings.py) over a temporary flat store (utils/flat_index.py) of
+# data/ssrf.txt and data/llm_cheatsheet.md, and a stub LLM that waits
+# --stub-latency-ms and returns a fixed answer. No API key is needed.
+#
+# Examples:
+#   python rag_service.py --port 8765 --max-concurrency 16
+#   python rag_service.py --stub --stub-latency-ms 500
+#   echo '{"id": 1, "question": "What is SSRF?"}' | python rag_service.py --stdio
+#
+# Then, with the client of rag_client.py:
+#   python rag_client.py ask "What is SSRF?"
+#   python rag_client.py load questions.txt --requests 1000 --concurrency 64
+
+# Instructor: Omar Santos @santosomar
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.rag_service import RAGService, serve_http, serve_stdio
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+def build_stub_chain(latency_seconds):
+    """
+    Builds an offline RAG chain: local embeddings, a temporary flat vector store,
+    and a stub LLM that sleeps ``latency_seconds`` and returns a fixed answer.
+    """
+    from langchain_core.runnables import RunnableLambda
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+    from utils.batch_retrieval import BatchRetriever, retrieval_step
+    from utils.flat_index import FlatVectorStore
+    from utils.local_embeddings import HashingEmbeddings
+
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
+    store = FlatVectorStore(
+        tempfile.mkdtemp(prefix="rag_service_stub_"), embedding_function=HashingEmbeddings(size=384)
+    )
+    for name in ("ssrf.txt", "llm_cheatsheet.md"):
+        path = os.path.join(current_dir, "data", name)
+        with open(path, "r", encoding="utf-8") as f:
+            chunks = text_splitter.split_text(f.read())
+        store.add_texts(chunks, metadatas=[{"source": path}] * len(chunks))
+    retriever = BatchRetriever(vector_store=store, k=4)
+
+    def format_docs(docs):
+        return "\n\n".join(doc.page_content for doc in docs)
+
+    def stub_answer(inputs):
+        return f"Stub answer to {inputs['question']!r} from {len(inputs['context'])} characters of context."
+
+    def answer(inputs):
+        time.sleep(latency_seconds)
+        return stub_answer(inputs)
+
+    async def aanswer(inputs):
+        # Async, so waiting for the "LLM" does not hold an executor thread
+        await asyncio.sleep(latency_seconds)
+        return stub_answer(inputs)
+
+    return retrieval_step(retriever, format_docs) | RunnableLambda(answer, afunc=aanswer)
+
+
+def build_chain():
+    """Returns the cached RAG chain of basic_rag_part3.py, with a warmed-up store."""
+    from basic_rag_part3 import cached_rag_chain, retriever
+
+    # The first search loads the index of the store; do it before the first question
+    retriever.invoke("What is SSRF?")
+    return cached_rag_chain
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Serve a RAG chain from a long-lived process.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--stdio", action="store_true", help="Serve JSON lines over stdin/stdout.")
+    parser.add_argument("--max-concurrency", type=int, default=8, help="Concurrent chain executions.")
+    parser.add_argument("--stub", action="store_true", help="Offline embeddings and LLM (load tests).")
+    parser.add_argument("--stub-latency-ms", type=float, default=500, help="Latency of the stub LLM.")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    chain = build_stub_chain(args.stub_latency_ms / 1000) if args.stub else build_chain()
+    # The sync steps of the chain run in the default executor: give it one thread
+    # per concurrent execution
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=args.max_concurrency, thread_name_prefix="rag")
+    )
+    service = RAGService(chain, max_concurrency=args.max_concurrency)
+    # Logs go to stderr, so they do not mix with the responses in --stdio mode
+    print(f"Chain ready in {time.perf_counter() - start:.2f} s", file=sys.stderr)
+
+    if args.stdio:
+        await serve_stdio(service)
+        print(service.stats(), file=sys.stderr)
+    else:
+        await serve_http(service, args.host, args.port)
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,210 @@
+# This script compares the text splitters from text_splitting_deep_dive.py with data
+# instead of eyeballing a single query. For every splitter it reports:
+#
+#   - split throughput (characters and chunks per second) and peak allocated memory
+#   - number of chunks and their token-length distribution
+#   - index size (float32 vectors plus stored text)
+#   - recall@k on a small gold question set (data/splitter_gold_questions.json)
+#     over ssrf.txt, llm_cheatsheet.md and tesla.json
+#
+# Retrieval uses a deterministic local embedder (HashingEmbeddings) and exact cosine
+# search, so the suite runs offline and gives the same numbers on every run. The
+# absolute recall is lower than with a real embedding model, but the comparison
+# between splitters is meaningful. A question counts as a hit when one of the top-k
+# chunks comes from the expected file and contains the expected answer text.
+#
+# Examples:
+#   python splitter_comparison.py
+#   python splitter_comparison.py --k 1 3 5 10 --output splitter_results.json
+
+# Instructor: Omar Santos @santosomar
+
+import argparse
+import json
+import os
+import time
+import tracemalloc
+
+import numpy as np
+
+from utils.benchmarking import environment_info
+from utils.embedding_executor import get_tokenizer
+from utils.local_embeddings import HashingEmbeddings
+from utils.parallel_loader import load_file
+from utils.splitters import splitting_configurations
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+data_dir = os.path.join(current_dir, "data")
+
+corpus_files = [
+    os.path.join(data_dir, "ssrf.txt"),
+    os.path.join(data_dir, "llm_cheatsheet.md"),
+    os.path.join(data_dir, "tesla.json"),
+]
+gold_questions_path = os.path.join(data_dir, "splitter_gold_questions.json")
+
+
+def token_length_stats(chunks, tokenizer):
+    """Returns the distribution of chunk lengths in tokens."""
+    lengths = np.array(
+        [len(tokens) for tokens in tokenizer.encode_ordinary_batch([c.page_content for c in chunks])]
+    )
+    if lengths.size == 0:
+        return {}
+    return {
+        "min": int(lengths.min()),
+        "mean": round(float(lengths.mean()), 1),
+        "p50": int(np.percentile(lengths, 50)),
+        "p90": int(np.percentile(lengths, 90)),
+        "p99": int(np.percentile(lengths, 99)),
+        "max": int(lengths.max()),
+        "total": int(lengths.sum()),
+    }
+
+
+def measure_split(text_splitter, documents, repeats):
+    """
+    Splits the documents ``repeats`` times and keeps the fastest run.
+
+    The peak memory allocated while splitting is measured in an extra run, because
+    tracemalloc slows down every allocation and would distort the timings.
+
+    :return: A tuple ``(chunks, seconds, peak_allocated_bytes)``.
+    """
+    best = float("inf")
+    chunks = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        chunks = text_splitter.split_documents(documents)
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    text_splitter.split_documents(documents)
+    peak_allocated = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return chunks, best, peak_allocated
+
+
+def recall_at_k(chunks, questions, embeddings, ks):
+    """
+    Computes recall@k for each k with exact cosine search over the chunks.
+
+    :return: A tuple ``(recall, misses)`` where recall maps k to the hit rate and
+        misses lists the questions not found within the largest k.
+    """
+    chunk_vectors = np.asarray(
+        embeddings.embed_documents([c.page_content for c in chunks]), dtype=np.float32
+    )
+    query_vectors = np.asarray(
+        embeddings.embed_documents([q["question"] for q in questions]), dtype=np.float32
+    )
+    # The local embedder returns unit vectors, so the dot product is the cosine
+    scores = query_vectors @ chunk_vectors.T
+    max_k = min(max(ks), len(chunks))
+    ranked = np.argsort(-scores, axis=1)[:, :max_k]
+
+    first_hit = []
+    for question, row in zip(questions, ranked):
+        rank = None
+        for position, index in enumerate(row):
+            chunk = chunks[index]
+            source = os.path.basename(chunk.metadata.get("source", ""))
+            if (
+                source == question["source"]
+                and question["answer"].lower() in chunk.page_content.lower()
+            ):
+                rank = position + 1
+                break
+        first_hit.append(rank)
+
+    recall = {
+        f"recall@{k}": round(
+            sum(1 for rank in first_hit if rank is not None and rank <= k) / len(questions), 3
+        )
+        for k in ks
+    }
+    misses = [q["question"] for q, rank in zip(questions, first_hit) if rank is None]
+    return recall, misses
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare text splitters on throughput, chunk statistics and recall@k."
+    )
+    parser.add_argument("--k", type=int, nargs="+", default=[1, 3, 5])
+    parser.add_argument("--repeats", type=int, default=3, help="Split runs per splitter (fastest is kept).")
+    parser.add_argument("--embedding-dim", type=int, default=1024)
+    parser.add_argument("--output", default=os.path.join(current_dir, "splitter_results.json"))
+    args = parser.parse_args()
+
+    documents = [doc for file_path in corpus_files for doc in load_file(file_path)]
+    total_characters = sum(len(doc.page_content) for doc in documents)
+    with open(gold_questions_path, "r", encoding="utf-8") as f:
+        questions = json.load(f)
+
+    tokenizer = get_tokenizer()
+    embeddings = HashingEmbeddings(size=args.embedding_dim)
+    results = {
+        "environment": environment_info(),
+        "arguments": vars(args),
+        "embedding_model": embeddings.model,
+        "corpus_characters": total_characters,
+        "questions": len(questions),
+        "splitters": [],
+    }
+
+    for name, text_splitter in splitting_configurations().items():
+        if isinstance(text_splitter, str):
+            print(f"\n{name}: skipped ({text_splitter})")
+            results["splitters"].append({"splitter": name, "skipped": text_splitter})
+            continue
+
+        chunks, split_seconds, peak_allocated = measure_split(
+            text_splitter, documents, args.repeats
+        )
+        recall, misses = recall_at_k(chunks, questions, embeddings, args.k)
+        text_bytes = sum(len(c.page_content.encode("utf-8")) for c in chunks)
+        result = {
+            "splitter": name,
+            "chunks": len(chunks),
+            "split_seconds": round(split_seconds, 6),
+            "characters_per_second": round(total_characters / split_seconds) if split_seconds else None,
+            "chunks_per_second": round(len(chunks) / split_seconds) if split_seconds else None,
+            "peak_allocated_kb": round(peak_allocated / 1024),
+            "token_lengths": token_length_stats(chunks, tokenizer),
+            # Index size for text-embedding-3-small sized vectors (1536 float32 values)
+            "index_bytes": {
+                "vectors": len(chunks) * 1536 * 4,
+                "text": text_bytes,
+            },
+            **recall,
+            "missed_questions": misses,
+        }
+        results["splitters"].append(result)
+
+    # Print a summary table
+    recall_columns = [f"recall@{k}" for k in args.k]
+    header = f"{'splitter':<30}{'chunks':>8}{'MB/s':>8}{'alloc KB':>10}{'tok p50':>9}{'tok max':>9}{'index KB':>10}"
+    header += "".join(f"{column:>11}" for column in recall_columns)
+    print("\n" + header)
+    for result in results["splitters"]:
+        if "skipped" in result:
+            continue
+        index_kb = sum(result["index_bytes"].values()) / 1024
+        row = (
+            f"{result['splitter']:<30}{result['chunks']:>8}"
+            f"{(result['characters_per_second'] or 0) / 1e6:>8.1f}"
+            f"{result['peak_allocated_kb']:>10}"
+            f"{result['token_lengths'].get('p50', 0):>9}{result['token_lengths'].get('max', 0):>9}"
+            f"{index_kb:>10.0f}"
+        )
+        row += "".join(f"{result[column]:>11.2f}" for column in recall_columns)
+        print(row)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
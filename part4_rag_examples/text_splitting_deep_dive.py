@@ -14,10 +14,18 @@ from langchain.text_splitter import (
     TextSplitter,
     TokenTextSplitter,
 )
+from langchain_chroma import Chroma
 from langchain_community.document_loaders import TextLoader
-from langchain_community.vectorstores import Chroma
 from langchain_openai import OpenAIEmbeddings
 
+from utils.embedding_cache import CachedEmbeddings
+from utils.embedding_executor import EmbeddingExecutor
+from utils.flat_index import open_flat_store
+from utils.hybrid_search import HybridRetriever, open_bm25_index
+from utils.json_records import JSONRecordLoader
+from utils.near_dedup import deduplicate_documents
+from utils.offset_splitter import OffsetTextSplitter, expand_context
+
 # Define the directory containing the text file
 current_dir = os.path.dirname(os.path.abspath(__file__))
 file_path = os.path.join(current_dir, "data", "tesla.json")
@@ -34,9 +42,23 @@ loader = TextLoader(file_path)
 documents = loader.load()
 
 # Define the embedding model
-embeddings = OpenAIEmbeddings(
-    model="text-embedding-3-small"
-)  # Update to a valid embedding model if needed
+# The splitters below produce heavily overlapping chunks of the same file, so the
+# embeddings are wrapped in the shared on-disk cache to avoid paying for the same
+# text more than once.
+# Cache misses are sent in token-packed, concurrent, rate-limited requests with retries.
+executor = EmbeddingExecutor(
+    OpenAIEmbeddings(model="text-embedding-3-small", chunk_size=2048, max_retries=0),
+    max_concurrency=4,
+    requests_per_minute=3000,
+    tokens_per_minute=1_000_000,
+)  # Update to a valid embedding model and your account's rate limits if needed
+embeddings = CachedEmbeddings(executor)
+
+
+# tesla.json is full of near-identical certificate records. When enabled,
+# near-duplicate chunks are collapsed to one representative (MinHash + LSH)
+# before they are embedded, which reduces both embedding cost and index size.
+deduplicate_chunks = True
 
 
 # Function to create and persist vector store
@@ -44,6 +66,12 @@ def create_vector_store(docs, store_name):
     persistent_directory = os.path.join(db_dir, store_name)
     if not os.path.exists(persistent_directory):
         print(f"\n--- Creating vector store {store_name} ---")
+        if deduplicate_chunks:
+            docs, dedup_stats = deduplicate_documents(docs, threshold=0.8)
+            print(
+                f"Near-duplicate removal: {dedup_stats['input_chunks']} -> "
+                f"{dedup_stats['output_chunks']} chunks"
+            )
         db = Chroma.from_documents(
             docs, embeddings, persist_directory=persistent_directory
         )
@@ -102,19 +130,73 @@ custom_splitter = CustomTextSplitter()
 custom_docs = custom_splitter.split_documents(documents)
 create_vector_store(custom_docs, "chroma_db_custom")
 
+# 6. Record-aware JSON Splitting
+# Streams the JSON array record by record (without reading the whole file) and packs
+# whole records into chunks of up to 512 tokens, so no record is ever cut in half.
+# Fields such as issuer_name, name_value and not_after are copied into the metadata.
+# Ideal for structured dumps such as certificate-transparency logs.
+print("\n--- Using Record-aware JSON Splitting ---")
+json_record_loader = JSONRecordLoader(file_path, max_tokens=512)
+json_record_docs = list(json_record_loader.lazy_load())
+create_vector_store(json_record_docs, "chroma_db_json_records")
+
+# 7. Offset-tracking Recursive Splitting
+# Same rules as RecursiveCharacterTextSplitter, but the text is scanned once and every
+# chunk is a (start, end) span of the source, stored as start_index/end_index metadata.
+# The chunks are created without overlap: the context around a retrieved chunk is
+# read from the source at query time instead (see query_vector_store below).
+print("\n--- Using Offset-tracking Recursive Splitting ---")
+offset_splitter = OffsetTextSplitter(chunk_size=1000, chunk_overlap=0)
+offset_docs = offset_splitter.split_documents(documents)
+create_vector_store(offset_docs, "chroma_db_offsets")
+embeddings.print_stats()
+executor.print_stats()
+
+
+# Retrieval backend: "chroma" opens the Chroma store directly. "flat" opens a
+# memory-mapped NumPy copy of it (utils/flat_index.py) that loads in milliseconds
+# and does exact search; the copy is exported from the Chroma store on first use
+# and refreshed whenever the Chroma store changes.
+vector_backend = "chroma"
+
+# Hybrid retrieval: when True, the vector search is combined with a BM25 keyword
+# index (utils/hybrid_search.py) that matches exact tokens such as hostnames, IP
+# addresses and CVE IDs, and both result lists are fused with reciprocal rank
+# fusion. The keyword index is built next to the vector store on first use.
+use_hybrid_search = True
+
+# Metadata filters (e.g., {"source": ...} or {"issuer_name": {"$in": [...]}}) are
+# passed to query_vector_store() as search_filter. The flat store answers them with
+# secondary metadata indexes (utils/metadata_index.py), so only the matching chunks
+# are scored; Chroma applies the same filter syntax itself.
+
 
 # Function to query a vector store
-def query_vector_store(store_name, query):
+def query_vector_store(store_name, query, expand_chars=0, search_filter=None):
     persistent_directory = os.path.join(db_dir, store_name)
     if os.path.exists(persistent_directory):
         print(f"\n--- Querying the Vector Store {store_name} ---")
-        db = Chroma(
-            persist_directory=persistent_directory, embedding_function=embeddings
-        )
-        retriever = db.as_retriever(
-            search_type="similarity_score_threshold",
-            search_kwargs={"k": 1, "score_threshold": 0.1},
-        )
+        if vector_backend == "flat":
+            db = open_flat_store(persistent_directory, embeddings)
+        else:
+            db = Chroma(
+                persist_directory=persistent_directory, embedding_function=embeddings
+            )
+        if use_hybrid_search:
+            retriever = HybridRetriever(
+                vector_store=db,
+                lexical_index=open_bm25_index(persistent_directory, db),
+                k=1,
+                filter=search_filter,
+            )
+        else:
+            search_kwargs = {"k": 1, "score_threshold": 0.1}
+            if search_filter:
+                search_kwargs["filter"] = search_filter
+            retriever = db.as_retriever(
+                search_type="similarity_score_threshold",
+                search_kwargs=search_kwargs,
+            )
         relevant_docs = retriever.invoke(query)
         # Display the relevant results with metadata
         print(f"\n--- Relevant Documents for {store_name} ---")
@@ -122,6 +204,13 @@ def query_vector_store(store_name, query):
             print(f"Document {i}:\n{doc.page_content}\n")
             if doc.metadata:
                 print(f"Source: {doc.metadata.get('source', 'Unknown')}\n")
+            # Widen chunks with known offsets by expand_chars on both sides
+            if expand_chars and "start_index" in doc.metadata:
+                expanded = expand_context(doc, before=expand_chars, after=expand_chars)
+                print(
+                    f"Expanded context ({expanded.metadata['start_index']}-"
+                    f"{expanded.metadata['end_index']}):\n{expanded.page_content}\n"
+                )
     else:
         print(f"Vector store {store_name} does not exist.")
 
@@ -135,3 +224,5 @@ query_vector_store("chroma_db_sent", query)
 query_vector_store("chroma_db_token", query)
 query_vector_store("chroma_db_rec_char", query)
 query_vector_store("chroma_db_custom", query)
+query_vector_store("chroma_db_json_records", query)
+query_vector_store("chroma_db_offsets", query, expand_chars=100)
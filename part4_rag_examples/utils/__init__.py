@@ -0,0 +1 @@
+# Shared helpers used by the RAG example scripts in this directory.
@@ -0,0 +1,360 @@
+# This module provides a semantic answer cache for RAG chains.
+#
+# A RAG chain pays for retrieval and an LLM completion on every question, even when
+# an almost identical question was just answered from the same documents. The
+# semantic cache embeds each incoming question and compares it with the questions
+# answered before. When the most similar one is above a cosine similarity
+# threshold, its stored answer is returned in milliseconds instead of seconds.
+#
+# An answer is only valid for the content it was generated from, so every entry
+# records the content version of the vector store. When the store is re-ingested
+# its version changes and all older entries are dropped on the next lookup. The
+# version is the hash of the ingest manifest of utils/incremental_ingest.py when
+# the store has one (so it only changes when chunks were actually added, changed
+# or removed), otherwise the size and modification time of the store files.
+#
+# Entries are kept in a SQLite file so the cache survives restarts, and are bounded
+# by ``max_entries`` (least recently used entries are evicted first) and an
+# optional time to live.
+
+# Instructor: Omar Santos @santosomar
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from array import array
+
+import numpy as np
+from langchain_core.runnables import RunnableLambda
+
+from utils.embedding_cache import model_id_for, normalize_text
+from utils.flat_index import INDEX_FILENAME, normalize_rows
+from utils.incremental_ingest import MANIFEST_FILENAME
+
+# Default location of the answer cache used by the example scripts
+DEFAULT_ANSWER_CACHE_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "db",
+    "answer_cache.sqlite3",
+)
+
+
+def store_content_version(persist_directory):
+    """
+    Returns a string that changes whenever the content of a vector store changes.
+
+    :param persist_directory: The directory of a Chroma or flat vector store.
+    :return: The SHA-256 of the ingest manifest if the store has one, otherwise a
+        hash of the size and modification time of the store files.
+    """
+    manifest_path = os.path.join(persist_directory, MANIFEST_FILENAME)
+    digest = hashlib.sha256()
+    if os.path.exists(manifest_path):
+        with open(manifest_path, "rb") as f:
+            digest.update(f.read())
+        return "manifest:" + digest.hexdigest()
+    for name in ("chroma.sqlite3", INDEX_FILENAME):
+        path = os.path.join(persist_directory, name)
+        if os.path.exists(path):
+            stat = os.stat(path)
+            digest.update(f"{name}:{stat.st_size}:{stat.st_mtime_ns};".encode("utf-8"))
+    return "files:" + digest.hexdigest()
+
+
+def pipeline_namespace(name="rag", **settings):
+    """
+    Returns a cache namespace that changes whenever the answering pipeline changes.
+
+    An answer depends on more than the store content: the LLM, the prompt, the
+    retrieval and context settings. Passing them all here means that changing any
+    of them starts a new namespace instead of serving answers of the old pipeline.
+
+    Example:
+        pipeline_namespace(llm="gpt-4.1-mini", prompt=prompt_template, use_reranker=False)
+
+    :param name: A readable prefix.
+    :param settings: JSON-serializable settings of the pipeline.
+    :return: ``"<name>:<hash of the settings>"``.
+    """
+    encoded = json.dumps(settings, sort_keys=True, default=str).encode("utf-8")
+    return f"{name}:{hashlib.sha256(encoded).hexdigest()[:16]}"
+
+
+def _percentile_ms(seconds, percentile):
+    return round(float(np.percentile(seconds, percentile)) * 1000, 3) if seconds else None
+
+
+class SemanticAnswerCache:
+    """
+    Caches the answers of a chain by question similarity and store content version.
+
+    Example:
+        answer_cache = SemanticAnswerCache(
+            embeddings, version_fn=lambda: store_content_version(persistent_directory)
+        )
+        cached_chain = answer_cache.wrap(rag_chain)
+        cached_chain.invoke("What is SSRF?")
+        answer_cache.print_stats()
+    """
+
+    def __init__(
+        self,
+        embeddings,
+        version_fn,
+        path=DEFAULT_ANSWER_CACHE_PATH,
+        similarity_threshold=0.95,
+        max_entries=1000,
+        ttl_seconds=None,
+        namespace="default",
+    ):
+        """
+        :param embeddings: The LangChain Embeddings used to embed the questions.
+            Reusing the retriever's embeddings (behind utils/query_cache.py) means a
+            cache miss does not embed the question twice.
+        :param version_fn: A function returning the current content version of the
+            vector store (e.g., store_content_version()).
+        :param path: Location of the SQLite file.
+        :param similarity_threshold: Minimum cosine similarity between a new and a
+            cached question. Keep it high: "SSRF on AWS" and "SSRF on Azure" are
+            similar questions with different answers.
+        :param max_entries: Maximum number of cached answers (LRU eviction).
+        :param ttl_seconds: Optional lifetime of an answer, regardless of version.
+        :param namespace: Separates the answers of different chains or prompts that
+            share one cache file. Use pipeline_namespace() so that answers are not
+            reused after the LLM, the prompt or the retrieval settings change.
+        """
+        self.embeddings = embeddings
+        self.version_fn = version_fn
+        self.similarity_threshold = similarity_threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        # Vectors of different embedding models are not comparable
+        self.namespace = f"{namespace}:{model_id_for(embeddings)}"
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+        self._hit_seconds = []
+        self._miss_seconds = []
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS answers (
+                id INTEGER PRIMARY KEY,
+                namespace TEXT NOT NULL,
+                version TEXT NOT NULL,
+                question TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                answer TEXT NOT NULL,
+                created REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_answers_ns ON answers (namespace)")
+        self._conn.commit()
+        # In-memory copy of the current version's entries: IDs and unit vectors
+        self._version = None
+        self._ids = []
+        self._vectors = None
+
+    def _load(self, version):
+        # Drops the entries of other versions and loads the current ones
+        deleted = self._conn.execute(
+            "DELETE FROM answers WHERE namespace = ? AND version != ?", (self.namespace, version)
+        ).rowcount
+        if self.ttl_seconds is not None:
+            deleted += self._conn.execute(
+                "DELETE FROM answers WHERE namespace = ? AND created < ?",
+                (self.namespace, time.time() - self.ttl_seconds),
+            ).rowcount
+        self._conn.commit()
+        self.invalidations += deleted
+        rows = self._conn.execute(
+            "SELECT id, vector FROM answers WHERE namespace = ? ORDER BY id", (self.namespace,)
+        ).fetchall()
+        self._version = version
+        self._ids = [row[0] for row in rows]
+        self._vectors = (
+            np.vstack([np.frombuffer(row[1], dtype=np.float32) for row in rows]) if rows else None
+        )
+
+    def lookup(self, question, question_vector=None):
+        """
+        Returns the cached answer of the most similar question, or None.
+
+        :param question: The incoming question.
+        :param question_vector: The question embedding, if already computed.
+        :return: A tuple ``(answer, similarity, cached_question)`` or None.
+        """
+        version = self.version_fn()
+        if question_vector is None:
+            question_vector = self.embeddings.embed_query(normalize_text(question))
+        query = normalize_rows(np.atleast_2d(question_vector))[0]
+        with self._lock:
+            if version != self._version:
+                self._load(version)
+            if self._vectors is None:
+                return None
+            similarities = self._vectors @ query
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.similarity_threshold:
+                return None
+            row = self._conn.execute(
+                "SELECT answer, question, created FROM answers WHERE id = ?", (self._ids[best],)
+            ).fetchone()
+            if row is None:
+                # Removed by another process; reload on the next lookup
+                self._version = None
+                return None
+            if self.ttl_seconds is not None and row[2] < time.time() - self.ttl_seconds:
+                self._version = None
+                return None
+            self._conn.execute(
+                "UPDATE answers SET last_access = ? WHERE id = ?", (time.time(), self._ids[best])
+            )
+            self._conn.commit()
+            return row[0], float(similarities[best]), row[1]
+
+    def store(self, question, answer, question_vector=None, version=None):
+        """
+        Stores an answer for the current (or given) store version.
+
+        :param question: The question that was answered.
+        :param answer: The answer text.
+        :param question_vector: The question embedding, if already computed.
+        :param version: The content version the answer was generated from. The
+            answer is not stored if the store has changed since.
+        """
+        current_version = self.version_fn()
+        if version is not None and version != current_version:
+            return
+        version = current_version
+        if question_vector is None:
+            question_vector = self.embeddings.embed_query(normalize_text(question))
+        vector = normalize_rows(np.atleast_2d(question_vector))[0]
+        now = time.time()
+        with self._lock:
+            if version != self._version:
+                self._load(version)
+            cursor = self._conn.execute(
+                "INSERT INTO answers (namespace, version, question, vector, answer, created, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (self.namespace, version, question, array("f", vector).tobytes(), answer, now, now),
+            )
+            self._ids.append(cursor.lastrowid)
+            self._vectors = vector[None, :] if self._vectors is None else np.vstack([self._vectors, vector])
+            if len(self._ids) > self.max_entries:
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        # Removes the least recently used entries down to 90% of max_entries
+        excess = len(self._ids) - int(self.max_entries * 0.9)
+        victims = [
+            row[0]
+            for row in self._conn.execute(
+                "SELECT id FROM answers WHERE namespace = ? ORDER BY last_access LIMIT ?",
+                (self.namespace, excess),
+            ).fetchall()
+        ]
+        self._conn.executemany("DELETE FROM answers WHERE id = ?", [(i,) for i in victims])
+        self.evictions += len(victims)
+        victims = set(victims)
+        keep = np.array([i not in victims for i in self._ids])
+        self._ids = [i for i, kept in zip(self._ids, keep) if kept]
+        self._vectors = self._vectors[keep] if self._ids else None
+
+    def invoke(self, chain, question, **kwargs):
+        """
+        Answers a question from the cache or, on a miss, with the chain.
+
+        The store version is read before the chain runs, so an answer generated
+        while the store was being re-ingested is not stored.
+
+        :param chain: A runnable that maps the question to an answer string.
+        :param question: The question.
+        :param kwargs: Passed to chain.invoke().
+        :return: The answer.
+        """
+        start = time.perf_counter()
+        version = self.version_fn()
+        question_vector = self.embeddings.embed_query(normalize_text(question))
+        cached = self.lookup(question, question_vector)
+        if cached is not None:
+            self.record(True, time.perf_counter() - start)
+            return cached[0]
+
+        answer = chain.invoke(question, **kwargs)
+        self.store(question, answer, question_vector, version)
+        self.record(False, time.perf_counter() - start)
+        return answer
+
+    def record(self, hit, seconds):
+        """
+        Counts a hit or a miss and its latency, for callers that use lookup() and
+        store() directly (e.g., utils/streaming_rag.py).
+        """
+        with self._lock:
+            if hit:
+                self.hits += 1
+                self._hit_seconds.append(seconds)
+            else:
+                self.misses += 1
+                self._miss_seconds.append(seconds)
+
+    def wrap(self, chain):
+        """
+        Returns a runnable that answers through the cache, for use in place of the
+        chain (e.g., ``answer_cache.wrap(rag_chain).invoke(question)``).
+        """
+        return RunnableLambda(lambda question: self.invoke(chain, question))
+
+    def clear(self):
+        """Removes all answers of this cache's namespace."""
+        with self._lock:
+            self._conn.execute("DELETE FROM answers WHERE namespace = ?", (self.namespace,))
+            self._conn.commit()
+            self._version = None
+
+    def stats(self):
+        """
+        Returns hit counters and the p50 latency of hits and misses.
+
+        :return: A dictionary with hits, misses, hit rate, invalidated and evicted
+            entries, the number of cached answers, and latencies in milliseconds.
+        """
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "invalidations": self.invalidations,
+                "evictions": self.evictions,
+                "entries": len(self._ids),
+                "hit_p50_ms": _percentile_ms(self._hit_seconds, 50),
+                "miss_p50_ms": _percentile_ms(self._miss_seconds, 50),
+            }
+
+    def print_stats(self):
+        stats = self.stats()
+        latency = ""
+        if stats["hit_p50_ms"] is not None:
+            latency += f", hit p50 {stats['hit_p50_ms']:.1f} ms"
+        if stats["miss_p50_ms"] is not None:
+            latency += f", miss p50 {stats['miss_p50_ms']:.1f} ms"
+        print(
+            f"Answer cache: {stats['hits']} hits, {stats['misses']} misses "
+            f"({stats['hit_rate']:.0%} hit rate), {stats['entries']} cached answers{latency}"
+        )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,222 @@
+# This module provides batch retrieval: many questions are answered with one
+# embedding request and one batched search, instead of one round-trip of each per
+# question.
+#
+# Calling retriever.invoke() in a loop over thousands of questions (e.g., a nightly
+# job) pays an embedding API call and a separate search per question. BatchRetriever
+# embeds all questions with a single embed_documents() call (OpenAIEmbeddings packs
+# up to ``chunk_size`` texts per request), then searches with the batch API of the
+# store:
+#
+#   FlatVectorStore, HNSWVectorStore, QuantizedVectorStore
+#          - similarity_search_with_score_by_vectors(): one matrix product (or one
+#            graph query) for a block of questions.
+#   Chroma - collection.query() with all query embeddings in one call.
+#   others - one similarity_search_with_score_by_vector() call per question.
+#
+# BatchRetriever is a regular LangChain retriever, and its batch() method retrieves
+# all inputs at once. Because RunnableParallel (the {"context": ..., "question": ...}
+# step of a RAG chain) runs its inputs one by one, retrieval_step() provides the
+# first step of a chain whose batch() keeps the retrieval batched.
+#
+# With search_type="mmr", fetch_k candidates are fetched per query (with their
+# vectors) and k diverse ones are selected with the MMR of utils/mmr.py, after the
+# score threshold has been applied to the pool.
+
+# Instructor: Omar Santos @santosomar
+
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.runnables import Runnable
+from langchain_core.vectorstores import VectorStore
+
+from utils.mmr import maximal_marginal_relevance
+
+
+class BatchRetriever(BaseRetriever):
+    """
+    A retriever that embeds and searches many queries at once.
+
+    Example:
+        retriever = BatchRetriever(vector_store=db, k=5, score_threshold=0.5)
+        results = retriever.retrieve_batch(questions)  # [[(Document, score), ...], ...]
+        documents = retriever.batch(questions)          # [[Document, ...], ...]
+    """
+
+    vector_store: VectorStore
+    k: int = 4
+    # Minimum relevance score (0 to 1, higher is more similar), as in the
+    # "similarity_score_threshold" search type of as_retriever()
+    score_threshold: float | None = None
+    # Embed all queries with one embed_documents() call. Set to False for models
+    # that embed queries differently from documents (e.g., with an instruction prefix)
+    batch_embed: bool = True
+    # Number of queries searched at a time (bounds the size of the score matrix)
+    search_batch_size: int = 256
+    # Optional metadata filter applied to every query (see utils/metadata_index.py)
+    filter: dict | None = None
+    # "similarity" returns the k most similar chunks; "mmr" selects k diverse chunks
+    # from the fetch_k most similar ones with maximal marginal relevance
+    search_type: str = "similarity"
+    fetch_k: int = 20
+    # MMR trade-off: 1 ranks by relevance only, 0 by diversity only
+    lambda_mult: float = 0.5
+
+    model_config = {"arbitrary_types_allowed": True}
+
+    def embed_queries(self, queries):
+        """Embeds the queries with as few embedding requests as possible."""
+        embeddings = self.vector_store.embeddings
+        if not self.batch_embed:
+            return [embeddings.embed_query(query) for query in queries]
+        if hasattr(embeddings, "embed_queries"):
+            # e.g., utils/query_cache.py, which only sends the uncached queries
+            return embeddings.embed_queries(queries)
+        return embeddings.embed_documents(queries)
+
+    def _search(self, vectors, k, with_vectors=False):
+        # Returns one list of (Document, distance) pairs per query vector, or of
+        # (Document, distance, vector) triples with with_vectors
+        store = self.vector_store
+        filter_kwargs = {"filter": self.filter} if self.filter else {}
+        if with_vectors and hasattr(store, "similarity_search_with_vectors"):
+            return store.similarity_search_with_vectors(vectors, k=k, **filter_kwargs)
+        if not with_vectors and hasattr(store, "similarity_search_with_score_by_vectors"):
+            return store.similarity_search_with_score_by_vectors(vectors, k=k, **filter_kwargs)
+        if hasattr(store, "_collection"):
+            include = ["documents", "metadatas", "distances"]
+            data = store._collection.query(
+                query_embeddings=np.asarray(vectors, dtype=np.float32),
+                n_results=k,
+                where=self.filter or None,
+                include=include + ["embeddings"] if with_vectors else include,
+            )
+            rows = zip(data["ids"], data["documents"], data["metadatas"], data["distances"])
+            results = [
+                [
+                    (Document(id=chunk_id, page_content=text, metadata=metadata or {}), distance)
+                    for chunk_id, text, metadata, distance in zip(*row)
+                ]
+                for row in rows
+            ]
+            if with_vectors:
+                results = [
+                    [(document, distance, vector) for (document, distance), vector in zip(hits, row)]
+                    for hits, row in zip(results, data["embeddings"])
+                ]
+            return results
+        results = [
+            store.similarity_search_with_score_by_vector(vector, k=k, **filter_kwargs)
+            for vector in vectors
+        ]
+        if with_vectors:
+            # The store cannot return its vectors, so the candidates are embedded again
+            results = [
+                [
+                    (document, distance, vector)
+                    for (document, distance), vector in zip(
+                        hits, store.embeddings.embed_documents([d.page_content for d, _ in hits])
+                    )
+                ]
+                for hits in results
+            ]
+        return results
+
+    def retrieve_batch(self, queries):
+        """
+        Retrieves the top-k chunks of every query.
+
+        Repeated queries are embedded and searched only once.
+
+        :param queries: A list of query strings.
+        :return: One list of ``(Document, relevance_score)`` pairs per query, best
+            first (in MMR selection order with search_type="mmr"), filtered by
+            ``score_threshold``.
+        """
+        if self.search_type not in ("similarity", "mmr"):
+            raise ValueError(f"Unknown search_type {self.search_type!r}; use 'similarity' or 'mmr'.")
+        unique = list(dict.fromkeys(queries))
+        if not unique:
+            return []
+        vectors = self.embed_queries(unique)
+        relevance = self.vector_store._select_relevance_score_fn()
+        mmr = self.search_type == "mmr"
+
+        results = {}
+        for start in range(0, len(unique), self.search_batch_size):
+            batch = unique[start:start + self.search_batch_size]
+            batch_vectors = vectors[start:start + len(batch)]
+            hits = self._search(batch_vectors, max(self.k, self.fetch_k) if mmr else self.k, mmr)
+            for query, query_vector, query_hits in zip(batch, batch_vectors, hits):
+                # (Document, relevance, vector or None) triples
+                scored = [(hit[0], relevance(hit[1]), hit[2] if mmr else None) for hit in query_hits]
+                if self.score_threshold is not None:
+                    scored = [hit for hit in scored if hit[1] >= self.score_threshold]
+                if mmr and scored:
+                    selected = maximal_marginal_relevance(
+                        query_vector,
+                        np.asarray([vector for _, _, vector in scored], dtype=np.float32),
+                        self.lambda_mult,
+                        self.k,
+                    )
+                    scored = [scored[i] for i in selected]
+                results[query] = [(document, score) for document, score, _ in scored]
+        return [results[query] for query in queries]
+
+    def _get_relevant_documents(self, query, *, run_manager: CallbackManagerForRetrieverRun):
+        return [document for document, _ in self.retrieve_batch([query])[0]]
+
+    def batch(self, inputs, config=None, *, return_exceptions=False, **kwargs):
+        """Retrieves the documents of all inputs with one embedding request and one search."""
+        if not inputs:
+            return []
+        try:
+            results = self.retrieve_batch(list(inputs))
+        except Exception as e:
+            if return_exceptions:
+                return [e] * len(inputs)
+            raise
+        return [[document for document, _ in hits] for hits in results]
+
+
+class RetrievalStep(Runnable):
+    """
+    Maps a question to ``{"context": ..., "question": question}`` with a
+    BatchRetriever, so that chain.batch() retrieves all questions at once.
+    """
+
+    def __init__(self, retriever, format_fn, context_key="context", question_key="question"):
+        self.retriever = retriever
+        self.format_fn = format_fn
+        self.context_key = context_key
+        self.question_key = question_key
+
+    def invoke(self, input, config=None, **kwargs):
+        return self.batch([input], config)[0]
+
+    def batch(self, inputs, config=None, *, return_exceptions=False, **kwargs):
+        documents = self.retriever.batch(inputs, config, return_exceptions=return_exceptions)
+        return [
+            docs if isinstance(docs, Exception)
+            else {self.context_key: self.format_fn(docs), self.question_key: question}
+            for question, docs in zip(inputs, documents)
+        ]
+
+
+def retrieval_step(retriever, format_fn, context_key="context", question_key="question"):
+    """
+    Returns the first step of a RAG chain that turns a question into the prompt
+    variables, retrieving a whole batch of questions at once in chain.batch().
+
+    Example:
+        rag_chain = retrieval_step(retriever, format_docs) | prompt | llm | StrOutputParser()
+        answers = rag_chain.batch(questions, config={"max_concurrency": 8})
+
+    :param retriever: A BatchRetriever.
+    :param format_fn: Turns the list of retrieved documents into the context string.
+    :param context_key: Name of the context variable of the prompt.
+    :param question_key: Name of the question variable of the prompt.
+    """
+    return RetrievalStep(retriever, format_fn, context_key, question_key)
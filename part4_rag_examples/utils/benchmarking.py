@@ -0,0 +1,101 @@
+# This module contains small helpers to time the stages of an ingestion or retrieval
+# flow and to measure their peak memory (resident set size, RSS). A background thread
+# samples the RSS of the process while a stage runs, so every stage gets its own peak
+# instead of the process-wide maximum reported by the operating system.
+
+# Instructor: Omar Santos @santosomar
+
+import os
+import platform
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def current_rss_bytes():
+    """
+    Returns the current resident set size of the process in bytes.
+
+    Reads /proc/self/statm on Linux. On other platforms the peak RSS reported by
+    ``getrusage`` is returned instead (or 0 when it is not available).
+    """
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        if resource is None:
+            return 0
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+class StageTimer:
+    """
+    Measures the wall time and peak RSS of a block of code.
+
+    Example:
+        with StageTimer("split") as stage:
+            chunks = splitter.split_documents(documents)
+        stage.items = len(chunks)
+        print(stage.as_dict())
+    """
+
+    def __init__(self, name, sample_interval=0.005):
+        self.name = name
+        self.sample_interval = sample_interval
+        self.items = 0
+        self.wall_seconds = 0.0
+        self.start_rss = 0
+        self.peak_rss = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        while not self._stop.wait(self.sample_interval):
+            self.peak_rss = max(self.peak_rss, current_rss_bytes())
+
+    def __enter__(self):
+        self.start_rss = self.peak_rss = current_rss_bytes()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.wall_seconds = time.perf_counter() - self._start
+        self._stop.set()
+        self._thread.join()
+        self.peak_rss = max(self.peak_rss, current_rss_bytes())
+        return False
+
+    def as_dict(self):
+        return {
+            "stage": self.name,
+            "items": self.items,
+            "wall_seconds": round(self.wall_seconds, 6),
+            "items_per_second": (
+                round(self.items / self.wall_seconds, 2) if self.wall_seconds else None
+            ),
+            "peak_rss_mb": round(self.peak_rss / (1024 * 1024), 2),
+            "rss_growth_mb": round((self.peak_rss - self.start_rss) / (1024 * 1024), 2),
+        }
+
+
+def environment_info():
+    """Returns information about the machine, to store next to benchmark results."""
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
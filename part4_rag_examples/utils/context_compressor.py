@@ -0,0 +1,268 @@
+# This module compresses the retrieved chunks before generation: only the sentences
+# that match the question (and their neighbours) are kept.
+#
+# Chunks are about 1000 characters, and usually only a few of their sentences are
+# relevant to the question; the others still cost prompt tokens, which are billed
+# and slow down the LLM. ExtractiveCompressor:
+#
+#   1. Splits every chunk into sentences (and lines, for lists and tables).
+#   2. Embeds the question and the sentences and scores each sentence by its
+#      cosine similarity with the question. No LLM is called. Use the embedding
+#      model of the pipeline behind CachedEmbeddings (utils/embedding_cache.py),
+#      so each sentence of the corpus is embedded once and then read from the local
+#      cache, and behind QueryEmbeddingCache (utils/query_cache.py), so the
+#      question vector computed by the retriever is reused. A local sentence model
+#      (e.g., HuggingFaceEmbeddings) works too. HashingEmbeddings only measures
+#      word overlap and is meant for offline tests, not for real answers.
+#   3. Keeps the best sentences across all chunks, each with ``neighbours``
+#      sentences on both sides for context, until ``ratio`` of the original tokens
+#      (or ``max_tokens``) is reached. A sentence repeated in two chunks (e.g., in
+#      the overlap of neighbouring chunks) is kept once.
+#   4. Returns the chunks with their kept sentences in the original order, gaps
+#      marked with " ... ". Chunks without any kept sentence are dropped.
+#
+# CompressingRetriever puts the compressor behind any retriever, like
+# RerankingRetriever does with the reranker (utils/reranker.py).
+
+# Instructor: Omar Santos @santosomar
+
+import re
+import threading
+import time
+
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from utils.embedding_cache import model_id_for
+
+# A sentence ends with . ! or ? followed by whitespace; lines are split too
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+|\n+")
+
+
+def split_sentences(text):
+    """Splits a text into sentences and lines, without empty pieces."""
+    return [sentence.strip() for sentence in _SENTENCE_END.split(text) if sentence.strip()]
+
+
+class ExtractiveCompressor:
+    """
+    Keeps the sentences of the retrieved chunks that best match the question.
+
+    Example:
+        compressor = ExtractiveCompressor(
+            CachedEmbeddings(query_embeddings), ratio=0.5, neighbours=1
+        )
+        documents = compressor.compress_documents(documents, "What is SSRF?")
+        compressor.print_stats()
+    """
+
+    def __init__(
+        self,
+        embeddings,
+        ratio=0.5,
+        max_tokens=None,
+        neighbours=1,
+        model_name=None,
+        tokenizer=None,
+    ):
+        """
+        :param embeddings: The LangChain Embeddings used for the question and the
+            sentences, e.g., the query embeddings of the pipeline behind
+            CachedEmbeddings (see the module comment).
+        :param ratio: Fraction of the tokens of the chunks to keep.
+        :param max_tokens: Optional maximum number of tokens kept over all chunks.
+        :param neighbours: Number of sentences kept before and after each selected
+            sentence.
+        :param model_name: Model whose tiktoken encoding counts the tokens (defaults
+            to cl100k_base).
+        :param tokenizer: A tiktoken Encoding to use instead of model_name.
+        """
+        self.embeddings = embeddings
+        self.model_id = model_id_for(embeddings)
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.neighbours = neighbours
+        self.model_name = model_name
+        self._tokenizer = tokenizer
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self._latencies = []
+
+    @property
+    def tokenizer(self):
+        if self._tokenizer is None:
+            # Imported lazily, like in utils/context_packer.py
+            from utils.embedding_executor import get_tokenizer
+
+            self._tokenizer = get_tokenizer(self.model_name)
+        return self._tokenizer
+
+    def _select(self, sentences, tokens, owners, scores, budget):
+        # Picks sentences best first, each with its neighbours in the same chunk,
+        # within the token budget. Returns the set of kept sentence indices.
+        kept, seen_texts, used = set(), set(), 0
+        for index in np.argsort(-scores, kind="stable"):
+            index = int(index)
+            if index in kept or sentences[index] in seen_texts:
+                continue
+            window = [
+                i
+                for i in range(index - self.neighbours, index + self.neighbours + 1)
+                if 0 <= i < len(sentences)
+                and owners[i] == owners[index]
+                and i not in kept
+                and sentences[i] not in seen_texts
+            ]
+            cost = sum(tokens[i] for i in window)
+            if used + cost > budget:
+                # Without its neighbours, the sentence itself may still fit
+                window, cost = [index], tokens[index]
+            if used + cost > budget and kept:
+                continue
+            kept.update(window)
+            seen_texts.update(sentences[i] for i in window)
+            used += cost
+            if used >= budget:
+                break
+        return kept
+
+    def _compress(self, documents, query):
+        # Returns (position in documents, compressed Document) pairs
+        start = time.perf_counter()
+        sentences, owners = [], []
+        for position, document in enumerate(documents):
+            for sentence in split_sentences(document.page_content):
+                sentences.append(sentence)
+                owners.append(position)
+        if not sentences:
+            return list(enumerate(documents))
+
+        tokens = [len(self.tokenizer.encode_ordinary(sentence)) for sentence in sentences]
+        total = sum(tokens)
+        budget = total * self.ratio
+        if self.max_tokens is not None:
+            budget = min(budget, self.max_tokens)
+
+        vectors = np.asarray(self.embeddings.embed_documents(sentences), dtype=np.float32)
+        query_vector = np.asarray(self.embeddings.embed_query(query), dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1) * (np.linalg.norm(query_vector) or 1.0)
+        norms[norms == 0] = 1.0
+        kept = self._select(sentences, tokens, owners, (vectors @ query_vector) / norms, budget)
+
+        compressed = []
+        for position, document in enumerate(documents):
+            indices = [i for i in range(len(sentences)) if owners[i] == position]
+            if not any(i in kept for i in indices):
+                continue
+            # Consecutive kept sentences are joined with a space, gaps with " ... "
+            parts, previous = [], None
+            for i in indices:
+                if i in kept:
+                    if previous is not None and i != previous + 1:
+                        parts.append("...")
+                    parts.append(sentences[i])
+                    previous = i
+            compressed.append(
+                (
+                    position,
+                    Document(
+                        id=document.id,
+                        page_content=" ".join(parts),
+                        metadata={
+                            **document.metadata,
+                            "compressed_from": sum(tokens[i] for i in indices),
+                            "compressed_to": sum(tokens[i] for i in indices if i in kept),
+                        },
+                    ),
+                )
+            )
+        with self._lock:
+            self.calls += 1
+            self.input_tokens += total
+            self.output_tokens += sum(tokens[i] for i in kept)
+            self._latencies.append(time.perf_counter() - start)
+            del self._latencies[:-1000]
+        return compressed
+
+    def compress_documents(self, documents, query):
+        """
+        Compresses the documents for a question (see the module comment).
+
+        :param documents: The retrieved documents, best first.
+        :param query: The question.
+        :return: The compressed documents, in the same order. Each one has the
+            ``compressed_from`` and ``compressed_to`` token counts in its metadata.
+        """
+        return [document for _, document in self._compress(list(documents), query)]
+
+    def stats(self):
+        """Returns the tokens before and after compression and the p50 latency."""
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "input_tokens": self.input_tokens,
+                "output_tokens": self.output_tokens,
+                "kept_ratio": round(self.output_tokens / self.input_tokens, 4) if self.input_tokens else 0.0,
+                "p50_ms": (
+                    round(float(np.percentile(self._latencies, 50)) * 1000, 3)
+                    if self._latencies
+                    else None
+                ),
+            }
+
+    def print_stats(self):
+        stats = self.stats()
+        print(
+            f"Context compression: {stats['calls']} questions, {stats['input_tokens']} -> "
+            f"{stats['output_tokens']} tokens ({stats['kept_ratio']:.0%} kept), "
+            f"p50 {stats['p50_ms']} ms"
+        )
+
+
+class CompressingRetriever(BaseRetriever):
+    """
+    A retriever that compresses the results of another retriever with an
+    ExtractiveCompressor.
+
+    Example:
+        retriever = CompressingRetriever(
+            retriever=db.as_retriever(search_kwargs={"k": 3}),
+            compressor=ExtractiveCompressor(CachedEmbeddings(embeddings), ratio=0.5),
+        )
+        retriever.invoke("What is SSRF?")
+    """
+
+    retriever: BaseRetriever
+    compressor: ExtractiveCompressor
+
+    model_config = {"arbitrary_types_allowed": True}
+
+    def _get_relevant_documents(self, query, *, run_manager: CallbackManagerForRetrieverRun):
+        return self.compressor.compress_documents(self.retriever.invoke(query), query)
+
+    def batch(self, inputs, config=None, *, return_exceptions=False, **kwargs):
+        """Retrieves the documents of all inputs at once, then compresses them."""
+        if not inputs:
+            return []
+        inputs = list(inputs)
+        results = self.retriever.batch(inputs, config, return_exceptions=return_exceptions)
+        return [
+            documents if isinstance(documents, Exception)
+            else self.compressor.compress_documents(documents, query)
+            for query, documents in zip(inputs, results)
+        ]
+
+    def retrieve_batch(self, queries):
+        """
+        Like BatchRetriever.retrieve_batch(): one list of ``(Document, score)`` pairs
+        per query, with the compressed documents and the scores of the retriever.
+        """
+        results = []
+        for query, hits in zip(queries, self.retriever.retrieve_batch(queries)):
+            compressed = self.compressor._compress([d for d, _ in hits], query)
+            results.append([(document, hits[position][1]) for position, document in compressed])
+        return results
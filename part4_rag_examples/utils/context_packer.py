@@ -0,0 +1,217 @@
+# This module assembles the context of a RAG prompt from the retrieved chunks,
+# replacing the usual format_docs() that joins every page_content.
+#
+# Chunks are ingested with an overlap (e.g., chunk_overlap=100), so two retrieved
+# chunks that are neighbours in the same file repeat the same text in the prompt,
+# and nothing limits the size of the context. ContextPacker:
+#
+#   1. Merges overlapping or adjacent chunks of the same source into one passage:
+#      by their offsets in the source ("start_index"/"end_index", as recorded by
+#      utils/offset_splitter.py), or else by finding the end of one chunk at the
+#      start of the other (text overlap). Chunks contained in another are dropped.
+#   2. Counts the tokens of every passage with tiktoken.
+#   3. Packs the passages in retrieval order (best first, as ranked by the
+#      retriever or the reranker) into a token budget: a passage that does not fit
+#      is skipped and smaller ones after it may still be added. If even the best
+#      passage does not fit, it is cut at the budget.
+#
+# stats() reports the tokens a plain join would have sent, the tokens sent, and how
+# many were saved by merging overlaps and by the budget. Prompt tokens are billed
+# and make up a large share of the LLM latency.
+
+# Instructor: Omar Santos @santosomar
+
+import threading
+
+
+def _text_overlap(first, second, min_overlap):
+    # Returns the length of the longest suffix of first that is a prefix of second
+    # (at least min_overlap characters), or 0
+    if min(len(first), len(second)) < min_overlap:
+        return 0
+    anchor = second[:min_overlap]
+    position = first.find(anchor, max(0, len(first) - len(second)))
+    while position != -1:
+        if second.startswith(first[position:]):
+            return len(first) - position
+        position = first.find(anchor, position + 1)
+    return 0
+
+
+class _Passage:
+    """One or more merged chunks of the same source."""
+
+    def __init__(self, document, rank):
+        self.source = document.metadata.get("source")
+        self.text = document.page_content
+        self.rank = rank
+        start, end = document.metadata.get("start_index"), document.metadata.get("end_index")
+        # Offsets are only used when they describe the text (end - start == length)
+        if isinstance(start, int) and isinstance(end, int) and end - start == len(self.text):
+            self.start, self.end = start, end
+        else:
+            self.start = self.end = None
+
+    def merge(self, other, min_overlap):
+        """Merges another passage of the same source into this one, if they overlap."""
+        if self.source is None or other.source != self.source:
+            return False
+        if self.start is not None and other.start is not None:
+            first, second = (self, other) if self.start <= other.start else (other, self)
+            if second.start > first.end:
+                return False
+            text = first.text + second.text[first.end - second.start:]
+            self.start, self.end, self.text = first.start, max(first.end, second.end), text
+        elif other.text in self.text:
+            pass
+        elif self.text in other.text:
+            self.text, self.start, self.end = other.text, other.start, other.end
+        else:
+            overlap = _text_overlap(self.text, other.text, min_overlap)
+            if overlap:
+                self.text += other.text[overlap:]
+            else:
+                overlap = _text_overlap(other.text, self.text, min_overlap)
+                if not overlap:
+                    return False
+                self.text = other.text + self.text[overlap:]
+            self.start = self.end = None
+        self.rank = min(self.rank, other.rank)
+        return True
+
+
+class ContextPacker:
+    """
+    Builds a deduplicated, token-budgeted context string from retrieved documents.
+
+    Example:
+        context_packer = ContextPacker(max_tokens=2000)
+        rag_chain = retrieval_step(retriever, context_packer) | prompt | llm | StrOutputParser()
+        context_packer.print_stats()
+    """
+
+    def __init__(
+        self, max_tokens=2000, model_name=None, separator="\n\n", min_overlap=20, tokenizer=None
+    ):
+        """
+        :param max_tokens: Token budget of the context.
+        :param model_name: Model whose tiktoken encoding counts the tokens (defaults
+            to cl100k_base).
+        :param separator: Text placed between passages.
+        :param min_overlap: Minimum number of characters for a text overlap between
+            two chunks without offsets to be merged.
+        :param tokenizer: A tiktoken Encoding to use instead of model_name.
+        """
+        self.max_tokens = max_tokens
+        self.model_name = model_name
+        self.separator = separator
+        self.min_overlap = min_overlap
+        self._tokenizer = tokenizer
+        self._lock = threading.Lock()
+        self.contexts = 0
+        self.input_chunks = 0
+        self.output_passages = 0
+        self.plain_tokens = 0
+        self.packed_tokens = 0
+        self.overlap_saved_tokens = 0
+        self.budget_saved_tokens = 0
+
+    @property
+    def tokenizer(self):
+        if self._tokenizer is None:
+            # Imported lazily, like in utils/json_records.py
+            from utils.embedding_executor import get_tokenizer
+
+            self._tokenizer = get_tokenizer(self.model_name)
+        return self._tokenizer
+
+    def count_tokens(self, text):
+        return len(self.tokenizer.encode_ordinary(text))
+
+    def merge(self, docs):
+        """
+        Merges the overlapping chunks of the same source.
+
+        :param docs: The retrieved documents, best first.
+        :return: The merged passage texts, best first.
+        """
+        passages = []
+        for rank, document in enumerate(docs):
+            passage = _Passage(document, rank)
+            # Merging can make a passage reach another one, so repeat until stable
+            merged = True
+            while merged:
+                merged = False
+                for other in passages:
+                    if other.merge(passage, self.min_overlap):
+                        passages.remove(other)
+                        passage = other
+                        merged = True
+                        break
+            passages.append(passage)
+        return [passage.text for passage in sorted(passages, key=lambda p: p.rank)]
+
+    def pack(self, docs):
+        """
+        Returns the context string for the documents (see the module comment).
+
+        :param docs: The retrieved documents, best first.
+        """
+        docs = list(docs)
+        separator_tokens = self.count_tokens(self.separator)
+        plain_tokens = self.count_tokens(self.separator.join(doc.page_content for doc in docs))
+        passages = self.merge(docs)
+        passage_tokens = [self.count_tokens(text) for text in passages]
+        merged_tokens = sum(passage_tokens) + separator_tokens * max(len(passages) - 1, 0)
+
+        selected, used = [], 0
+        for text, tokens in zip(passages, passage_tokens):
+            needed = tokens + (separator_tokens if selected else 0)
+            if used + needed <= self.max_tokens:
+                selected.append(text)
+                used += needed
+        if not selected and passages:
+            # Not even the best passage fits: keep its beginning
+            tokens = self.tokenizer.encode_ordinary(passages[0])[:self.max_tokens]
+            selected = [self.tokenizer.decode(tokens)]
+        context = self.separator.join(selected)
+
+        packed_tokens = self.count_tokens(context)
+        with self._lock:
+            self.contexts += 1
+            self.input_chunks += len(docs)
+            self.output_passages += len(selected)
+            self.plain_tokens += plain_tokens
+            self.packed_tokens += packed_tokens
+            self.overlap_saved_tokens += max(plain_tokens - merged_tokens, 0)
+            self.budget_saved_tokens += max(merged_tokens - packed_tokens, 0)
+        return context
+
+    def __call__(self, docs):
+        return self.pack(docs)
+
+    def stats(self):
+        """Returns the token counts before and after packing, summed over all contexts."""
+        with self._lock:
+            saved = self.plain_tokens - self.packed_tokens
+            return {
+                "contexts": self.contexts,
+                "input_chunks": self.input_chunks,
+                "output_passages": self.output_passages,
+                "plain_tokens": self.plain_tokens,
+                "packed_tokens": self.packed_tokens,
+                "saved_tokens": saved,
+                "overlap_saved_tokens": self.overlap_saved_tokens,
+                "budget_saved_tokens": self.budget_saved_tokens,
+                "saved_ratio": round(saved / self.plain_tokens, 4) if self.plain_tokens else 0.0,
+            }
+
+    def print_stats(self):
+        stats = self.stats()
+        print(
+            f"Context packer: {stats['contexts']} contexts, {stats['input_chunks']} chunks -> "
+            f"{stats['output_passages']} passages, {stats['plain_tokens']} -> "
+            f"{stats['packed_tokens']} tokens ({stats['saved_ratio']:.0%} saved: "
+            f"{stats['overlap_saved_tokens']} by merging overlaps, "
+            f"{stats['budget_saved_tokens']} by the {self.max_tokens}-token budget)"
+        )
@@ -0,0 +1,274 @@
+# This module provides a persistent, on-disk embedding cache that can wrap any
+# LangChain Embeddings object. Vectors are stored in a SQLite database keyed by the
+# embedding model ID and the SHA-256 of the normalized chunk text, so the same text
+# is only embedded once per model, no matter which script or vector store needs it.
+# The cache is bounded by size: when it grows past ``max_bytes``, the least recently
+# used vectors are evicted.
+
+# Instructor: Omar Santos @santosomar
+
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from array import array
+
+from langchain_core.embeddings import Embeddings
+
+# Default location of the shared cache used by the example scripts
+DEFAULT_CACHE_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "db",
+    "embedding_cache.sqlite3",
+)
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text):
+    """
+    Normalizes text before hashing so that trivial differences (Unicode form,
+    runs of whitespace, leading/trailing blanks) map to the same cache entry.
+    """
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFC", text)).strip()
+
+
+def text_hash(text):
+    """Returns the SHA-256 hex digest of the normalized text."""
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+def model_id_for(embeddings):
+    """
+    Derives a model identifier from a LangChain Embeddings object.
+
+    Wrappers that keep the wrapped model in an ``embeddings`` attribute (e.g.,
+    EmbeddingExecutor) are unwrapped first, so wrapping a model does not change
+    its cache keys.
+
+    :param embeddings: The embeddings object (e.g., OpenAIEmbeddings).
+    :return: A string such as ``OpenAIEmbeddings:text-embedding-3-small``.
+    """
+    while isinstance(getattr(embeddings, "embeddings", None), Embeddings):
+        embeddings = embeddings.embeddings
+    for attribute in ("model", "model_name", "model_id"):
+        value = getattr(embeddings, attribute, None)
+        if isinstance(value, str) and value:
+            return f"{type(embeddings).__name__}:{value}"
+    return type(embeddings).__name__
+
+
+class EmbeddingCacheStore:
+    """
+    SQLite-backed storage for embedding vectors with LRU eviction by size.
+
+    Vectors are stored as packed float32 arrays. The store is safe to share
+    between threads.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_bytes=512 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                hash TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_access REAL NOT NULL,
+                PRIMARY KEY (model, hash)
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_last_access ON embeddings (last_access)"
+        )
+        self._conn.commit()
+        self._size = self._conn.execute(
+            "SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+        ).fetchone()[0]
+
+    @property
+    def size_bytes(self):
+        return self._size
+
+    def get_many(self, model, hashes, batch_size=500):
+        """
+        Looks up several vectors at once.
+
+        :param model: The embedding model ID.
+        :param hashes: The text hashes to look up.
+        :return: A dictionary mapping each found hash to its vector.
+        """
+        found = {}
+        unique = list(dict.fromkeys(hashes))
+        with self._lock:
+            for start in range(0, len(unique), batch_size):
+                batch = unique[start:start + batch_size]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT hash, vector FROM embeddings "
+                    f"WHERE model = ? AND hash IN ({placeholders})",
+                    [model, *batch],
+                ).fetchall()
+                for key, blob in rows:
+                    vector = array("f")
+                    vector.frombytes(blob)
+                    found[key] = vector.tolist()
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_access = ? WHERE model = ? AND hash = ?",
+                    [(now, model, key) for key in found],
+                )
+                self._conn.commit()
+        return found
+
+    def put_many(self, model, items, batch_size=500):
+        """
+        Stores several vectors and evicts old entries if the cache is too big.
+
+        :param model: The embedding model ID.
+        :param items: An iterable of ``(hash, vector)`` pairs.
+        """
+        now = time.time()
+        # A hash given twice is stored once (the last vector wins)
+        rows = list(
+            {key: (model, key, array("f", vector).tobytes(), now) for key, vector in items}.values()
+        )
+        if not rows:
+            return
+        with self._lock:
+            # Size of the entries about to be replaced, looked up in batches like
+            # get_many() so the query stays under SQLite's variable limit
+            replaced = 0
+            for start in range(0, len(rows), batch_size):
+                batch = [row[1] for row in rows[start:start + batch_size]]
+                placeholders = ",".join("?" * len(batch))
+                replaced += self._conn.execute(
+                    f"SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings "
+                    f"WHERE model = ? AND hash IN ({placeholders})",
+                    [model, *batch],
+                ).fetchone()[0]
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, hash, vector, last_access) "
+                "VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            self._size += sum(len(row[2]) for row in rows) - replaced
+            if self._size > self.max_bytes:
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        # Evict down to 90% of the limit so we do not evict on every insert
+        target = int(self.max_bytes * 0.9)
+        while self._size > target:
+            rows = self._conn.execute(
+                "SELECT model, hash, LENGTH(vector) FROM embeddings "
+                "ORDER BY last_access LIMIT 256"
+            ).fetchall()
+            if not rows:
+                break
+            freed = 0
+            victims = []
+            for model, key, length in rows:
+                victims.append((model, key))
+                freed += length
+                if self._size - freed <= target:
+                    break
+            self._conn.executemany(
+                "DELETE FROM embeddings WHERE model = ? AND hash = ?", victims
+            )
+            self._size -= freed
+            self.evictions += len(victims)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    A drop-in wrapper around any LangChain Embeddings object that serves document
+    embeddings from a persistent cache and only calls the underlying model for
+    texts it has not seen before.
+
+    Example:
+        embeddings = CachedEmbeddings(OpenAIEmbeddings(model="text-embedding-3-small"))
+        db = Chroma.from_documents(docs, embeddings, persist_directory=...)
+        print(embeddings.stats())
+    """
+
+    def __init__(self, embeddings, store=None, model_id=None):
+        """
+        :param embeddings: The LangChain Embeddings object to wrap.
+        :param store: An EmbeddingCacheStore, or a path to the SQLite file. Defaults
+            to the shared cache in ``db/embedding_cache.sqlite3``.
+        :param model_id: Overrides the model ID used in the cache key.
+        """
+        self.embeddings = embeddings
+        if store is None or isinstance(store, str):
+            store = EmbeddingCacheStore(store or DEFAULT_CACHE_PATH)
+        self.store = store
+        self.model_id = model_id or model_id_for(embeddings)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def embed_documents(self, texts):
+        hashes = [text_hash(text) for text in texts]
+        cached = self.store.get_many(self.model_id, hashes)
+
+        # Embed each missing text only once, even if it repeats within the batch
+        missing = {}
+        for key, text in zip(hashes, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            new_items = list(zip(missing.keys(), vectors))
+            self.store.put_many(self.model_id, new_items)
+            cached.update(new_items)
+
+        with self._lock:
+            self.misses += len(missing)
+            self.hits += len(texts) - len(missing)
+        return [cached[key] for key in hashes]
+
+    def embed_query(self, text):
+        # Query embeddings are not cached here; some models embed queries and
+        # documents differently.
+        return self.embeddings.embed_query(text)
+
+    def stats(self):
+        """
+        Returns the cache hit and miss counters for this wrapper.
+
+        :return: A dictionary with hits, misses, hit rate, evictions and cache size.
+        """
+        total = self.hits + self.misses
+        return {
+            "model": self.model_id,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "evictions": self.store.evictions,
+            "cache_bytes": self.store.size_bytes,
+        }
+
+    def print_stats(self):
+        stats = self.stats()
+        print(
+            f"Embedding cache ({stats['model']}): {stats['hits']} hits, "
+            f"{stats['misses']} misses ({stats['hit_rate']:.0%} hit rate), "
+            f"{stats['cache_bytes'] / (1024 * 1024):.1f} MiB on disk"
+        )
@@ -0,0 +1,275 @@
+# This module provides an embedding executor that speeds up large ingests and makes
+# them resilient to rate limits. It wraps any LangChain Embeddings object and:
+#
+#   1. Uses tiktoken (like utils/embedding_cost_calculator.py) to count the tokens of
+#      each chunk and packs chunks into requests just under the per-request limits.
+#   2. Runs several requests concurrently while staying within a configurable
+#      requests-per-minute (RPM) and tokens-per-minute (TPM) budget.
+#   3. Retries rate-limited (HTTP 429) and transient failures with exponential
+#      backoff and full jitter instead of failing the whole ingest.
+#   4. Reports the achieved throughput in tokens per second.
+
+# Instructor: Omar Santos @santosomar
+
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import tiktoken
+from langchain_core.embeddings import Embeddings
+
+# OpenAI embedding API limits (https://platform.openai.com/docs/api-reference/embeddings)
+MAX_INPUTS_PER_REQUEST = 2048
+MAX_TOKENS_PER_REQUEST = 300_000
+
+# HTTP status codes that are worth retrying
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+
+def get_tokenizer(model_name=None):
+    """
+    Returns the tiktoken encoding for a model, falling back to cl100k_base
+    (the encoding used by the OpenAI embedding models).
+    """
+    if model_name:
+        try:
+            return tiktoken.encoding_for_model(model_name)
+        except KeyError:
+            pass
+    return tiktoken.get_encoding("cl100k_base")
+
+
+def pack_requests(token_counts, max_tokens, max_inputs=MAX_INPUTS_PER_REQUEST):
+    """
+    Packs texts into requests without exceeding the token and input limits.
+
+    Texts are kept in their original order so the results can be reassembled
+    easily. A single text larger than ``max_tokens`` gets a request of its own.
+
+    :param token_counts: The number of tokens of each text.
+    :param max_tokens: The maximum number of tokens per request.
+    :param max_inputs: The maximum number of texts per request.
+    :return: A list of requests, each a list of text indexes.
+    """
+    requests = []
+    current, current_tokens = [], 0
+    for index, tokens in enumerate(token_counts):
+        if current and (
+            current_tokens + tokens > max_tokens or len(current) >= max_inputs
+        ):
+            requests.append(current)
+            current, current_tokens = [], 0
+        current.append(index)
+        current_tokens += tokens
+    if current:
+        requests.append(current)
+    return requests
+
+
+def is_retryable(error):
+    """
+    Decides whether an exception from an embedding call is transient.
+
+    Works with the OpenAI client (``status_code`` attribute, ``RateLimitError``,
+    ``APIConnectionError``, ``APITimeoutError``) and with generic timeouts.
+    """
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    if status is not None:
+        return status in RETRYABLE_STATUS_CODES
+    name = type(error).__name__
+    return isinstance(error, (TimeoutError, ConnectionError)) or any(
+        marker in name for marker in ("RateLimit", "Timeout", "Connection")
+    )
+
+
+class RateLimiter:
+    """
+    A thread-safe token bucket limiter for requests per minute and tokens per minute.
+
+    Both buckets refill continuously. A request larger than the whole TPM budget
+    is allowed once the bucket is full, so it cannot block forever.
+    """
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None):
+        self.rpm = requests_per_minute
+        self.tpm = tokens_per_minute
+        self._requests = float(requests_per_minute or 0)
+        self._tokens = float(tokens_per_minute or 0)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        elapsed = now - self._updated
+        self._updated = now
+        if self.rpm:
+            self._requests = min(self.rpm, self._requests + elapsed * self.rpm / 60)
+        if self.tpm:
+            self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm / 60)
+
+    def acquire(self, tokens):
+        """Blocks until a request of ``tokens`` tokens fits within the budget."""
+        while True:
+            with self._lock:
+                self._refill(time.monotonic())
+                needed_tokens = min(tokens, self.tpm) if self.tpm else 0
+                wait = 0.0
+                if self.rpm and self._requests < 1:
+                    wait = max(wait, (1 - self._requests) * 60 / self.rpm)
+                if self.tpm and self._tokens < needed_tokens:
+                    wait = max(wait, (needed_tokens - self._tokens) * 60 / self.tpm)
+                if wait == 0.0:
+                    if self.rpm:
+                        self._requests -= 1
+                    if self.tpm:
+                        self._tokens -= needed_tokens
+                    return
+            time.sleep(wait)
+
+
+class EmbeddingExecutor(Embeddings):
+    """
+    Wraps a LangChain Embeddings object with token-aware batching, concurrent
+    requests, RPM/TPM rate limiting and retries with jittered backoff.
+
+    Example:
+        embeddings = EmbeddingExecutor(
+            OpenAIEmbeddings(model="text-embedding-3-small"),
+            max_concurrency=4,
+            requests_per_minute=3000,
+            tokens_per_minute=1_000_000,
+        )
+        vectors = embeddings.embed_documents(texts)
+        embeddings.print_stats()
+    """
+
+    def __init__(
+        self,
+        embeddings,
+        max_concurrency=4,
+        requests_per_minute=None,
+        tokens_per_minute=None,
+        max_tokens_per_request=MAX_TOKENS_PER_REQUEST,
+        max_inputs_per_request=MAX_INPUTS_PER_REQUEST,
+        safety_margin=0.95,
+        max_retries=6,
+        initial_backoff=1.0,
+        max_backoff=60.0,
+        model_name=None,
+    ):
+        """
+        :param embeddings: The LangChain Embeddings object to wrap. For
+            OpenAIEmbeddings, consider ``chunk_size=2048`` so it does not split the
+            packed requests again, and ``max_retries=0`` so retries are handled here.
+        :param max_concurrency: Number of requests in flight at the same time.
+        :param requests_per_minute: RPM budget (None for unlimited).
+        :param tokens_per_minute: TPM budget (None for unlimited).
+        :param max_tokens_per_request: Per-request token limit of the API.
+        :param max_inputs_per_request: Per-request input limit of the API.
+        :param safety_margin: Fraction of ``max_tokens_per_request`` actually used,
+            since tiktoken counts can differ slightly from the server's.
+        :param max_retries: Retries per request before giving up.
+        :param initial_backoff: Backoff in seconds before the first retry.
+        :param max_backoff: Upper bound of the backoff in seconds.
+        :param model_name: Model used to pick the tokenizer (defaults to the
+            ``model`` attribute of the wrapped embeddings).
+        """
+        self.embeddings = embeddings
+        self.max_concurrency = max_concurrency
+        self.limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        self.max_tokens = int(max_tokens_per_request * safety_margin)
+        self.max_inputs = max_inputs_per_request
+        self.max_retries = max_retries
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.tokenizer = get_tokenizer(model_name or getattr(embeddings, "model", None))
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.total_tokens = 0
+        self.total_requests = 0
+        self.total_retries = 0
+        self.busy_seconds = 0.0
+
+    def _call_with_retries(self, texts, tokens):
+        attempt = 0
+        while True:
+            self.limiter.acquire(tokens)
+            try:
+                return self.embeddings.embed_documents(texts)
+            except Exception as e:  # noqa: BLE001
+                if attempt >= self.max_retries or not is_retryable(e):
+                    raise
+                # Exponential backoff with full jitter avoids synchronized retries
+                backoff = min(self.max_backoff, self.initial_backoff * 2**attempt)
+                delay = random.uniform(0, backoff)
+                with self._lock:
+                    self.total_retries += 1
+                print(
+                    f"Embedding request failed ({type(e).__name__}), "
+                    f"retrying in {delay:.1f}s (attempt {attempt + 1}/{self.max_retries})"
+                )
+                time.sleep(delay)
+                attempt += 1
+
+    def embed_documents(self, texts):
+        if not texts:
+            return []
+        token_counts = [
+            len(tokens) for tokens in self.tokenizer.encode_ordinary_batch(list(texts))
+        ]
+        requests = pack_requests(token_counts, self.max_tokens, self.max_inputs)
+
+        def run(indexes):
+            tokens = sum(token_counts[i] for i in indexes)
+            return self._call_with_retries([texts[i] for i in indexes], tokens)
+
+        start = time.perf_counter()
+        results = [None] * len(texts)
+        if len(requests) == 1 or self.max_concurrency <= 1:
+            batches = map(run, requests)
+            for indexes, vectors in zip(requests, batches):
+                for i, vector in zip(indexes, vectors):
+                    results[i] = vector
+        else:
+            with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+                for indexes, vectors in zip(requests, executor.map(run, requests)):
+                    for i, vector in zip(indexes, vectors):
+                        results[i] = vector
+
+        with self._lock:
+            self.busy_seconds += time.perf_counter() - start
+            self.total_tokens += sum(token_counts)
+            self.total_requests += len(requests)
+        return results
+
+    def embed_query(self, text):
+        self.limiter.acquire(len(self.tokenizer.encode_ordinary(text)))
+        return self.embeddings.embed_query(text)
+
+    def stats(self):
+        """
+        Returns the throughput statistics of the executor.
+
+        :return: A dictionary with tokens, requests, retries, seconds spent
+            embedding and the achieved tokens per second.
+        """
+        return {
+            "tokens": self.total_tokens,
+            "requests": self.total_requests,
+            "retries": self.total_retries,
+            "seconds": self.busy_seconds,
+            "tokens_per_second": (
+                self.total_tokens / self.busy_seconds if self.busy_seconds else 0.0
+            ),
+        }
+
+    def print_stats(self):
+        stats = self.stats()
+        print(
+            f"Embedded {stats['tokens']} tokens in {stats['requests']} requests "
+            f"({stats['retries']} retries) at {stats['tokens_per_second']:.0f} tokens/s"
+        )
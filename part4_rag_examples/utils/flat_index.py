@@ -0,0 +1,697 @@
+# This module provides a flat (brute-force) vector store backed by memory-mapped
+# NumPy files, as a lightweight alternative to Chroma for small and mid-sized corpora.
+#
+# The embeddings are normalized and stored as a raw float32 (or float16) matrix. A
+# query is answered with one matrix product over all vectors and np.argpartition to
+# pick the exact top-k, without any index to load or build. Opening the store only
+# reads a small JSON header: the vectors and the chunk texts are memory-mapped and
+# read on demand, so opening takes milliseconds and several processes reading the
+# same store share one copy of the vectors in the operating system's page cache.
+#
+# FlatVectorStore implements the LangChain VectorStore interface, so the usual
+# db.as_retriever(...), similarity_search() and add_documents() calls keep working.
+# open_flat_store() exports an existing Chroma store to a flat store on first use.
+#
+# Files in the store directory:
+#   index.json     - dimension, dtype, number of vectors and deleted positions
+#   vectors.bin    - the normalized vectors, one row per chunk
+#   records.jsonl  - the ID, text and metadata of each chunk, one JSON line per row
+#   offsets.bin    - the end offset of each line of records.jsonl (int64)
+#   metadata_index.npz - secondary indexes on the metadata (utils/metadata_index.py),
+#                    built on the first filtered search
+#
+# Filtered searches ({"source": ...}, {"not_after": {"$gte": ...}}, ...) first look
+# up the matching rows in the metadata index. A small query planner then either
+# scores only those rows ("prefilter", for selective filters) or scores all rows
+# and masks out the others before picking the top-k ("postfilter"). Either way,
+# every matching chunk competes for the top-k, unlike filtering a fixed number of
+# results after the search. explain_filter() shows the plan chosen for a filter.
+#
+# as_retriever(search_type="mmr") re-ranks a pool of fetch_k chunks for diversity
+# with the vectorized MMR of utils/mmr.py.
+
+# Instructor: Omar Santos @santosomar
+
+import json
+import os
+import shutil
+import uuid
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+from utils.metadata_index import MetadataIndex, matches_filter
+
+INDEX_FILENAME = "index.json"
+VECTORS_FILENAME = "vectors.bin"
+RECORDS_FILENAME = "records.jsonl"
+OFFSETS_FILENAME = "offsets.bin"
+METADATA_INDEX_FILENAME = "metadata_index.npz"
+
+
+def normalize_rows(vectors):
+    """Returns the vectors scaled to unit length (zero vectors are left as they are)."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def top_k_indices(scores, k):
+    """
+    Returns the column indices of the k highest scores of each row, best first.
+
+    np.argpartition finds the top-k in linear time; only those k are then sorted.
+
+    :param scores: A (queries, n) array of scores.
+    :param k: Number of indices to return per row.
+    """
+    k = min(k, scores.shape[1])
+    if k <= 0:
+        return np.empty((scores.shape[0], 0), dtype=np.int64)
+    if k < scores.shape[1]:
+        candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        candidates = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+    order = np.argsort(-np.take_along_axis(scores, candidates, axis=1), axis=1, kind="stable")
+    return np.take_along_axis(candidates, order, axis=1)
+
+
+class FlatVectorStore(VectorStore):
+    """
+    A memory-mapped vector store with exact top-k search.
+
+    Example:
+        db = FlatVectorStore("db/flat_security", embedding_function=embeddings)
+        db.add_documents(chunks)
+        retriever = db.as_retriever(search_kwargs={"k": 5})
+    """
+
+    # Suffix of the directory used by open_flat_store() for copies of a Chroma store
+    DIRECTORY_SUFFIX = "_flat"
+
+    def __init__(
+        self,
+        persist_directory,
+        embedding_function=None,
+        dtype="float32",
+        block_size=65536,
+        prefilter_selectivity=0.2,
+        prefilter_max_rows=4096,
+    ):
+        """
+        :param persist_directory: Directory of the store. It is created on the first
+            write if it does not exist.
+        :param embedding_function: The LangChain Embeddings used for queries and for
+            add_texts(). Must be the model the stored vectors were created with.
+        :param dtype: Storage type of new stores: "float32", or "float16" to halve
+            the size of the vectors at a small cost in precision. Existing stores
+            keep their dtype.
+        :param block_size: Number of rows multiplied at a time, which bounds the
+            memory used to score float16 stores.
+        :param prefilter_selectivity: Filters that match at most this fraction of
+            the chunks are searched by scoring only the matching chunks; broader
+            filters score all chunks and mask out the others.
+        :param prefilter_max_rows: Filters that match at most this many chunks are
+            always searched by scoring only the matching chunks.
+        """
+        self.persist_directory = persist_directory
+        self.embedding_function = embedding_function
+        self.block_size = block_size
+        self.prefilter_selectivity = prefilter_selectivity
+        self.prefilter_max_rows = prefilter_max_rows
+        index_path = os.path.join(persist_directory, INDEX_FILENAME)
+        if os.path.exists(index_path):
+            with open(index_path, "r", encoding="utf-8") as f:
+                self._info = json.load(f)
+        else:
+            self._info = {
+                "dim": None,
+                "dtype": np.dtype(dtype).name,
+                "count": 0,
+                "deleted": [],
+            }
+        self._deleted = set(self._info["deleted"])
+        self._vectors = None
+        self._end_offsets = None
+        self._id_positions = None
+        self._metadata_index = None
+
+    @staticmethod
+    def exists(persist_directory):
+        """Returns True if a flat store has been written to the directory."""
+        return os.path.exists(os.path.join(persist_directory, INDEX_FILENAME))
+
+    @property
+    def embeddings(self):
+        return self.embedding_function
+
+    def __len__(self):
+        return self._info["count"] - len(self._deleted)
+
+    def _path(self, filename):
+        return os.path.join(self.persist_directory, filename)
+
+    def _vector_matrix(self):
+        # Maps the vectors lazily, so opening the store does not touch them
+        if self._vectors is None:
+            count, dim = self._info["count"], self._info["dim"]
+            if count == 0:
+                self._vectors = np.empty((0, dim or 0), dtype=self._info["dtype"])
+            else:
+                self._vectors = np.memmap(
+                    self._path(VECTORS_FILENAME),
+                    dtype=self._info["dtype"],
+                    mode="r",
+                    shape=(count, dim),
+                )
+        return self._vectors
+
+    def _record_end_offsets(self):
+        if self._end_offsets is None:
+            count = self._info["count"]
+            if count == 0:
+                self._end_offsets = np.empty(0, dtype=np.int64)
+            else:
+                self._end_offsets = np.memmap(
+                    self._path(OFFSETS_FILENAME), dtype=np.int64, mode="r", shape=(count,)
+                )
+        return self._end_offsets
+
+    def _read_records(self, positions):
+        # Reads only the requested lines of records.jsonl
+        end_offsets = self._record_end_offsets()
+        records = []
+        with open(self._path(RECORDS_FILENAME), "rb") as f:
+            for position in positions:
+                start = int(end_offsets[position - 1]) if position else 0
+                f.seek(start)
+                records.append(json.loads(f.read(int(end_offsets[position]) - start)))
+        return records
+
+    def _positions_by_id(self):
+        # Built on first use (deletes, upserts and get_by_ids), by scanning the records
+        if self._id_positions is None:
+            self._id_positions = {}
+            if self._info["count"]:
+                with open(self._path(RECORDS_FILENAME), "rb") as f:
+                    for position, line in enumerate(f):
+                        if position >= self._info["count"]:
+                            break
+                        if position not in self._deleted:
+                            self._id_positions[json.loads(line)["id"]] = position
+        return self._id_positions
+
+    def _save_info(self):
+        # Written last and atomically: the header defines which rows are valid
+        self._info["deleted"] = sorted(self._deleted)
+        index_path = self._path(INDEX_FILENAME)
+        with open(index_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(self._info, f)
+        os.replace(index_path + ".tmp", index_path)
+
+    def metadata_index(self):
+        """
+        Returns the secondary indexes on the chunk metadata.
+
+        The index is loaded on first use. Rows added since it was saved (e.g., by
+        another process) are read from records.jsonl and indexed, and the index is
+        saved again.
+        """
+        count = self._info["count"]
+        if self._metadata_index is None:
+            path = self._path(METADATA_INDEX_FILENAME)
+            index = MetadataIndex.load(path) if os.path.exists(path) else MetadataIndex()
+            if index.count > count:
+                # An index of a previous version of the store
+                index = MetadataIndex()
+            self._metadata_index = index
+        index = self._metadata_index
+        if index.count < count:
+            start = index.count
+            batch_size = 10000
+            for offset in range(start, count, batch_size):
+                positions = range(offset, min(offset + batch_size, count))
+                index.add(offset, [record["metadata"] for record in self._read_records(positions)])
+            self._save_metadata_index()
+        return index
+
+    def _save_metadata_index(self):
+        if self._metadata_index is not None and os.path.isdir(self.persist_directory):
+            self._metadata_index.save(self._path(METADATA_INDEX_FILENAME))
+
+    def persist(self):
+        """Writes the store header (the data files are written as chunks are added)."""
+        os.makedirs(self.persist_directory, exist_ok=True)
+        self._save_metadata_index()
+        self._save_info()
+
+    def _to_document(self, record):
+        return Document(id=record["id"], page_content=record["text"], metadata=record["metadata"])
+
+    def add_embeddings(self, texts, embeddings, metadatas=None, ids=None, **kwargs):
+        """
+        Adds chunks with pre-computed embeddings. Existing IDs are replaced.
+
+        :param texts: The chunk texts.
+        :param embeddings: One vector per text.
+        :param metadatas: Optional metadata dictionaries, one per text.
+        :param ids: Optional IDs, one per text. Random UUIDs are used by default.
+        :return: The list of IDs.
+        """
+        texts = list(texts)
+        if not texts:
+            return []
+        metadatas = metadatas or [{} for _ in texts]
+        ids = list(ids) if ids else [str(uuid.uuid4()) for _ in texts]
+        vectors = normalize_rows(embeddings)
+        if len(metadatas) != len(texts) or len(ids) != len(texts) or len(vectors) != len(texts):
+            raise ValueError("texts, embeddings, metadatas and ids must have the same length.")
+        if self._info["dim"] is None:
+            self._info["dim"] = vectors.shape[1]
+        elif vectors.shape[1] != self._info["dim"]:
+            raise ValueError(
+                f"Embedding dimension {vectors.shape[1]} does not match the store "
+                f"dimension {self._info['dim']}."
+            )
+
+        os.makedirs(self.persist_directory, exist_ok=True)
+        count = self._info["count"]
+        end_offsets = self._record_end_offsets()
+        records_size = int(end_offsets[-1]) if count else 0
+
+        # Replace existing chunks with the same ID (the last occurrence wins)
+        id_positions = self._positions_by_id()
+        for i, chunk_id in enumerate(ids):
+            if chunk_id in id_positions:
+                self._deleted.add(id_positions[chunk_id])
+            id_positions[chunk_id] = count + i
+
+        lines, new_end_offsets, end = [], [], records_size
+        for text, metadata, chunk_id in zip(texts, metadatas, ids):
+            line = json.dumps(
+                {"id": chunk_id, "text": text, "metadata": metadata}, ensure_ascii=False
+            ).encode("utf-8") + b"\n"
+            end += len(line)
+            lines.append(line)
+            new_end_offsets.append(end)
+
+        # Drop anything past the last committed row (e.g., from an interrupted write)
+        self._vectors = self._end_offsets = None
+        row_bytes = self._info["dim"] * np.dtype(self._info["dtype"]).itemsize
+        for filename, size in (
+            (VECTORS_FILENAME, count * row_bytes),
+            (OFFSETS_FILENAME, count * 8),
+            (RECORDS_FILENAME, records_size),
+        ):
+            with open(self._path(filename), "ab") as f:
+                f.truncate(size)
+
+        with open(self._path(VECTORS_FILENAME), "ab") as f:
+            f.write(vectors.astype(self._info["dtype"]).tobytes())
+        with open(self._path(RECORDS_FILENAME), "ab") as f:
+            f.writelines(lines)
+        with open(self._path(OFFSETS_FILENAME), "ab") as f:
+            f.write(np.asarray(new_end_offsets, dtype=np.int64).tobytes())
+        self._info["count"] = count + len(texts)
+        if self._metadata_index is not None and self._metadata_index.count == count:
+            # Keep a loaded index up to date (otherwise it catches up on first use)
+            self._metadata_index.add(count, metadatas)
+            self._save_metadata_index()
+        self._save_info()
+        return ids
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        if self.embedding_function is None:
+            raise ValueError("An embedding_function is required to add texts.")
+        texts = list(texts)
+        return self.add_embeddings(
+            texts, self.embedding_function.embed_documents(texts), metadatas, ids
+        )
+
+    def delete(self, ids=None, **kwargs):
+        """Deletes chunks by ID. The space is reclaimed by re-exporting the store."""
+        if not ids:
+            return False
+        id_positions = self._positions_by_id()
+        for chunk_id in ids:
+            position = id_positions.pop(chunk_id, None)
+            if position is not None:
+                self._deleted.add(position)
+        self._save_info()
+        return True
+
+    def get_by_ids(self, ids):
+        id_positions = self._positions_by_id()
+        positions = [id_positions[chunk_id] for chunk_id in ids if chunk_id in id_positions]
+        return [self._to_document(record) for record in self._read_records(positions)]
+
+    def score_vectors(self, query_vectors):
+        """
+        Computes the cosine similarity of the queries with every stored vector.
+
+        :param query_vectors: A (queries, dim) array of query embeddings.
+        :return: A (queries, count) float32 array. Deleted rows score -inf.
+        """
+        queries = normalize_rows(np.atleast_2d(query_vectors))
+        matrix = self._vector_matrix()
+        if matrix.dtype == np.float32 and len(matrix) <= self.block_size:
+            scores = queries @ matrix.T
+        else:
+            scores = np.empty((len(queries), len(matrix)), dtype=np.float32)
+            for start in range(0, len(matrix), self.block_size):
+                block = np.asarray(matrix[start:start + self.block_size], dtype=np.float32)
+                scores[:, start:start + len(block)] = queries @ block.T
+        if self._deleted:
+            scores[:, sorted(self._deleted)] = -np.inf
+        return scores
+
+    def _search_scores(self, query_vectors, k, mask=None):
+        # Scores used to rank the chunks in searches for the top k. Subclasses that
+        # search an approximation of the vectors override this. Rows outside the
+        # mask score -inf.
+        scores = self.score_vectors(query_vectors)
+        if mask is not None:
+            scores[:, ~mask] = -np.inf
+        return scores
+
+    def _top_k(self, query_vectors, k, mask=None):
+        # Returns one list of (position, similarity) pairs per query, best first,
+        # restricted to the rows where mask is True. Subclasses with an index that
+        # does not score every row (e.g., HNSW) override this.
+        scores = self._search_scores(query_vectors, k, mask)
+        return [
+            [(int(p), float(row[p])) for p in positions if np.isfinite(row[p])]
+            for row, positions in zip(scores, top_k_indices(scores, k))
+        ]
+
+    def _top_k_subset(self, query_vectors, k, positions):
+        # Exact top k among the given rows only. The rows are read in position
+        # order, block by block, so the memory-mapped file is read sequentially.
+        queries = normalize_rows(np.atleast_2d(query_vectors))
+        matrix = self._vector_matrix()
+        scores = np.empty((len(queries), len(positions)), dtype=np.float32)
+        for start in range(0, len(positions), self.block_size):
+            block = np.asarray(matrix[positions[start:start + self.block_size]], dtype=np.float32)
+            scores[:, start:start + len(block)] = queries @ block.T
+        return [
+            [(int(positions[i]), float(row[i])) for i in indices]
+            for row, indices in zip(scores, top_k_indices(scores, k))
+        ]
+
+    def _plan_filter(self, filter):
+        # Returns (plan, mask of the matching live rows)
+        if not filter:
+            return "unfiltered", None
+        mask = self.metadata_index().mask(filter, self._info["count"])
+        if mask is None:
+            # A field the index does not cover: check the records of the best rows
+            return "scan", None
+        if self._deleted:
+            mask[sorted(self._deleted)] = False
+        matching = int(np.count_nonzero(mask))
+        if matching <= self.prefilter_max_rows or matching <= self.prefilter_selectivity * len(self):
+            return "prefilter", mask
+        return "postfilter", mask
+
+    def explain_filter(self, filter):
+        """
+        Returns how a search with a metadata filter is executed.
+
+        Example:
+            db.explain_filter({"issuer_name": {"$contains": "Let's Encrypt"}})
+            # {"plan": "prefilter", "matching": 118, "selectivity": 0.0312}
+
+        :param filter: A metadata filter (see utils/metadata_index.py).
+        :return: A dictionary with the plan ("unfiltered", "prefilter", "postfilter"
+            or "scan"), the number of matching chunks and the fraction of the store
+            they represent (None for "scan", which reads the records).
+        """
+        plan, mask = self._plan_filter(filter)
+        if plan == "unfiltered":
+            return {"plan": plan, "matching": len(self), "selectivity": 1.0}
+        if mask is None:
+            return {"plan": plan, "matching": None, "selectivity": None}
+        matching = int(np.count_nonzero(mask))
+        return {"plan": plan, "matching": matching, "selectivity": round(matching / max(len(self), 1), 4)}
+
+    def _search(self, query_vectors, k, filter=None):
+        # Returns one list of (position, similarity, record) triples per query
+        plan, mask = self._plan_filter(filter)
+        if plan == "scan":
+            results = []
+            for query in np.atleast_2d(query_vectors):
+                scores = self._search_scores(query, 4 * k)[0]
+                positions, records = self._rank(scores, k, filter)
+                results.append(
+                    [(p, float(scores[p]), record) for p, record in zip(positions, records)]
+                )
+            return results
+        if plan == "prefilter":
+            hits = self._top_k_subset(query_vectors, k, np.flatnonzero(mask))
+        else:
+            hits = self._top_k(query_vectors, k, mask)
+        results = []
+        for row in hits:
+            records = self._read_records([position for position, _ in row])
+            results.append(
+                [(position, similarity, record) for (position, similarity), record in zip(row, records)]
+            )
+        return results
+
+    def _rank(self, scores, k, filter):
+        # Returns (positions, scores) of the best live rows, filtered by metadata
+        if filter is None:
+            positions = [int(p) for p in top_k_indices(scores[None, :], k)[0]]
+            positions = [p for p in positions if np.isfinite(scores[p])]
+            return positions, self._read_records(positions)
+
+        positions, records = [], []
+        order = np.argsort(-scores, kind="stable")
+        batch = max(4 * k, 64)
+        for start in range(0, len(order), batch):
+            candidates = [int(p) for p in order[start:start + batch] if np.isfinite(scores[p])]
+            for position, record in zip(candidates, self._read_records(candidates)):
+                if matches_filter(record["metadata"], filter):
+                    positions.append(position)
+                    records.append(record)
+                    if len(positions) == k:
+                        return positions, records
+            if len(candidates) < batch:
+                break
+        return positions, records
+
+    def similarity_search_with_score_by_vector(self, embedding, k=4, filter=None, **kwargs):
+        """
+        Returns the k most similar chunks with their distance.
+
+        Like Chroma, the distance is the squared Euclidean distance between unit
+        vectors (0 = identical, 4 = opposite), so score thresholds used with Chroma
+        stores behave the same.
+
+        :param filter: Optional metadata filter the chunks must match, e.g.
+            {"source": "ssrf.txt"} or {"not_after": {"$gte": "2024-11-01"}} (see
+            utils/metadata_index.py for the operators).
+        """
+        if self._info["count"] == 0:
+            return []
+        return self.similarity_search_with_score_by_vectors([embedding], k=k, filter=filter)[0]
+
+    def similarity_search_with_score_by_vectors(self, embeddings, k=4, filter=None):
+        """
+        Searches for several queries at once, with a single matrix product.
+
+        :param embeddings: A list of query embeddings.
+        :param filter: Optional metadata filter applied to every query.
+        :return: One list of (Document, distance) pairs per query.
+        """
+        if self._info["count"] == 0:
+            return [[] for _ in embeddings]
+        return [
+            [
+                (self._to_document(record), max(0.0, 2.0 - 2.0 * similarity))
+                for _, similarity, record in row
+            ]
+            for row in self._search(embeddings, k, filter)
+        ]
+
+    def similarity_search_with_vectors(self, embeddings, k=4, filter=None):
+        """
+        Like similarity_search_with_score_by_vectors(), but also returns the stored
+        (normalized) vector of every chunk, e.g., for MMR re-ranking.
+
+        :return: One list of (Document, distance, vector) triples per query.
+        """
+        if self._info["count"] == 0:
+            return [[] for _ in embeddings]
+        matrix = self._vector_matrix()
+        results = []
+        for row in self._search(embeddings, k, filter):
+            positions = [position for position, _, _ in row]
+            vectors = np.asarray(matrix[positions], dtype=np.float32)
+            results.append(
+                [
+                    (self._to_document(record), max(0.0, 2.0 - 2.0 * similarity), vector)
+                    for (_, similarity, record), vector in zip(row, vectors)
+                ]
+            )
+        return results
+
+    def max_marginal_relevance_search_by_vector(
+        self, embedding, k=4, fetch_k=20, lambda_mult=0.5, filter=None, **kwargs
+    ):
+        """
+        Returns k chunks selected for relevance and diversity with maximal marginal
+        relevance, from the fetch_k most similar chunks (see utils/mmr.py).
+
+        Used by db.as_retriever(search_type="mmr").
+
+        :param lambda_mult: 1 ranks by relevance only, 0 by diversity only.
+        :param filter: Optional metadata filter (see utils/metadata_index.py).
+        """
+        # Imported here because utils/mmr.py imports this module
+        from utils.mmr import maximal_marginal_relevance
+
+        candidates = self.similarity_search_with_vectors(
+            [embedding], k=max(k, fetch_k), filter=filter
+        )[0]
+        if not candidates:
+            return []
+        selected = maximal_marginal_relevance(
+            embedding, np.stack([vector for _, _, vector in candidates]), lambda_mult, k
+        )
+        return [candidates[i][0] for i in selected]
+
+    def max_marginal_relevance_search(
+        self, query, k=4, fetch_k=20, lambda_mult=0.5, filter=None, **kwargs
+    ):
+        return self.max_marginal_relevance_search_by_vector(
+            self.embedding_function.embed_query(query), k, fetch_k, lambda_mult, filter
+        )
+
+    def similarity_search_with_score(self, query, k=4, filter=None, **kwargs):
+        return self.similarity_search_with_score_by_vector(
+            self.embedding_function.embed_query(query), k=k, filter=filter
+        )
+
+    def similarity_search_by_vector(self, embedding, k=4, filter=None, **kwargs):
+        return [
+            doc
+            for doc, _ in self.similarity_search_with_score_by_vector(embedding, k=k, filter=filter)
+        ]
+
+    def similarity_search(self, query, k=4, filter=None, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k=k, filter=filter)]
+
+    def _select_relevance_score_fn(self):
+        return self._euclidean_relevance_score_fn
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts,
+        embedding,
+        metadatas=None,
+        ids=None,
+        persist_directory=None,
+        dtype="float32",
+        **kwargs,
+    ):
+        if persist_directory is None:
+            raise ValueError("persist_directory is required to create a FlatVectorStore.")
+        store = cls(persist_directory, embedding_function=embedding, dtype=dtype)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        return store
+
+    @classmethod
+    def from_chroma(
+        cls,
+        chroma_db,
+        persist_directory,
+        embedding_function=None,
+        dtype="float32",
+        batch_size=1000,
+        **kwargs,
+    ):
+        """
+        Exports a Chroma store (vectors, texts and metadata) to a new flat store.
+
+        The export is written to a temporary directory and then moved into place,
+        so processes that have the previous export open keep reading a consistent
+        copy.
+
+        :param chroma_db: A LangChain Chroma vector store.
+        :param persist_directory: Directory of the flat store (replaced if it exists).
+        :param embedding_function: Embeddings for queries. Defaults to the
+            embedding function of the Chroma store.
+        :param dtype: "float32" or "float16".
+        :param batch_size: Number of chunks read from Chroma at a time.
+        :param kwargs: Further options for the store class.
+        :return: The new store.
+        """
+        embedding_function = embedding_function or chroma_db.embeddings
+        staging_directory = persist_directory.rstrip(os.sep) + ".tmp"
+        shutil.rmtree(staging_directory, ignore_errors=True)
+        staging = cls(
+            staging_directory, embedding_function=embedding_function, dtype=dtype, **kwargs
+        )
+
+        collection = chroma_db._collection
+        total = collection.count()
+        for offset in range(0, total, batch_size):
+            data = collection.get(
+                include=["embeddings", "documents", "metadatas"],
+                limit=batch_size,
+                offset=offset,
+            )
+            staging.add_embeddings(
+                data["documents"],
+                np.asarray(data["embeddings"], dtype=np.float32),
+                [metadata or {} for metadata in data["metadatas"]],
+                data["ids"],
+            )
+        # Build the metadata index with the export, so filtered searches are fast
+        # from the first query
+        staging.metadata_index()
+        staging.persist()
+
+        shutil.rmtree(persist_directory, ignore_errors=True)
+        os.replace(staging_directory, persist_directory)
+        return cls(persist_directory, embedding_function=embedding_function, **kwargs)
+
+
+def open_flat_store(
+    chroma_directory,
+    embedding_function,
+    flat_directory=None,
+    dtype="float32",
+    store_class=FlatVectorStore,
+    **kwargs,
+):
+    """
+    Opens the flat copy of a Chroma store, exporting it first if the copy is
+    missing or older than the Chroma store.
+
+    :param chroma_directory: The persist directory of the Chroma store.
+    :param embedding_function: Embeddings used for queries.
+    :param flat_directory: Directory of the copy. Defaults to the Chroma directory
+        with the DIRECTORY_SUFFIX of the store class (e.g., "_flat").
+    :param dtype: Storage type used when exporting ("float32" or "float16").
+    :param store_class: FlatVectorStore or a subclass of it.
+    :param kwargs: Further options for the store class.
+    :return: An instance of store_class.
+    """
+    flat_directory = flat_directory or (
+        chroma_directory.rstrip(os.sep) + store_class.DIRECTORY_SUFFIX
+    )
+    index_path = os.path.join(flat_directory, INDEX_FILENAME)
+    chroma_file = os.path.join(chroma_directory, "chroma.sqlite3")
+    if not os.path.exists(index_path) or (
+        os.path.exists(chroma_file) and os.path.getmtime(chroma_file) > os.path.getmtime(index_path)
+    ):
+        # Imported lazily so the flat store can be used without chromadb installed
+        from langchain_chroma import Chroma
+
+        chroma_db = Chroma(persist_directory=chroma_directory, embedding_function=embedding_function)
+        return store_class.from_chroma(chroma_db, flat_directory, dtype=dtype, **kwargs)
+    return store_class(flat_directory, embedding_function=embedding_function, **kwargs)
@@ -0,0 +1,308 @@
+# This module provides an approximate nearest neighbour (ANN) vector store based on
+# HNSW graphs (Hierarchical Navigable Small World), for corpora that are too large
+# for exact search.
+#
+# HNSWVectorStore extends the flat store of utils/flat_index.py: the chunk records
+# and the normalized vectors are stored the same way, and an HNSW graph built with
+# hnswlib is kept next to them (hnsw.bin). A query visits only a small part of the
+# graph instead of scoring every vector. The graph is tuned with three parameters:
+#
+#   M               - links per node. Higher values improve recall but use more memory.
+#   ef_construction - candidate list size while inserting. Higher values build a
+#                     better graph, more slowly.
+#   ef_search       - candidate list size while searching. Higher values improve
+#                     recall at the cost of latency. Can be changed at any time.
+#
+# Chunks can be added and deleted incrementally. Each add or delete saves the whole
+# graph; bulk loads should run inside bulk_load() (as from_chroma() does), which
+# saves it once at the end. When the saved graph is behind the
+# stored vectors (e.g., after an interrupted write), the missing rows are inserted
+# when the store is opened. recall_latency_report() compares the graph with exact
+# search, to help choosing M and ef_search.
+#
+# Metadata filters are planned as in the flat store: selective filters are answered
+# by exact search over the matching chunks, broader ones by a graph search that
+# skips the chunks outside the filter.
+
+# Instructor: Omar Santos @santosomar
+
+import os
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+from utils.flat_index import FlatVectorStore, normalize_rows, open_flat_store, top_k_indices
+
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+GRAPH_FILENAME = "hnsw.bin"
+
+
+class HNSWVectorStore(FlatVectorStore):
+    """
+    A persistent vector store with approximate (HNSW) search.
+
+    Example:
+        db = HNSWVectorStore("db/hnsw_security", embedding_function=embeddings, M=16)
+        with db.bulk_load():  # Saves the graph once, not after every batch
+            for batch in batches:
+                db.add_documents(batch)
+        db.ef_search = 128
+        retriever = db.as_retriever(search_kwargs={"k": 5})
+    """
+
+    DIRECTORY_SUFFIX = "_hnsw"
+
+    def __init__(
+        self,
+        persist_directory,
+        embedding_function=None,
+        M=16,
+        ef_construction=200,
+        ef_search=64,
+        autosave=True,
+        insert_batch_size=10000,
+        **kwargs,
+    ):
+        """
+        :param persist_directory: Directory of the store.
+        :param embedding_function: The LangChain Embeddings used for queries.
+        :param M: Links per node. Only used when the graph is created; an existing
+            store keeps the values it was built with.
+        :param ef_construction: Candidate list size while inserting. Only used when
+            the graph is created.
+        :param ef_search: Candidate list size while searching (at least k is used).
+        :param autosave: Save the graph after every add or delete. Set to False for
+            bulk loads and call persist() at the end.
+        :param insert_batch_size: Number of vectors inserted into the graph at a time.
+        :param kwargs: Options of FlatVectorStore (e.g., dtype).
+        """
+        if hnswlib is None:
+            raise ImportError(
+                "HNSWVectorStore requires the hnswlib package. Install it with `pip install hnswlib`."
+            )
+        super().__init__(persist_directory, embedding_function=embedding_function, **kwargs)
+        self._info.setdefault("hnsw", {"M": M, "ef_construction": ef_construction})
+        self.ef_search = ef_search
+        self.autosave = autosave
+        self.insert_batch_size = insert_batch_size
+        self._index = None
+        self._graph_deleted = set()
+
+    def _graph(self):
+        # Loads (or creates) the graph on first use and brings it up to date with the
+        # stored vectors and deletions
+        count = self._info["count"]
+        if self._index is None:
+            self._index = hnswlib.Index(space="ip", dim=self._info["dim"])
+            graph_path = self._path(GRAPH_FILENAME)
+            if os.path.exists(graph_path):
+                self._index.load_index(graph_path)
+            if not os.path.exists(graph_path) or self._index.get_current_count() > count:
+                # No graph yet, or a graph that does not belong to these vectors
+                self._index = hnswlib.Index(space="ip", dim=self._info["dim"])
+                self._index.init_index(
+                    max_elements=max(count, 1024),
+                    M=self._info["hnsw"]["M"],
+                    ef_construction=self._info["hnsw"]["ef_construction"],
+                    random_seed=100,
+                )
+            self._graph_deleted = set()
+
+        graph_count = self._index.get_current_count()
+        if graph_count < count:
+            if count > self._index.get_max_elements():
+                self._index.resize_index(max(count, 2 * self._index.get_max_elements()))
+            vectors = self._vector_matrix()
+            for start in range(graph_count, count, self.insert_batch_size):
+                stop = min(start + self.insert_batch_size, count)
+                self._index.add_items(
+                    np.asarray(vectors[start:stop], dtype=np.float32), np.arange(start, stop)
+                )
+
+        for position in self._deleted - self._graph_deleted:
+            try:
+                self._index.mark_deleted(position)
+            except RuntimeError:
+                pass  # Already deleted in the saved graph
+            self._graph_deleted.add(position)
+        return self._index
+
+    def persist(self):
+        """Writes the store header and saves the graph."""
+        super().persist()
+        if self._info["count"]:
+            graph_path = self._path(GRAPH_FILENAME)
+            self._graph().save_index(graph_path + ".tmp")
+            os.replace(graph_path + ".tmp", graph_path)
+
+    @contextmanager
+    def bulk_load(self):
+        """
+        Turns autosave off for the adds and deletes of the block and saves the store
+        once at the end, instead of rewriting the whole graph after each of them.
+        """
+        autosave, self.autosave = self.autosave, False
+        try:
+            yield self
+        finally:
+            self.autosave = autosave
+        if autosave:
+            self.persist()
+
+    def add_embeddings(self, texts, embeddings, metadatas=None, ids=None, **kwargs):
+        ids = super().add_embeddings(texts, embeddings, metadatas, ids, **kwargs)
+        if self._index is not None or self.autosave:
+            self._graph()
+        if self.autosave:
+            self.persist()
+        return ids
+
+    def delete(self, ids=None, **kwargs):
+        deleted = super().delete(ids, **kwargs)
+        if deleted and self.autosave:
+            self.persist()
+        return deleted
+
+    @classmethod
+    def from_chroma(cls, chroma_db, persist_directory, embedding_function=None, autosave=True, **kwargs):
+        """
+        Exports a Chroma store to a new HNSW store (see FlatVectorStore.from_chroma()).
+        The batches are added without autosave and the graph is built and saved once,
+        when the export is persisted.
+
+        :param autosave: Autosave setting of the returned store.
+        """
+        store = super().from_chroma(
+            chroma_db, persist_directory, embedding_function, autosave=False, **kwargs
+        )
+        store.autosave = autosave
+        return store
+
+    def _knn(self, query_vectors, k, mask=None):
+        # Returns (positions, cosine similarities) arrays for the queries. With a
+        # mask, the graph search only returns rows where the mask is True.
+        index = self._graph()
+        k = min(k, len(self) if mask is None else int(np.count_nonzero(mask)))
+        index.set_ef(max(self.ef_search, k))
+        queries = normalize_rows(np.atleast_2d(query_vectors))
+        if mask is None:
+            labels, distances = index.knn_query(queries, k=k)
+        else:
+            # The filter is a Python callback, so the graph is searched on one thread
+            labels, distances = index.knn_query(
+                queries, k=k, num_threads=1, filter=lambda label: bool(mask[label])
+            )
+        # The "ip" space returns 1 - inner product
+        return labels.astype(np.int64), 1.0 - distances
+
+    def _top_k(self, query_vectors, k, mask=None):
+        # Approximate top k from the graph. Broad filters ("postfilter" plans) are
+        # applied while walking the graph, so no result is lost to the filter;
+        # selective filters are answered by exact search over the matching rows
+        # (see FlatVectorStore._plan_filter()).
+        if mask is not None and not mask.any():
+            return [[] for _ in np.atleast_2d(query_vectors)]
+        try:
+            positions, similarities = self._knn(query_vectors, k, mask)
+        except RuntimeError:
+            if mask is None:
+                raise
+            # The filtered walk found fewer than k matching rows
+            return self._top_k_subset(query_vectors, k, np.flatnonzero(mask))
+        return [
+            [(int(p), float(s)) for p, s in zip(row, row_similarities)]
+            for row, row_similarities in zip(positions, similarities)
+        ]
+
+
+def open_hnsw_store(chroma_directory, embedding_function, hnsw_directory=None, **kwargs):
+    """
+    Opens the HNSW copy of a Chroma store, exporting it first if the copy is
+    missing or older than the Chroma store (see open_flat_store()).
+
+    :param chroma_directory: The persist directory of the Chroma store.
+    :param embedding_function: Embeddings used for queries.
+    :param hnsw_directory: Directory of the copy. Defaults to the Chroma directory
+        with a "_hnsw" suffix.
+    :param kwargs: Options of HNSWVectorStore (M, ef_construction, ef_search).
+    :return: An HNSWVectorStore.
+    """
+    return open_flat_store(
+        chroma_directory,
+        embedding_function,
+        flat_directory=hnsw_directory,
+        store_class=HNSWVectorStore,
+        **kwargs,
+    )
+
+
+def _latency_stats(seconds):
+    seconds = np.asarray(seconds)
+    return {
+        "p50_ms": round(float(np.percentile(seconds, 50)) * 1000, 3),
+        "p95_ms": round(float(np.percentile(seconds, 95)) * 1000, 3),
+        "qps": round(len(seconds) / float(seconds.sum()), 1) if seconds.sum() else None,
+    }
+
+
+def recall_latency_report(store, query_vectors, k=10, ef_values=(16, 32, 64, 128, 256)):
+    """
+    Measures recall@k and per-query latency of the graph for several ef_search
+    values, using exact search over the same vectors as the ground truth.
+
+    :param store: An HNSWVectorStore.
+    :param query_vectors: A list or array of query embeddings.
+    :param k: Number of neighbours per query.
+    :param ef_values: The ef_search values to measure.
+    :return: A list of result dictionaries, the first one for exact search.
+    """
+    query_vectors = normalize_rows(query_vectors)
+    k = min(k, len(store))
+
+    exact_seconds, truth = [], []
+    for query in query_vectors:
+        start = time.perf_counter()
+        scores = store.score_vectors(query)
+        truth.append(set(top_k_indices(scores, k)[0].tolist()))
+        exact_seconds.append(time.perf_counter() - start)
+    rows = [{"method": "exact", "ef_search": None, f"recall@{k}": 1.0, **_latency_stats(exact_seconds)}]
+
+    store._graph()  # Load the graph before timing
+    original_ef = store.ef_search
+    try:
+        for ef in ef_values:
+            store.ef_search = ef
+            seconds, hits = [], 0
+            for query, expected in zip(query_vectors, truth):
+                start = time.perf_counter()
+                positions, _ = store._knn(query, k)
+                seconds.append(time.perf_counter() - start)
+                hits += len(expected.intersection(positions[0].tolist()))
+            rows.append(
+                {
+                    "method": "hnsw",
+                    "ef_search": ef,
+                    f"recall@{k}": round(hits / (k * len(query_vectors)), 4),
+                    **_latency_stats(seconds),
+                }
+            )
+    finally:
+        store.ef_search = original_ef
+    return rows
+
+
+def print_report(rows):
+    """Prints the rows of recall_latency_report() as a table."""
+    recall_column = next(key for key in rows[0] if key.startswith("recall@"))
+    print(f"{'method':<8}{'ef_search':>10}{recall_column:>12}{'p50 ms':>10}{'p95 ms':>10}{'QPS':>10}")
+    for row in rows:
+        print(
+            f"{row['method']:<8}{row['ef_search'] if row['ef_search'] is not None else '-':>10}"
+            f"{row[recall_column]:>12.4f}{row['p50_ms']:>10.3f}{row['p95_ms']:>10.3f}"
+            f"{row['qps'] or 0:>10.1f}"
+        )
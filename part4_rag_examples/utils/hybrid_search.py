@@ -0,0 +1,456 @@
+# This module adds lexical (BM25) search next to a vector store and fuses both result
+# lists with reciprocal rank fusion (RRF).
+#
+# Dense embeddings capture meaning, but they are poor at matching exact tokens such
+# as CVE IDs, IP addresses, file hashes and hostnames: "CVE-2021-44228" and
+# "CVE-2021-45046" are almost the same vector. A keyword index finds those exact
+# tokens, while the vector store finds paraphrases. HybridRetriever runs both
+# searches and ranks every chunk by the sum of 1 / (rrf_k + rank) over the lists it
+# appears in, so no score calibration between the two searches is needed.
+#
+# The tokenizer keeps security tokens intact instead of splitting them at dots and
+# dashes: CVE/CWE IDs, IPv4 addresses (with CIDR suffix), IPv6 addresses, hex hashes
+# and fully qualified domain names (and localhost), with an optional port for
+# addresses and hostnames. Hostnames are also indexed by their parent domains and
+# labels, so "tesla.com" matches "shop.tesla.com", and "host:port" is also indexed as
+# its host and port, so "127.0.0.1" matches "127.0.0.1:6379".
+#
+# The inverted index is stored as a few flat NumPy arrays (4 bytes per posting plus
+# 2 bytes for its term frequency) that are memory-mapped when the index is opened.
+# Queries made only of security tokens (e.g., "CVE-2021-44228") can be answered by
+# the index alone, which skips the embedding call entirely.
+#
+# Files in the index directory:
+#   bm25.json          - BM25 parameters, chunk IDs and the sorted vocabulary
+#   postings.npy       - the chunk positions of every term, term after term (uint32)
+#   frequencies.npy    - the frequency of the term in each of those chunks (uint16)
+#   term_offsets.npy   - where the postings of each term start (int64)
+#   doc_lengths.npy    - the number of tokens of each chunk (uint32)
+
+# Instructor: Omar Santos @santosomar
+
+import json
+import os
+import re
+import shutil
+from collections import Counter
+
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.vectorstores import VectorStore
+
+from utils.flat_index import INDEX_FILENAME, FlatVectorStore, top_k_indices
+from utils.metadata_index import matches_filter
+
+HEADER_FILENAME = "bm25.json"
+ARRAY_FILENAMES = ("postings", "frequencies", "term_offsets", "doc_lengths")
+
+# Security tokens must not be glued to other word characters, dots or dashes (a
+# trailing dot that ends a sentence is allowed). Addresses and hostnames may end
+# with a port, so a colon after them is only rejected when it starts a longer port.
+_BEFORE = r"(?<![\w.:-])"
+_AFTER = r"(?![\w:-]|\.\w)"
+_PORT = r"(?::\d{1,5})?"
+_HOST_AFTER = r"(?![\w-]|\.\w|:\d)"
+_TOKEN = re.compile(
+    rf"{_BEFORE}(?P<cve>(?:cve-\d{{4}}-\d{{4,}}|cwe-\d+)){_AFTER}"
+    rf"|{_BEFORE}(?P<ipv4>(?:\d{{1,3}}\.){{3}}\d{{1,3}}(?:/\d{{1,2}}|{_PORT})){_HOST_AFTER}"
+    rf"|{_BEFORE}(?P<ipv6>(?:[0-9a-f]{{1,4}}:){{7}}[0-9a-f]{{1,4}}"
+    rf"|(?:[0-9a-f]{{1,4}}:){{1,7}}:(?:[0-9a-f]{{1,4}}(?::[0-9a-f]{{1,4}}){{0,6}})?"
+    rf"|::[0-9a-f]{{1,4}}(?::[0-9a-f]{{1,4}}){{0,6}})(?:/\d{{1,3}})?{_AFTER}"
+    rf"|{_BEFORE}(?P<hash>[0-9a-f]{{32,}}){_AFTER}"
+    rf"|{_BEFORE}(?P<fqdn>(?:(?:\*\.)?(?:[a-z0-9](?:[a-z0-9-]*[a-z0-9])?\.)+[a-z]{{2,63}}"
+    rf"|localhost){_PORT}){_HOST_AFTER}"
+    r"|(?P<word>\w+)"
+)
+
+STOP_WORDS = frozenset(
+    "a an and are as at be by do does for from has have how in is it of on or that the "
+    "this to was were what when where which who why will with".split()
+)
+
+
+def iter_tokens(text):
+    """
+    Yields the ``(kind, token)`` pairs of a lowercased text, where kind is "cve",
+    "ipv4", "ipv6", "hash", "fqdn" or "word". Stop words are skipped.
+    """
+    for match in _TOKEN.finditer(text.lower()):
+        kind = match.lastgroup
+        token = match.group(kind)
+        if kind == "word" and token in STOP_WORDS:
+            continue
+        yield kind, token
+
+
+def tokenize(text):
+    """
+    Returns the index terms of a text.
+
+    Security tokens are kept whole. A hostname also yields its parent domains and
+    its labels ("shop.tesla.com" -> "shop.tesla.com", "tesla.com", "shop", "tesla",
+    "com"), a CIDR range also yields its base address, and an address or hostname
+    with a port also yields the host and the port ("evil.com:443" -> "evil.com:443",
+    "evil.com", "443", "evil", "com").
+    """
+    terms = []
+    for kind, token in iter_tokens(text):
+        terms.append(token)
+        host = token
+        if kind in ("ipv4", "fqdn") and ":" in token:
+            host, port = token.rsplit(":", 1)
+            terms.extend((host, port))
+        if kind == "fqdn" and "." in host:
+            labels = host.lstrip("*.").split(".")
+            terms.extend(".".join(labels[i:]) for i in range(1, len(labels) - 1))
+            terms.extend(labels)
+        elif "/" in token:
+            terms.append(token.split("/")[0])
+    return terms
+
+
+def is_identifier_query(query):
+    """Returns True if the query consists only of security tokens (no plain words)."""
+    kinds = [kind for kind, _ in iter_tokens(query)]
+    return bool(kinds) and "word" not in kinds
+
+
+def iter_store_texts(vector_store, batch_size=1000):
+    """
+    Yields the ``(id, text)`` pairs of the chunks in a Chroma or FlatVectorStore.
+
+    :param vector_store: A LangChain Chroma store or a FlatVectorStore (or subclass).
+    :param batch_size: Number of chunks read at a time.
+    """
+    if isinstance(vector_store, FlatVectorStore):
+        live = [p for p in range(vector_store._info["count"]) if p not in vector_store._deleted]
+        for start in range(0, len(live), batch_size):
+            for record in vector_store._read_records(live[start:start + batch_size]):
+                yield record["id"], record["text"]
+        return
+    collection = vector_store._collection
+    total = collection.count()
+    for offset in range(0, total, batch_size):
+        data = collection.get(include=["documents"], limit=batch_size, offset=offset)
+        yield from zip(data["ids"], data["documents"])
+
+
+class BM25Index:
+    """
+    A persistent BM25 inverted index over chunk IDs.
+
+    The index stores only IDs and postings; the chunk texts and metadata are
+    fetched from the vector store it was built from.
+
+    Example:
+        index = BM25Index.from_vector_store(db, "db/chroma_db_bm25")
+        index.search("CVE-2021-44228", k=5)  # -> [(chunk_id, score), ...]
+    """
+
+    def __init__(self, persist_directory):
+        """
+        :param persist_directory: Directory of an index written by build().
+        """
+        self.persist_directory = persist_directory
+        with open(os.path.join(persist_directory, HEADER_FILENAME), "r", encoding="utf-8") as f:
+            header = json.load(f)
+        self.k1 = header["k1"]
+        self.b = header["b"]
+        self.ids = header["ids"]
+        self._term_ids = {term: i for i, term in enumerate(header["terms"])}
+        arrays = {
+            name: np.load(os.path.join(persist_directory, f"{name}.npy"), mmap_mode="r")
+            for name in ARRAY_FILENAMES
+        }
+        self._postings = arrays["postings"]
+        self._frequencies = arrays["frequencies"]
+        self._term_offsets = arrays["term_offsets"]
+        self._doc_lengths = np.asarray(arrays["doc_lengths"], dtype=np.float32)
+        self._average_length = float(self._doc_lengths.mean()) if len(self.ids) else 0.0
+
+    @staticmethod
+    def exists(persist_directory):
+        """Returns True if an index has been written to the directory."""
+        return os.path.exists(os.path.join(persist_directory, HEADER_FILENAME))
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def build(cls, chunks, persist_directory, k1=1.2, b=0.75):
+        """
+        Builds an index and writes it to a directory.
+
+        The index is written to a temporary directory and then moved into place,
+        so processes that have the previous index open keep reading a consistent copy.
+
+        :param chunks: An iterable of ``(id, text)`` pairs.
+        :param persist_directory: Directory of the index (replaced if it exists).
+        :param k1: BM25 term frequency saturation.
+        :param b: BM25 document length normalization.
+        :return: The new index.
+        """
+        ids, doc_lengths = [], []
+        term_ids, postings, frequencies = {}, [], []
+        for position, (chunk_id, text) in enumerate(chunks):
+            counts = Counter(tokenize(text or ""))
+            ids.append(chunk_id)
+            doc_lengths.append(sum(counts.values()))
+            for term, count in counts.items():
+                term_id = term_ids.setdefault(term, len(term_ids))
+                if term_id == len(postings):
+                    postings.append([])
+                    frequencies.append([])
+                postings[term_id].append(position)
+                frequencies[term_id].append(min(count, np.iinfo(np.uint16).max))
+
+        # Store the postings term after term, in vocabulary order
+        terms = sorted(term_ids)
+        order = [term_ids[term] for term in terms]
+        lengths = np.array([len(postings[i]) for i in order], dtype=np.int64)
+        arrays = {
+            "postings": np.fromiter(
+                (p for i in order for p in postings[i]), dtype=np.uint32, count=int(lengths.sum())
+            ),
+            "frequencies": np.fromiter(
+                (f for i in order for f in frequencies[i]), dtype=np.uint16, count=int(lengths.sum())
+            ),
+            "term_offsets": np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64),
+            "doc_lengths": np.array(doc_lengths, dtype=np.uint32),
+        }
+
+        staging_directory = persist_directory.rstrip(os.sep) + ".tmp"
+        shutil.rmtree(staging_directory, ignore_errors=True)
+        os.makedirs(staging_directory)
+        for name, array in arrays.items():
+            np.save(os.path.join(staging_directory, f"{name}.npy"), array)
+        with open(os.path.join(staging_directory, HEADER_FILENAME), "w", encoding="utf-8") as f:
+            json.dump({"k1": k1, "b": b, "ids": ids, "terms": terms}, f)
+        shutil.rmtree(persist_directory, ignore_errors=True)
+        os.replace(staging_directory, persist_directory)
+        return cls(persist_directory)
+
+    @classmethod
+    def from_vector_store(cls, vector_store, persist_directory, batch_size=1000, **kwargs):
+        """
+        Builds an index over the chunks of a Chroma or flat vector store.
+
+        :param vector_store: The vector store to index.
+        :param persist_directory: Directory of the index (replaced if it exists).
+        :param batch_size: Number of chunks read from the store at a time.
+        :param kwargs: BM25 parameters (k1, b).
+        :return: The new index.
+        """
+        return cls.build(iter_store_texts(vector_store, batch_size), persist_directory, **kwargs)
+
+    def score(self, query):
+        """
+        Computes the BM25 score of every chunk for a query.
+
+        :return: A float32 array with one score per chunk (0 when no term matches).
+        """
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        for term in set(tokenize(query)):
+            term_id = self._term_ids.get(term)
+            if term_id is None:
+                continue
+            start, stop = self._term_offsets[term_id], self._term_offsets[term_id + 1]
+            positions = self._postings[start:stop]
+            frequencies = np.asarray(self._frequencies[start:stop], dtype=np.float32)
+            idf = np.log(1.0 + (len(self.ids) - len(positions) + 0.5) / (len(positions) + 0.5))
+            length_norm = self.k1 * (
+                1.0 - self.b + self.b * self._doc_lengths[positions] / self._average_length
+            )
+            # A term appears at most once in the postings of a chunk
+            scores[positions] += idf * frequencies * (self.k1 + 1.0) / (frequencies + length_norm)
+        return scores
+
+    def search(self, query, k=4):
+        """
+        Returns the k best matching chunks for a query.
+
+        :return: A list of ``(chunk_id, score)`` pairs, best first. Chunks that do not
+            contain any query term are not returned.
+        """
+        if not self.ids:
+            return []
+        scores = self.score(query)
+        return [
+            (self.ids[position], float(scores[position]))
+            for position in top_k_indices(scores[None, :], k)[0]
+            if scores[position] > 0
+        ]
+
+
+def open_bm25_index(store_directory, vector_store, index_directory=None, **kwargs):
+    """
+    Opens the BM25 index of a vector store, building it first if it is missing or
+    older than the store (the Chroma database file or the flat store header).
+
+    :param store_directory: The persist directory of the vector store.
+    :param vector_store: The opened vector store (Chroma or FlatVectorStore).
+    :param index_directory: Directory of the index. Defaults to the store
+        directory with a "_bm25" suffix.
+    :param kwargs: BM25 parameters used when building (k1, b).
+    :return: A BM25Index.
+    """
+    index_directory = index_directory or store_directory.rstrip(os.sep) + "_bm25"
+    header_path = os.path.join(index_directory, HEADER_FILENAME)
+    source_files = [
+        os.path.join(store_directory, name) for name in ("chroma.sqlite3", INDEX_FILENAME)
+    ]
+    source_mtime = max((os.path.getmtime(p) for p in source_files if os.path.exists(p)), default=0)
+    if not os.path.exists(header_path) or source_mtime > os.path.getmtime(header_path):
+        return BM25Index.from_vector_store(vector_store, index_directory, **kwargs)
+    return BM25Index(index_directory)
+
+
+def reciprocal_rank_fusion(rankings, rrf_k=60):
+    """
+    Fuses several ranked lists of keys.
+
+    :param rankings: A list of ranked key lists, best first.
+    :param rrf_k: Damping constant; higher values flatten the rank differences.
+    :return: A list of ``(key, fused_score)`` pairs, best first.
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking, 1):
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    A LangChain retriever that fuses vector and BM25 results with RRF.
+
+    Example:
+        bm25 = open_bm25_index(persistent_directory, db)
+        retriever = HybridRetriever(vector_store=db, lexical_index=bm25, k=3)
+        retriever.invoke("What hosts are in Amazon?")
+
+    Each returned document carries its fused score in ``metadata["rrf_score"]``.
+    """
+
+    vector_store: VectorStore
+    lexical_index: BM25Index
+    k: int = 4
+    # Number of candidates taken from each search before fusion
+    fetch_k: int = 20
+    rrf_k: int = 60
+    # "hybrid", "vector" (dense only) or "lexical" (BM25 only, no embedding call)
+    search_type: str = "hybrid"
+    # Answer queries made only of security tokens with BM25 alone
+    lexical_only_for_identifiers: bool = True
+    # Optional metadata filter for both searches, e.g. {"source": "data/tesla.json"}
+    # (see utils/metadata_index.py for the operators)
+    filter: dict | None = None
+
+    model_config = {"arbitrary_types_allowed": True}
+
+    def _vector_search(self, query):
+        # Returns the fetch_k nearest chunks. For Chroma, the collection is queried
+        # directly so that every hit carries its Chroma ID, the key of the BM25
+        # results (the Chroma class of langchain_community returns no IDs).
+        store = self.vector_store
+        if hasattr(store, "_collection"):
+            data = store._collection.query(
+                query_embeddings=[store.embeddings.embed_query(query)],
+                n_results=self.fetch_k,
+                where=self.filter or None,
+                include=["documents", "metadatas"],
+            )
+            return [
+                Document(id=chunk_id, page_content=text, metadata=metadata or {})
+                for chunk_id, text, metadata in zip(
+                    data["ids"][0], data["documents"][0], data["metadatas"][0]
+                )
+            ]
+        if self.filter:
+            return store.similarity_search(query, k=self.fetch_k, filter=self.filter)
+        return store.similarity_search(query, k=self.fetch_k)
+
+    def _get_by_ids(self, ids):
+        # Fetches the chunks found by BM25 only (Chroma is read through its collection,
+        # since not every Chroma class implements get_by_ids())
+        store = self.vector_store
+        if hasattr(store, "_collection"):
+            data = store._collection.get(ids=ids, include=["documents", "metadatas"])
+            return [
+                Document(id=chunk_id, page_content=text, metadata=metadata or {})
+                for chunk_id, text, metadata in zip(data["ids"], data["documents"], data["metadatas"])
+            ]
+        return store.get_by_ids(ids)
+
+    def _get_relevant_documents(self, query, *, run_manager: CallbackManagerForRetrieverRun):
+        search_type = self.search_type
+        if search_type == "hybrid" and self.lexical_only_for_identifiers and is_identifier_query(query):
+            search_type = "lexical"
+
+        documents, rankings = {}, []
+        # Vector hits of a store that returns no IDs are keyed by their text
+        text_keys = {}
+        if search_type in ("hybrid", "vector"):
+            vector_documents = self._vector_search(query)
+            for document in vector_documents:
+                key = document.id or document.page_content
+                documents.setdefault(key, document)
+                if not document.id:
+                    text_keys.setdefault(document.page_content, key)
+            rankings.append([document.id or document.page_content for document in vector_documents])
+        if search_type in ("hybrid", "lexical"):
+            if self.filter:
+                lexical_ids = self._filtered_lexical_ids(query, documents)
+            else:
+                lexical_ids = [
+                    chunk_id for chunk_id, _ in self.lexical_index.search(query, self.fetch_k)
+                ]
+                missing = [chunk_id for chunk_id in lexical_ids if chunk_id not in documents]
+                if missing:
+                    for document in self._get_by_ids(missing):
+                        documents[document.id] = document
+            if text_keys:
+                # The same chunk must be one key in both rankings to be fused
+                lexical_ids = [
+                    text_keys.get(documents[chunk_id].page_content, chunk_id)
+                    if chunk_id in documents
+                    else chunk_id
+                    for chunk_id in lexical_ids
+                ]
+            rankings.append(lexical_ids)
+
+        results = []
+        for key, score in reciprocal_rank_fusion(rankings, self.rrf_k):
+            if key in documents and len(results) < self.k:
+                document = documents[key]
+                results.append(
+                    Document(
+                        id=document.id,
+                        page_content=document.page_content,
+                        metadata={**document.metadata, "rrf_score": round(score, 6)},
+                    )
+                )
+        return results
+
+    def _filtered_lexical_ids(self, query, documents):
+        # Walks down all chunks that contain a query term, best first, until
+        # fetch_k of them match the filter (the index itself has no metadata)
+        ranked = [
+            chunk_id
+            for chunk_id, _ in self.lexical_index.search(query, len(self.lexical_index.ids))
+        ]
+        lexical_ids = []
+        for start in range(0, len(ranked), self.fetch_k):
+            batch = ranked[start:start + self.fetch_k]
+            missing = [chunk_id for chunk_id in batch if chunk_id not in documents]
+            fetched = {document.id: document for document in self._get_by_ids(missing)}
+            for chunk_id in batch:
+                document = documents.get(chunk_id) or fetched.get(chunk_id)
+                if document is not None and matches_filter(document.metadata, self.filter):
+                    documents[chunk_id] = document
+                    lexical_ids.append(chunk_id)
+                    if len(lexical_ids) == self.fetch_k:
+                        return lexical_ids
+        return lexical_ids
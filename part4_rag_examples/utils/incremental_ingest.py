@@ -0,0 +1,215 @@
+# This module implements incremental, hash-based ingestion for a Chroma vector store.
+# Instead of rebuilding the whole store whenever a file is added or modified, it keeps
+# a small JSON manifest with the SHA-256 of every ingested file and the IDs of the
+# chunks created from it. On each run only new or changed chunks are embedded and
+# upserted, and chunks whose source file changed or disappeared are deleted.
+
+# Instructor: Omar Santos @santosomar
+
+import hashlib
+import json
+import os
+import tempfile
+
+MANIFEST_FILENAME = "ingest_manifest.json"
+MANIFEST_VERSION = 1
+
+
+def file_sha256(file_path, block_size=1 << 20):
+    """
+    Computes the SHA-256 digest of a file without reading it into memory at once.
+
+    :param file_path: Path of the file to hash.
+    :param block_size: Number of bytes read per iteration.
+    :return: The hex digest of the file content.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def chunk_sha256(text):
+    """
+    Computes the SHA-256 digest of a chunk of text.
+
+    :param text: The chunk content.
+    :return: The hex digest of the UTF-8 encoded text.
+    """
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def assign_chunk_ids(source_key, chunks):
+    """
+    Derives stable IDs for the chunks of a single source file.
+
+    The ID depends only on the source and the chunk content (plus an occurrence
+    counter for chunks that repeat inside the same file), so an unchanged chunk
+    keeps its ID even when other parts of the file are edited.
+
+    :param source_key: The key identifying the source file in the manifest.
+    :param chunks: The list of LangChain documents created from the file.
+    :return: A list of IDs, one per chunk, in the same order.
+    """
+    seen = {}
+    ids = []
+    for chunk in chunks:
+        content_hash = chunk_sha256(chunk.page_content)
+        occurrence = seen.get(content_hash, 0)
+        seen[content_hash] = occurrence + 1
+        ids.append(
+            hashlib.sha256(
+                f"{source_key}\x00{content_hash}\x00{occurrence}".encode("utf-8")
+            ).hexdigest()
+        )
+    return ids
+
+
+class IngestManifest:
+    """
+    Keeps track of the files and chunks that were written to a vector store.
+
+    The manifest maps each source file to its content hash and to the IDs of the
+    chunks that were created from it.
+    """
+
+    def __init__(self, path, files=None):
+        self.path = path
+        self.files = files or {}
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads a manifest from disk, returning an empty one if it does not exist.
+
+        :param path: Location of the manifest JSON file.
+        :return: An IngestManifest instance.
+        """
+        if not os.path.exists(path):
+            return cls(path)
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") != MANIFEST_VERSION:
+            raise ValueError(
+                f"Unsupported manifest version {data.get('version')} in {path}."
+            )
+        return cls(path, data.get("files", {}))
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def save(self):
+        """
+        Writes the manifest atomically so an interrupted run never leaves a
+        half-written file behind.
+        """
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(
+                    {"version": MANIFEST_VERSION, "files": self.files}, f, indent=2
+                )
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+
+def incremental_ingest(db, files_to_load, split_files, manifest_path):
+    """
+    Synchronizes a vector store with a list of files using a hash manifest.
+
+    Unchanged files are skipped without being loaded. For new or changed files,
+    only chunks whose content hash is not already stored are embedded and added,
+    and chunks that no longer exist are deleted. Files that were ingested before
+    but are no longer in ``files_to_load`` (or no longer exist) are removed.
+
+    :param db: A LangChain vector store supporting ``add_documents(ids=...)``,
+        ``delete(ids=...)`` and ``get()`` (e.g., Chroma).
+    :param files_to_load: The list of file paths that should be in the store.
+    :param split_files: A callable that takes a list of file paths and yields
+        ``(file_path, chunks)`` pairs, where chunks is the list of LangChain
+        documents for that file. Files it does not yield (e.g., because they
+        failed to load) keep their previous chunks.
+    :param manifest_path: Location of the manifest JSON file.
+    :return: A dictionary with statistics about the run.
+    """
+    manifest = IngestManifest.load(manifest_path)
+    stats = {
+        "files_unchanged": 0,
+        "files_changed": 0,
+        "files_removed": 0,
+        "chunks_added": 0,
+        "chunks_deleted": 0,
+        "chunks_kept": 0,
+    }
+
+    # A store created before the manifest existed holds chunks with random IDs
+    # that cannot be matched against content hashes. Remove them once so the
+    # store and the manifest agree from now on.
+    if not manifest.exists():
+        legacy_ids = db.get(include=[])["ids"]
+        if legacy_ids:
+            print(
+                f"No manifest found. Removing {len(legacy_ids)} chunks "
+                "that were ingested without content hashes."
+            )
+            db.delete(ids=legacy_ids)
+            stats["chunks_deleted"] += len(legacy_ids)
+
+    wanted = [path for path in files_to_load if os.path.exists(path)]
+    for path in files_to_load:
+        if path not in wanted:
+            print(f"Warning: The file {path} does not exist. Skipping.")
+
+    # Drop chunks from files that disappeared or were removed from the list
+    for source_key in list(manifest.files):
+        if source_key not in wanted:
+            stale_ids = manifest.files.pop(source_key)["chunks"]
+            if stale_ids:
+                db.delete(ids=stale_ids)
+            stats["files_removed"] += 1
+            stats["chunks_deleted"] += len(stale_ids)
+            print(f"-> Removed: {os.path.basename(source_key)} ({len(stale_ids)} chunks)")
+
+    changed = {}
+    for file_path in wanted:
+        file_hash = file_sha256(file_path)
+        entry = manifest.files.get(file_path)
+        if entry and entry["sha256"] == file_hash:
+            stats["files_unchanged"] += 1
+            stats["chunks_kept"] += len(entry["chunks"])
+            print(f"-> Unchanged: {os.path.basename(file_path)}")
+        else:
+            changed[file_path] = file_hash
+
+    for file_path, chunks in split_files(list(changed)):
+        file_hash = changed[file_path]
+        entry = manifest.files.get(file_path)
+        ids = assign_chunk_ids(file_path, chunks)
+        old_ids = set(entry["chunks"]) if entry else set()
+        new_id_set = set(ids)
+
+        to_add = [(i, c) for i, c in zip(ids, chunks) if i not in old_ids]
+        to_delete = [i for i in old_ids if i not in new_id_set]
+
+        if to_add:
+            db.add_documents([c for _, c in to_add], ids=[i for i, _ in to_add])
+        if to_delete:
+            db.delete(ids=to_delete)
+
+        manifest.files[file_path] = {"sha256": file_hash, "chunks": ids}
+        # Save after every file so an interrupted run does not redo finished work
+        manifest.save()
+
+        stats["files_changed"] += 1
+        stats["chunks_added"] += len(to_add)
+        stats["chunks_deleted"] += len(to_delete)
+        stats["chunks_kept"] += len(ids) - len(to_add)
+
+    manifest.save()
+    return stats
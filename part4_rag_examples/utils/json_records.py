@@ -0,0 +1,197 @@
+# This module provides a streaming, record-aware loader for large JSON arrays such
+# as certificate-transparency (CT) dumps (see data/tesla.json).
+#
+# Loading a JSON dump with TextLoader reads the whole file into memory, and character
+# splitters then cut records in half. JSONRecordLoader instead parses the array
+# incrementally, one record at a time, and emits either one chunk per record or packs
+# of whole records that fit within a token budget. Useful fields such as the issuer,
+# the host names and the validity dates are lifted into the chunk metadata so they
+# can be displayed and filtered on.
+
+# Instructor: Omar Santos @santosomar
+
+import json
+
+from langchain_core.document_loaders import BaseLoader
+from langchain_core.documents import Document
+
+# Fields of crt.sh-style CT records that are copied into the chunk metadata
+CT_METADATA_FIELDS = (
+    "issuer_name",
+    "common_name",
+    "name_value",
+    "not_before",
+    "not_after",
+    "serial_number",
+)
+
+_WHITESPACE = " \t\r\n"
+
+
+def iter_json_records(file_path, buffer_size=1 << 16, encoding="utf-8"):
+    """
+    Yields the elements of a top-level JSON array one at a time.
+
+    Only a small buffer is kept in memory, so files of several gigabytes can be
+    processed. JSON Lines files (one object per line) are supported as well.
+
+    :param file_path: Path of the JSON file.
+    :param buffer_size: Number of characters read from the file at a time.
+    :param encoding: Encoding of the file.
+    :return: A generator of decoded records.
+    """
+    decoder = json.JSONDecoder()
+    with open(file_path, "r", encoding=encoding) as f:
+        buffer = ""
+        position = 0
+        in_array = None
+
+        def read_more():
+            # Appends the next block of the file to the unconsumed part of the buffer
+            nonlocal buffer, position
+            data = f.read(buffer_size)
+            if not data:
+                return False
+            buffer = buffer[position:] + data
+            position = 0
+            return True
+
+        while True:
+            # Skip whitespace, the opening bracket and the commas between records
+            while True:
+                while position < len(buffer) and buffer[position] in _WHITESPACE:
+                    position += 1
+                if position == len(buffer):
+                    if read_more():
+                        continue
+                    if in_array:
+                        raise ValueError(f"Unexpected end of file in {file_path}.")
+                    return
+                char = buffer[position]
+                if in_array is None:
+                    in_array = char == "["
+                    if in_array:
+                        position += 1
+                        continue
+                if in_array and char == ",":
+                    position += 1
+                    continue
+                if in_array and char == "]":
+                    return
+                break
+
+            # Decode the next record, reading more data until it is complete
+            while True:
+                try:
+                    record, end = decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError:
+                    if read_more():
+                        continue
+                    raise
+                # A number at the very end of the buffer may have been cut off
+                if (
+                    end == len(buffer)
+                    and not isinstance(record, (dict, list, str))
+                    and read_more()
+                ):
+                    continue
+                break
+
+            yield record
+            position = end
+
+
+def _lift_metadata(records, fields):
+    # Copies the given fields into metadata. For packs of records, distinct values
+    # are joined with "; " because vector stores only accept scalar metadata.
+    metadata = {}
+    for field in fields:
+        values = []
+        for record in records:
+            value = record.get(field) if isinstance(record, dict) else None
+            if value is not None and value not in values:
+                values.append(value)
+        if len(values) == 1:
+            metadata[field] = values[0]
+        elif values:
+            metadata[field] = "; ".join(str(value) for value in values)
+    return metadata
+
+
+def _default_token_counter():
+    # Imported lazily so tiktoken is only required when a token budget is used
+    from utils.embedding_executor import get_tokenizer
+
+    tokenizer = get_tokenizer()
+    return lambda text: len(tokenizer.encode_ordinary(text))
+
+
+class JSONRecordLoader(BaseLoader):
+    """
+    Streams a JSON array and emits whole records as chunks.
+
+    Example:
+        loader = JSONRecordLoader("data/tesla.json")             # one record per chunk
+        loader = JSONRecordLoader("data/tesla.json", max_tokens=512)  # record packs
+        docs = list(loader.lazy_load())
+    """
+
+    def __init__(
+        self,
+        file_path,
+        max_tokens=None,
+        metadata_fields=CT_METADATA_FIELDS,
+        length_function=None,
+        buffer_size=1 << 16,
+    ):
+        """
+        :param file_path: Path of the JSON file.
+        :param max_tokens: When set, consecutive records are packed into one chunk
+            as long as the chunk stays within this many tokens. A record larger
+            than the budget gets a chunk of its own. When None, every record is a
+            chunk.
+        :param metadata_fields: Record fields copied into the chunk metadata.
+        :param length_function: Function returning the length of a text in
+            tokens. Defaults to tiktoken's cl100k_base encoding.
+        :param buffer_size: Number of characters read from the file at a time.
+        """
+        self.file_path = file_path
+        self.max_tokens = max_tokens
+        self.metadata_fields = metadata_fields
+        self.length_function = length_function
+        self.buffer_size = buffer_size
+
+    def _make_document(self, texts, records, first_index):
+        metadata = {
+            "source": self.file_path,
+            "record_index": first_index,
+            "record_count": len(records),
+        }
+        metadata.update(_lift_metadata(records, self.metadata_fields))
+        return Document(page_content="\n".join(texts), metadata=metadata)
+
+    def lazy_load(self):
+        records = iter_json_records(self.file_path, self.buffer_size)
+        if self.max_tokens is None:
+            for index, record in enumerate(records):
+                yield self._make_document(
+                    [json.dumps(record, ensure_ascii=False)], [record], index
+                )
+            return
+
+        length_function = self.length_function or _default_token_counter()
+        pack_texts, pack_records, pack_tokens, first_index = [], [], 0, 0
+        for index, record in enumerate(records):
+            text = json.dumps(record, ensure_ascii=False)
+            # +1 accounts for the newline between records
+            tokens = length_function(text) + 1
+            if pack_records and pack_tokens + tokens > self.max_tokens:
+                yield self._make_document(pack_texts, pack_records, first_index)
+                pack_texts, pack_records, pack_tokens = [], [], 0
+            if not pack_records:
+                first_index = index
+            pack_texts.append(text)
+            pack_records.append(record)
+            pack_tokens += tokens
+        if pack_records:
+            yield self._make_document(pack_texts, pack_records, first_index)
@@ -0,0 +1,71 @@
+# This module provides a deterministic, offline embedding model for benchmarks and
+# tests. HashingEmbeddings maps the words (and word pairs) of a text into a
+# fixed-size vector with the "hashing trick" and normalizes it to unit length. The
+# vectors capture lexical overlap, not meaning, but they are fast, need no network
+# access or model download, and always return the same vector for the same text, so
+# timings and retrieval results are reproducible from run to run.
+
+# Instructor: Omar Santos @santosomar
+
+import hashlib
+import math
+import re
+import time
+
+from langchain_core.embeddings import Embeddings
+
+_TOKEN = re.compile(r"[a-z0-9]+(?:[.\-_:/][a-z0-9]+)*")
+
+
+def _bucket(feature, size):
+    # Returns the index and sign of a feature in the hashed vector
+    digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+    value = int.from_bytes(digest, "little")
+    return value % size, 1.0 if (value >> 63) & 1 else -1.0
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    A deterministic local embedder based on feature hashing.
+
+    Example:
+        embeddings = HashingEmbeddings(size=384)
+        db = Chroma.from_documents(docs, embeddings, persist_directory=...)
+    """
+
+    def __init__(self, size=384, use_bigrams=True, latency_seconds=0.0):
+        """
+        :param size: Number of dimensions of the vectors.
+        :param use_bigrams: Also hash pairs of adjacent words (captures a bit of
+            word order and improves precision).
+        :param latency_seconds: Simulated latency per embedding call, to mimic a
+            remote API in benchmarks.
+        """
+        self.size = size
+        self.use_bigrams = use_bigrams
+        self.latency_seconds = latency_seconds
+        self.model = f"hashing-{size}{'-bigrams' if use_bigrams else ''}"
+
+    def _embed(self, text):
+        vector = [0.0] * self.size
+        words = _TOKEN.findall(text.lower())
+        features = list(words)
+        if self.use_bigrams:
+            features += [f"{a} {b}" for a, b in zip(words, words[1:])]
+        for feature in features:
+            index, sign = _bucket(feature, self.size)
+            vector[index] += sign
+        norm = math.sqrt(sum(value * value for value in vector))
+        if norm:
+            vector = [value / norm for value in vector]
+        return vector
+
+    def embed_documents(self, texts):
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+        return self._embed(text)
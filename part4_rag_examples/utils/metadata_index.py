@@ -0,0 +1,344 @@
+# This module provides secondary indexes on chunk metadata, so that a filtered
+# similarity search only scores the chunks that match the filter.
+#
+# For every scalar metadata field (e.g., source, issuer_name, not_after) the index
+# keeps the row positions sorted by value:
+#
+#   strings - the sorted distinct values, and the positions of each value stored
+#             one after the other (a value, or a range of values, is one slice)
+#   numbers - the values sorted in a float64 array, with their positions (booleans
+#             are indexed the same way, separately, since True is not 1 in a filter)
+#
+# Equality and $in lookups are binary searches, and range lookups ($gt, $gte, $lt,
+# $lte) are two binary searches that select a contiguous slice. ISO dates such as
+# "2024-08-05T08:08:48" sort correctly as strings, so date ranges work without any
+# conversion: {"not_after": {"$gte": "2024-11-01"}}.
+#
+# Filters use the Chroma "where" syntax, so the same filter works with a Chroma
+# store and with the stores of this directory:
+#
+#   {"source": "data/ssrf.txt"}                               equality
+#   {"issuer_name": {"$contains": "Let's Encrypt"}}           substring
+#   {"$and": [{"source": "data/tesla.json"},
+#             {"not_after": {"$gte": "2024-11-01"}}]}         combinations
+#
+# Supported operators: $eq, $ne, $gt, $gte, $lt, $lte, $in, $nin, $contains, $and
+# and $or. ($contains on metadata is an addition of these stores; Chroma only
+# supports it on the document text.)
+
+# Instructor: Omar Santos @santosomar
+
+import json
+import os
+
+import numpy as np
+
+_COMPARISONS = {
+    "$gt": lambda a, b: a > b,
+    "$gte": lambda a, b: a >= b,
+    "$lt": lambda a, b: a < b,
+    "$lte": lambda a, b: a <= b,
+}
+OPERATORS = {"$eq", "$ne", "$in", "$nin", "$contains", *_COMPARISONS}
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _comparable(a, b):
+    # Numbers are only compared with numbers, and strings with strings
+    if isinstance(a, bool) or isinstance(b, bool):
+        return isinstance(a, bool) and isinstance(b, bool)
+    return (_is_number(a) and _is_number(b)) or (isinstance(a, str) and isinstance(b, str))
+
+
+def _split_condition(field, condition):
+    # {"field": value} is short for {"field": {"$eq": value}}
+    if isinstance(condition, dict):
+        if len(condition) != 1:
+            raise ValueError(f"The condition on {field!r} must have exactly one operator.")
+        return next(iter(condition.items()))
+    return "$eq", condition
+
+
+def _iter_conditions(filter):
+    # Yields the (field, operator, value) conditions of a filter and its sub-filters
+    for key, value in filter.items():
+        if key in ("$and", "$or"):
+            for sub_filter in value:
+                yield from _iter_conditions(sub_filter)
+        else:
+            yield (key, *_split_condition(key, value))
+
+
+def matches_filter(metadata, filter):
+    """
+    Returns True if a metadata dictionary matches a filter.
+
+    :param metadata: The metadata of a chunk.
+    :param filter: A filter in the Chroma "where" syntax (see the module comment).
+    """
+    for key, value in filter.items():
+        if key == "$and":
+            if not all(matches_filter(metadata, sub_filter) for sub_filter in value):
+                return False
+        elif key == "$or":
+            if not any(matches_filter(metadata, sub_filter) for sub_filter in value):
+                return False
+        else:
+            operator, operand = _split_condition(key, value)
+            if not _matches_condition(metadata, key, operator, operand):
+                return False
+    return True
+
+
+def _matches_condition(metadata, field, operator, operand):
+    if field not in metadata:
+        return False
+    value = metadata[field]
+    if operator == "$eq":
+        return _comparable(value, operand) and value == operand
+    if operator == "$ne":
+        return not (_comparable(value, operand) and value == operand)
+    if operator == "$in":
+        return any(_comparable(value, item) and value == item for item in operand)
+    if operator == "$nin":
+        return not any(_comparable(value, item) and value == item for item in operand)
+    if operator == "$contains":
+        return isinstance(value, str) and isinstance(operand, str) and operand in value
+    if operator in _COMPARISONS:
+        return _comparable(value, operand) and _COMPARISONS[operator](value, operand)
+    raise ValueError(f"Unsupported filter operator {operator!r}.")
+
+
+class _StringField:
+    """Positions of a string field, grouped by value in sorted value order."""
+
+    def __init__(self, values=None, offsets=None, positions=None):
+        self.values = values if values is not None else np.array([], dtype=str)
+        self.offsets = offsets if offsets is not None else np.zeros(1, dtype=np.int64)
+        self.positions = positions if positions is not None else np.array([], dtype=np.uint32)
+
+    def add(self, items):
+        # items: list of (position, value); re-sorts everything (adds are batched)
+        old_lengths = np.diff(self.offsets)
+        values = np.concatenate([np.repeat(self.values, old_lengths), [v for _, v in items]])
+        positions = np.concatenate([self.positions, [p for p, _ in items]]).astype(np.uint32)
+        order = np.lexsort((positions, values))
+        values, self.positions = values[order], positions[order]
+        self.values, starts = np.unique(values, return_index=True)
+        self.offsets = np.append(starts, len(values)).astype(np.int64)
+
+    def value_range(self, low=None, high=None, include_low=True, include_high=True):
+        lo = 0 if low is None else np.searchsorted(self.values, low, "left" if include_low else "right")
+        hi = (
+            len(self.values)
+            if high is None
+            else np.searchsorted(self.values, high, "right" if include_high else "left")
+        )
+        return self.positions[self.offsets[lo]:self.offsets[max(lo, hi)]]
+
+    def containing(self, substring):
+        selected = np.flatnonzero(np.char.find(self.values, substring) >= 0)
+        return np.concatenate(
+            [self.positions[self.offsets[i]:self.offsets[i + 1]] for i in selected]
+            or [np.array([], dtype=np.uint32)]
+        )
+
+
+class _NumberField:
+    """Positions of a numeric field, sorted by value."""
+
+    def __init__(self, values=None, positions=None):
+        self.values = values if values is not None else np.array([], dtype=np.float64)
+        self.positions = positions if positions is not None else np.array([], dtype=np.uint32)
+
+    def add(self, items):
+        values = np.concatenate([self.values, [float(v) for _, v in items]])
+        positions = np.concatenate([self.positions, [p for p, _ in items]]).astype(np.uint32)
+        order = np.lexsort((positions, values))
+        self.values, self.positions = values[order], positions[order]
+
+    def value_range(self, low=None, high=None, include_low=True, include_high=True):
+        lo = 0 if low is None else np.searchsorted(self.values, low, "left" if include_low else "right")
+        hi = (
+            len(self.values)
+            if high is None
+            else np.searchsorted(self.values, high, "right" if include_high else "left")
+        )
+        return self.positions[lo:max(lo, hi)]
+
+
+class MetadataIndex:
+    """
+    Secondary indexes on the scalar metadata fields of the rows of a store.
+
+    Example:
+        index = MetadataIndex()
+        index.add(0, [doc.metadata for doc in chunks])
+        mask = index.mask({"issuer_name": {"$contains": "Amazon"}}, len(chunks))
+    """
+
+    def __init__(self):
+        self.count = 0
+        self._strings = {}
+        self._numbers = {}
+        self._booleans = {}
+        # Fields with list or dictionary values somewhere; filters on them fall
+        # back to reading the records
+        self.unindexed_fields = set()
+
+    @property
+    def fields(self):
+        return sorted(set(self._strings) | set(self._numbers) | set(self._booleans))
+
+    def add(self, start, metadatas):
+        """
+        Indexes the metadata of the rows ``start``, ``start + 1``, ...
+
+        :param start: Position of the first row.
+        :param metadatas: The metadata dictionaries of the rows.
+        """
+        strings, numbers, booleans = {}, {}, {}
+        for position, metadata in enumerate(metadatas, start):
+            for field, value in (metadata or {}).items():
+                if isinstance(value, str):
+                    strings.setdefault(field, []).append((position, value))
+                elif isinstance(value, bool):
+                    booleans.setdefault(field, []).append((position, value))
+                elif isinstance(value, (int, float)) and value == value:  # skip NaN
+                    numbers.setdefault(field, []).append((position, value))
+                elif value is not None:
+                    self.unindexed_fields.add(field)
+        for field, items in strings.items():
+            self._strings.setdefault(field, _StringField()).add(items)
+        for field, items in numbers.items():
+            self._numbers.setdefault(field, _NumberField()).add(items)
+        for field, items in booleans.items():
+            self._booleans.setdefault(field, _NumberField()).add(items)
+        self.count = max(self.count, start + len(metadatas))
+
+    def can_evaluate(self, filter):
+        """Returns True if the filter only uses indexed fields and known operators."""
+        return all(
+            field not in self.unindexed_fields and operator in OPERATORS
+            for field, operator, _ in _iter_conditions(filter)
+        )
+
+    def _index_for(self, field, value):
+        # The index of the field that holds values of the type of ``value``
+        if isinstance(value, str):
+            return self._strings.get(field)
+        if isinstance(value, bool):
+            return self._booleans.get(field)
+        if isinstance(value, (int, float)):
+            return self._numbers.get(field)
+        return None
+
+    def _positions(self, field, operator, operand):
+        # Returns a list of position arrays, whose union matches the condition
+        if operator == "$eq" or operator == "$in":
+            parts = []
+            for item in operand if operator == "$in" else [operand]:
+                index = self._index_for(field, item)
+                if index is not None:
+                    parts.append(index.value_range(item, item))
+            return parts
+        index = self._index_for(field, operand)
+        if index is None:
+            return []
+        if operator == "$contains":
+            return [index.containing(operand)] if isinstance(index, _StringField) else []
+        # Range comparisons
+        bounds = {
+            "$gt": {"low": operand, "include_low": False},
+            "$gte": {"low": operand},
+            "$lt": {"high": operand, "include_high": False},
+            "$lte": {"high": operand},
+        }[operator]
+        return [index.value_range(**bounds)]
+
+    def _field_mask(self, field, count):
+        mask = np.zeros(count, dtype=bool)
+        for index in (self._strings.get(field), self._numbers.get(field), self._booleans.get(field)):
+            if index is not None:
+                mask[index.positions[index.positions < count]] = True
+        return mask
+
+    def mask(self, filter, count):
+        """
+        Evaluates a filter with the indexes.
+
+        :param filter: A filter in the Chroma "where" syntax.
+        :param count: Number of rows of the store.
+        :return: A boolean array with one entry per row, or None if the filter uses
+            a field or operator that is not indexed.
+        """
+        if not self.can_evaluate(filter):
+            return None
+        result = np.ones(count, dtype=bool)
+        for key, value in filter.items():
+            if key in ("$and", "$or"):
+                masks = [self.mask(sub_filter, count) for sub_filter in value]
+                if key == "$and":
+                    sub_mask = np.logical_and.reduce(masks) if masks else np.ones(count, dtype=bool)
+                else:
+                    sub_mask = np.logical_or.reduce(masks) if masks else np.zeros(count, dtype=bool)
+            else:
+                operator, operand = _split_condition(key, value)
+                negate = {"$ne": "$eq", "$nin": "$in"}.get(operator)
+                sub_mask = np.zeros(count, dtype=bool)
+                for positions in self._positions(key, negate or operator, operand):
+                    sub_mask[positions[positions < count]] = True
+                if negate:
+                    # Rows that have the field, but not the value
+                    sub_mask = self._field_mask(key, count) & ~sub_mask
+            result &= sub_mask
+        return result
+
+    def save(self, path):
+        """Writes the index to a .npz file."""
+        arrays = {}
+        header = {
+            "count": self.count,
+            "unindexed_fields": sorted(self.unindexed_fields),
+            "strings": [],
+            "numbers": [],
+            "booleans": [],
+        }
+        for i, (field, index) in enumerate(sorted(self._strings.items())):
+            header["strings"].append(field)
+            arrays[f"s{i}_values"] = index.values
+            arrays[f"s{i}_offsets"] = index.offsets
+            arrays[f"s{i}_positions"] = index.positions
+        for i, (field, index) in enumerate(sorted(self._numbers.items())):
+            header["numbers"].append(field)
+            arrays[f"n{i}_values"] = index.values
+            arrays[f"n{i}_positions"] = index.positions
+        for i, (field, index) in enumerate(sorted(self._booleans.items())):
+            header["booleans"].append(field)
+            arrays[f"b{i}_values"] = index.values
+            arrays[f"b{i}_positions"] = index.positions
+        with open(path + ".tmp", "wb") as f:
+            np.savez(f, header=np.array(json.dumps(header)), **arrays)
+        # Replace the previous file only once the new one is complete
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, path):
+        """Reads an index written by save()."""
+        index = cls()
+        with np.load(path) as data:
+            header = json.loads(str(data["header"]))
+            index.count = header["count"]
+            index.unindexed_fields = set(header["unindexed_fields"])
+            for i, field in enumerate(header["strings"]):
+                index._strings[field] = _StringField(
+                    data[f"s{i}_values"], data[f"s{i}_offsets"], data[f"s{i}_positions"]
+                )
+            for i, field in enumerate(header["numbers"]):
+                index._numbers[field] = _NumberField(data[f"n{i}_values"], data[f"n{i}_positions"])
+            for i, field in enumerate(header["booleans"]):
+                index._booleans[field] = _NumberField(data[f"b{i}_values"], data[f"b{i}_positions"])
+        return index
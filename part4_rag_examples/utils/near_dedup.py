@@ -0,0 +1,174 @@
+# This module removes near-duplicate chunks before they are embedded.
+#
+# Certificate-transparency dumps such as data/tesla.json contain many records that
+# only differ by an ID or a timestamp, so character splitters produce lots of almost
+# identical chunks. Embedding all of them costs money and fills the top-k results of
+# every query with the same content.
+#
+# Each chunk is reduced to a MinHash signature of its word shingles. Locality
+# sensitive hashing (LSH) with banding finds candidate pairs in roughly linear time,
+# and candidates whose estimated Jaccard similarity is above a threshold are merged
+# into the first chunk seen (the representative). The representative keeps a list
+# of the chunks it replaced in its metadata.
+
+# Instructor: Omar Santos @santosomar
+
+import hashlib
+import json
+import re
+
+import numpy as np
+from langchain_core.documents import Document
+
+# A prime larger than 2**32 for the universal hash functions (a * x + b) % P
+_PRIME = np.uint64((1 << 32) + 15)
+_TOKEN = re.compile(r"\w+")
+
+
+def shingles(text, size=2):
+    """
+    Returns the set of word n-grams (shingles) of a text.
+
+    :param text: The text to shingle.
+    :param size: Number of words per shingle.
+    :return: A set of shingle strings.
+    """
+    words = _TOKEN.findall(text.lower())
+    if len(words) <= size:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+class MinHasher:
+    """Computes MinHash signatures with ``num_perm`` universal hash functions."""
+
+    def __init__(self, num_perm=128, seed=42):
+        rng = np.random.default_rng(seed)
+        # a < 2**31 and x < 2**32 keep a * x + b below 2**64 (no overflow)
+        self.a = rng.integers(1, 1 << 31, size=num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, 1 << 32, size=num_perm, dtype=np.uint64)
+        self.num_perm = num_perm
+
+    def signature(self, text, shingle_size=2):
+        hashes = np.fromiter(
+            (
+                int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=4).digest(), "little")
+                for s in shingles(text, shingle_size)
+            ),
+            dtype=np.uint64,
+        )
+        if hashes.size == 0:
+            return np.full(self.num_perm, np.iinfo(np.uint64).max, dtype=np.uint64)
+        # One row per hash function, one column per shingle
+        permuted = (np.outer(self.a, hashes) + self.b[:, None]) % _PRIME
+        return permuted.min(axis=1)
+
+
+class NearDuplicateIndex:
+    """
+    An LSH index over MinHash signatures that finds near-duplicate texts.
+
+    With ``bands`` bands of ``num_perm / bands`` rows, two texts become candidates
+    when at least one band matches exactly. Candidates are then confirmed by their
+    estimated Jaccard similarity (the fraction of equal signature values).
+    """
+
+    def __init__(self, threshold=0.8, num_perm=128, bands=16, shingle_size=2, seed=42):
+        """
+        :param threshold: Minimum estimated Jaccard similarity of near-duplicates.
+        :param num_perm: Number of MinHash functions (signature length).
+        :param bands: Number of LSH bands. ``num_perm`` must be divisible by it.
+            More bands find more candidates (higher recall, more comparisons).
+        :param shingle_size: Number of words per shingle.
+        :param seed: Seed of the hash functions, so results are reproducible.
+        """
+        if num_perm % bands:
+            raise ValueError("num_perm must be divisible by bands.")
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        self.hasher = MinHasher(num_perm, seed)
+        self.signatures = []
+        self._buckets = {}
+
+    def _band_keys(self, signature):
+        for band in range(self.bands):
+            yield band, signature[band * self.rows:(band + 1) * self.rows].tobytes()
+
+    def find(self, signature):
+        """
+        Returns the ID of the most similar indexed text above the threshold, or None.
+        """
+        candidates = set()
+        for key in self._band_keys(signature):
+            candidates.update(self._buckets.get(key, ()))
+        best, best_similarity = None, self.threshold
+        for candidate in sorted(candidates):
+            similarity = float(np.mean(self.signatures[candidate] == signature))
+            if similarity >= best_similarity:
+                best, best_similarity = candidate, similarity
+        return best
+
+    def add(self, text):
+        """
+        Adds a text unless it is a near-duplicate of an indexed one.
+
+        :return: A tuple ``(id, is_new)``. ``id`` is the ID of the new entry, or of
+            the existing entry the text duplicates.
+        """
+        signature = self.hasher.signature(text, self.shingle_size)
+        existing = self.find(signature)
+        if existing is not None:
+            return existing, False
+        new_id = len(self.signatures)
+        self.signatures.append(signature)
+        for key in self._band_keys(signature):
+            self._buckets.setdefault(key, []).append(new_id)
+        return new_id, True
+
+
+def deduplicate_documents(docs, threshold=0.8, num_perm=128, bands=16, shingle_size=2):
+    """
+    Collapses near-duplicate chunks to one representative each.
+
+    The first chunk of each group is kept, in the original order. Its metadata
+    gets ``duplicate_count`` (number of merged chunks) and ``merged_sources``, a
+    JSON-encoded list of the merged chunks' ``source`` and position. JSON strings
+    are used because vector stores such as Chroma only accept scalar metadata.
+
+    :param docs: The list of chunks (LangChain documents).
+    :return: A tuple ``(representatives, stats)``.
+    """
+    index = NearDuplicateIndex(threshold, num_perm, bands, shingle_size)
+    representatives = []
+    merged = {}
+    for position, doc in enumerate(docs):
+        entry_id, is_new = index.add(doc.page_content)
+        if is_new:
+            representatives.append(doc)
+            continue
+        reference = {"source": doc.metadata.get("source", "Unknown"), "chunk": position}
+        if "start_index" in doc.metadata:
+            reference["start_index"] = doc.metadata["start_index"]
+        merged.setdefault(entry_id, []).append(reference)
+
+    for entry_id, references in merged.items():
+        representative = representatives[entry_id]
+        representatives[entry_id] = Document(
+            page_content=representative.page_content,
+            metadata={
+                **representative.metadata,
+                "duplicate_count": len(references),
+                "merged_sources": json.dumps(references),
+            },
+        )
+
+    stats = {
+        "input_chunks": len(docs),
+        "output_chunks": len(representatives),
+        "removed_chunks": len(docs) - len(representatives),
+        "input_characters": sum(len(doc.page_content) for doc in docs),
+        "output_characters": sum(len(doc.page_content) for doc in representatives),
+    }
+    return representatives, stats
@@ -0,0 +1,307 @@
+# This module provides an offset-tracking version of RecursiveCharacterTextSplitter.
+#
+# The LangChain splitters cut the text into pieces, rejoin them into chunks, strip
+# them and, when add_start_index is set, search the source again to find where each
+# chunk came from. OffsetTextSplitter instead scans the source once and works on
+# (start, end) offsets only: a chunk is a contiguous span of the original text, and a
+# string is created only for the chunks that are actually returned. The source can be
+# a string or a memory-mapped file (mmap), so large files do not have to be read into
+# memory.
+#
+# Every chunk records its offsets in the metadata ("start_index"/"end_index" for
+# text, "start_byte"/"end_byte" for files). With the offsets, expand_context() can
+# widen or trim a retrieved chunk from the source at query time, so the overlap does
+# not have to be stored (and embedded) twice.
+
+# Instructor: Omar Santos @santosomar
+
+import mmap
+import os
+import re
+from collections import deque
+
+from langchain.text_splitter import TextSplitter
+from langchain_core.documents import Document
+
+DEFAULT_SEPARATORS = ["\n\n", "\n", " ", ""]
+
+
+def _is_continuation_byte(buffer, position):
+    # UTF-8 continuation bytes look like 10xxxxxx
+    return (buffer[position] & 0xC0) == 0x80
+
+
+class OffsetTextSplitter(TextSplitter):
+    """
+    Splits text like RecursiveCharacterTextSplitter, but tracks the offsets of every
+    chunk in the source instead of building intermediate strings.
+
+    Example:
+        splitter = OffsetTextSplitter(chunk_size=1000, chunk_overlap=100)
+        chunks = splitter.split_documents(documents)   # adds start_index/end_index
+        for start, end in splitter.iter_spans(text):   # offsets only, no copies
+            ...
+        chunks = list(splitter.lazy_split_file("data/ssrf.txt"))  # mmap, byte offsets
+    """
+
+    def __init__(
+        self,
+        chunk_size=1000,
+        chunk_overlap=100,
+        separators=None,
+        keep_separator=True,
+        is_separator_regex=False,
+        strip_whitespace=True,
+    ):
+        """
+        :param chunk_size: Maximum chunk length in characters (bytes for files).
+        :param chunk_overlap: Maximum overlap between consecutive chunks.
+        :param separators: Separators tried in order, as in
+            RecursiveCharacterTextSplitter. Defaults to paragraphs, lines, words
+            and characters.
+        :param keep_separator: True or "start" keeps each separator at the start of
+            the following piece, "end" at the end of the preceding piece. False
+            drops separators at chunk boundaries (like CharacterTextSplitter).
+            Since chunks are spans of the source, separators inside a chunk are
+            always kept as they appear in the text, including repeated ones.
+        :param is_separator_regex: Treat the separators as regular expressions.
+        :param strip_whitespace: Remove leading and trailing whitespace from chunks
+            (by moving their offsets).
+        """
+        super().__init__(
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            keep_separator=keep_separator,
+            strip_whitespace=strip_whitespace,
+        )
+        self._separators = separators or DEFAULT_SEPARATORS
+        self._is_separator_regex = is_separator_regex
+        self._patterns = {}
+
+    def _pattern(self, separator, binary):
+        # Compiled patterns are cached per separator and text type (str or bytes)
+        key = (separator, binary)
+        if key not in self._patterns:
+            pattern = separator if self._is_separator_regex else re.escape(separator)
+            self._patterns[key] = re.compile(pattern.encode("utf-8") if binary else pattern)
+        return self._patterns[key]
+
+    def _pieces(self, text, start, end, separator, binary):
+        # Yields the (start, end) offsets of the pieces between separator matches
+        if not separator:
+            position = start
+            while position < end:
+                next_position = position + 1
+                # Never cut a UTF-8 encoded character in half
+                while binary and next_position < end and _is_continuation_byte(text, next_position):
+                    next_position += 1
+                yield position, next_position
+                position = next_position
+            return
+
+        previous = start
+        for match in self._pattern(separator, binary).finditer(text, start, end):
+            if match.start() == match.end():
+                continue
+            if self._keep_separator == "end":
+                piece_end = next_start = match.end()
+            elif self._keep_separator:
+                piece_end = next_start = match.start()
+            else:
+                piece_end, next_start = match.start(), match.end()
+            if piece_end > previous:
+                yield previous, piece_end
+            previous = next_start
+        if end > previous:
+            yield previous, end
+
+    def _trim(self, text, start, end):
+        # Returns the span without surrounding whitespace, or None if it is empty
+        if self._strip_whitespace:
+            while start < end and text[start:start + 1].isspace():
+                start += 1
+            while end > start and text[end - 1:end].isspace():
+                end -= 1
+        return (start, end) if end > start else None
+
+    def _merge(self, text, pieces):
+        # Combines consecutive pieces into chunks of up to chunk_size, keeping up to
+        # chunk_overlap of the previous chunk (same rules as TextSplitter._merge_splits,
+        # with the length of a chunk being the length of its span)
+        window = deque()
+        for piece in pieces:
+            if window and piece[1] - window[0][0] > self._chunk_size:
+                span = self._trim(text, window[0][0], window[-1][1])
+                if span:
+                    yield span
+                while window and (
+                    window[-1][1] - window[0][0] > self._chunk_overlap
+                    or piece[1] - window[0][0] > self._chunk_size
+                ):
+                    window.popleft()
+            window.append(piece)
+        if window:
+            span = self._trim(text, window[0][0], window[-1][1])
+            if span:
+                yield span
+
+    def _split_spans(self, text, start, end, separators, binary):
+        # Use the first separator that occurs in the span, and recurse with the
+        # remaining separators for pieces that are still too long
+        separator, remaining = separators[-1], []
+        for i, candidate in enumerate(separators):
+            if not candidate:
+                separator = candidate
+                break
+            if self._pattern(candidate, binary).search(text, start, end):
+                separator, remaining = candidate, separators[i + 1:]
+                break
+
+        good_pieces = []
+        for piece in self._pieces(text, start, end, separator, binary):
+            if piece[1] - piece[0] < self._chunk_size:
+                good_pieces.append(piece)
+                continue
+            if good_pieces:
+                yield from self._merge(text, good_pieces)
+                good_pieces = []
+            if remaining:
+                yield from self._split_spans(text, piece[0], piece[1], remaining, binary)
+            else:
+                yield piece
+        if good_pieces:
+            yield from self._merge(text, good_pieces)
+
+    def iter_spans(self, text, start=0, end=None):
+        """
+        Yields the (start, end) offsets of the chunks of a text.
+
+        :param text: A string, or a bytes-like object such as an mmap of a UTF-8
+            file (offsets are then in bytes).
+        :param start: Offset where splitting starts.
+        :param end: Offset where splitting stops (defaults to the end of the text).
+        :return: A generator of (start, end) tuples, in order.
+        """
+        end = len(text) if end is None else end
+        yield from self._split_spans(
+            text, start, end, self._separators, not isinstance(text, str)
+        )
+
+    def split_text(self, text):
+        return [text[start:end] for start, end in self.iter_spans(text)]
+
+    def create_documents(self, texts, metadatas=None):
+        documents = []
+        for i, text in enumerate(texts):
+            metadata = metadatas[i] if metadatas else {}
+            for start, end in self.iter_spans(text):
+                documents.append(
+                    Document(
+                        page_content=text[start:end],
+                        metadata={**metadata, "start_index": start, "end_index": end},
+                    )
+                )
+        return documents
+
+    def lazy_split_file(self, file_path, encoding="utf-8"):
+        """
+        Splits a file through a read-only memory map, without reading it into memory.
+
+        :param file_path: Path of a UTF-8 (or ASCII) encoded file.
+        :param encoding: Encoding used to decode the chunks.
+        :return: A generator of Documents with "source", "start_byte" and "end_byte"
+            metadata.
+        """
+        with open(file_path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                for start, end in self.iter_spans(mapped):
+                    yield Document(
+                        page_content=mapped[start:end].decode(encoding),
+                        metadata={"source": file_path, "start_byte": start, "end_byte": end},
+                    )
+
+
+def paragraph_splitter(chunk_size=1000, chunk_overlap=100):
+    """
+    Returns the splitter of basic_rag_part1.py: paragraph chunks like
+    CharacterTextSplitter(chunk_size=1000, chunk_overlap=100), with offsets.
+    ingestion_benchmark.py uses it too, so it benchmarks the same chunks.
+    """
+    return OffsetTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        separators=["\n\n"],
+        keep_separator=False,
+    )
+
+
+def _loaded_text(metadata, encoding):
+    # Returns the text that the loader of a chunk produced from its source file
+    source = metadata["source"]
+    loader = metadata.get("loader")
+    if loader is None and source.endswith(".md"):
+        # Chunks ingested before the loader was recorded (see utils/parallel_loader.py)
+        loader = "UnstructuredMarkdownLoader"
+    if loader in (None, "TextLoader"):
+        with open(source, "r", encoding=encoding) as f:
+            return f.read()
+    if loader == "UnstructuredMarkdownLoader":
+        # Imported lazily: only needed to parse Markdown files again
+        from utils.parallel_loader import load_file
+
+        documents = load_file(source)
+        if len(documents) == 1:
+            return documents[0].page_content
+    raise ValueError(
+        f"The offsets of {source} point into the text returned by {loader}, not into "
+        "the file; pass that text to expand_context() with text=."
+    )
+
+
+def expand_context(document, before=0, after=0, text=None, encoding="utf-8"):
+    """
+    Returns a copy of a chunk with its span widened (or trimmed) in the source.
+
+    Chunks from lazy_split_file() are read from the memory-mapped source file by
+    byte offsets. Chunks with character offsets (start_index/end_index) are sliced
+    from ``text``. Without ``text``, the offsets are applied to the source file only
+    if it was loaded unchanged ("loader" metadata TextLoader); a Markdown file parsed
+    by UnstructuredMarkdownLoader is parsed again, since the offsets point into the
+    parsed text, and other loaders require ``text``.
+
+    :param document: A chunk created by OffsetTextSplitter.
+    :param before: Characters (bytes for file chunks) to add before the chunk.
+        Negative values trim the start of the chunk instead.
+    :param after: Characters (bytes for file chunks) to add after the chunk.
+        Negative values trim the end of the chunk instead.
+    :param text: The text the chunk was split from. Passing it avoids reading (and
+        possibly parsing) the source again.
+    :param encoding: Encoding of the source file.
+    :return: A new Document with the updated content and offsets.
+    :raises ValueError: If the chunk was loaded by another loader and no text is given.
+    """
+    metadata = dict(document.metadata)
+
+    if "start_byte" in metadata:
+        with open(metadata["source"], "rb") as f, mmap.mmap(
+            f.fileno(), 0, access=mmap.ACCESS_READ
+        ) as mapped:
+            start = min(max(0, metadata["start_byte"] - before), len(mapped))
+            end = max(min(len(mapped), metadata["end_byte"] + after), start)
+            # Move the offsets to character boundaries
+            while 0 < start < len(mapped) and _is_continuation_byte(mapped, start):
+                start -= 1
+            while end < len(mapped) and _is_continuation_byte(mapped, end):
+                end += 1
+            content = mapped[start:end].decode(encoding)
+        metadata.update(start_byte=start, end_byte=end)
+        return Document(page_content=content, metadata=metadata)
+
+    if text is None:
+        text = _loaded_text(metadata, encoding)
+    start = min(max(0, metadata["start_index"] - before), len(text))
+    end = max(min(len(text), metadata["end_index"] + after), start)
+    metadata.update(start_index=start, end_index=end)
+    return Document(page_content=text[start:end], metadata=metadata)
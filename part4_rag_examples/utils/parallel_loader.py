@@ -0,0 +1,87 @@
+# This module fans document loading and splitting out to a pool of worker processes.
+# Parsing Markdown with Unstructured is CPU-bound, so loading files one after the
+# other leaves most cores idle on large corpora. Each file is one task; results are
+# returned in the same order as the input files, so the chunk order (and therefore
+# the chunk IDs and the vector store content) is deterministic.
+#
+# NOTE: Scripts that use this module must protect their entry point with
+# ``if __name__ == "__main__":`` because worker processes re-import the main module
+# on platforms that use the "spawn" start method (Windows and macOS).
+
+# Instructor: Omar Santos @santosomar
+
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from langchain_community.document_loaders import TextLoader, UnstructuredMarkdownLoader
+
+
+def load_file(file_path):
+    """
+    Loads a file with the appropriate LangChain loader based on its extension.
+
+    The name of the loader is recorded in the "loader" metadata: only TextLoader
+    returns the file text unchanged, so only its character offsets point into the
+    file itself (see utils/offset_splitter.py).
+
+    :param file_path: Path of the file to load.
+    :return: A list of LangChain documents.
+    """
+    if file_path.endswith(".md"):
+        loader = UnstructuredMarkdownLoader(file_path)
+    else:
+        loader = TextLoader(file_path)
+    documents = loader.load()
+    for document in documents:
+        document.metadata["loader"] = type(loader).__name__
+    return documents
+
+
+def _load_and_split_file(file_path, text_splitter):
+    # Runs in a worker process. Errors are returned instead of raised so one bad
+    # file does not abort the whole batch.
+    try:
+        return file_path, text_splitter.split_documents(load_file(file_path)), None
+    except Exception as e:  # noqa: BLE001
+        return file_path, [], f"{type(e).__name__}: {e}"
+
+
+def load_and_split_files(file_paths, text_splitter, max_workers=None, max_pending=None):
+    """
+    Loads and splits files in parallel, one file per task.
+
+    Results are yielded in the same order as ``file_paths`` as soon as each one
+    (and all files before it) is ready, so callers can print per-file progress
+    while the remaining files are still being processed.
+
+    :param file_paths: The files to load.
+    :param text_splitter: A picklable LangChain text splitter (e.g., CharacterTextSplitter).
+    :param max_workers: Number of worker processes (defaults to the number of CPUs).
+        Use 1 to load the files in the current process.
+    :param max_pending: Maximum number of files submitted but not yet consumed
+        (defaults to four per worker). Bounds memory and keeps workers busy.
+    :return: A generator of ``(file_path, chunks, error)`` tuples.
+    """
+    file_paths = list(file_paths)
+    max_workers = max_workers or os.cpu_count() or 1
+    worker = partial(_load_and_split_file, text_splitter=text_splitter)
+
+    if max_workers == 1 or len(file_paths) <= 1:
+        yield from map(worker, file_paths)
+        return
+
+    # Only a bounded window of files is submitted ahead of the consumer, so a slow
+    # consumer (e.g., a streaming embedding pipeline) does not cause the results of
+    # thousands of files to pile up in memory.
+    if max_pending is None:
+        max_pending = max_workers * 4
+    with ProcessPoolExecutor(max_workers=min(max_workers, len(file_paths))) as executor:
+        pending = deque()
+        for file_path in file_paths:
+            pending.append(executor.submit(worker, file_path))
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
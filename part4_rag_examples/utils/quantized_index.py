@@ -0,0 +1,365 @@
+# This module provides a vector store that keeps only compact, quantized codes of the
+# embeddings in memory. A text-embedding-3-small vector is 1536 float32 values (6 KB);
+# two quantization methods shrink it:
+#
+#   int8 - scalar quantization: every value is stored as one signed byte, scaled per
+#          dimension (4x smaller).
+#   pq   - product quantization: the vector is cut into sub-vectors of a few values,
+#          and each sub-vector is replaced by the ID of the closest of 256 centroids
+#          learned with k-means (16x smaller with 4 values per sub-vector).
+#
+# A search scores every chunk using the codes, then re-ranks only the best
+# candidates with their full-precision vectors. Those vectors stay on disk (the
+# memory-mapped vectors.bin of utils/flat_index.py), so only the few rows that are
+# re-ranked are read. recall_check() reports the recall against exact search and
+# the memory saved.
+
+# Instructor: Omar Santos @santosomar
+
+import os
+import time
+
+import numpy as np
+
+from utils.flat_index import FlatVectorStore, normalize_rows, open_flat_store, top_k_indices
+
+QUANTIZER_FILENAME = "quantizer.npz"
+CODES_FILENAME = "codes.bin"
+PQ_CENTROIDS = 256
+
+
+def train_int8(vectors):
+    """Returns the per-dimension scale that maps the vectors to -127..127."""
+    scale = np.abs(vectors).max(axis=0) / 127.0
+    return {"scale": np.where(scale == 0, 1.0, scale).astype(np.float32)}
+
+
+def encode_int8(vectors, quantizer):
+    return np.clip(np.rint(vectors / quantizer["scale"]), -127, 127).astype(np.int8)
+
+
+def _pq_assign(subvectors, centroids):
+    # subvectors: (m, n, d), centroids: (m, k, d) -> index of the closest centroid (m, n)
+    m, n, _ = subvectors.shape
+    assignments = np.empty((m, n), dtype=np.int64)
+    centroid_norms = (centroids ** 2).sum(axis=2)
+    for j in range(m):
+        # ||x - c||^2 without the ||x||^2 term, which does not change the argmin
+        distances = subvectors[j] @ centroids[j].T
+        distances *= -2
+        distances += centroid_norms[j]
+        assignments[j] = distances.argmin(axis=1)
+    return assignments
+
+
+def train_pq(vectors, subvector_dim=4, iterations=10, seed=42):
+    """
+    Learns the product quantization centroids with k-means in every sub-space.
+
+    :param vectors: A (n, dim) float32 array of training vectors.
+    :param subvector_dim: Number of values per sub-vector. Must divide dim.
+    :param iterations: Number of k-means iterations.
+    :param seed: Random seed for the initial centroids.
+    :return: A dictionary with the (m, 256, subvector_dim) centroids.
+    """
+    n, dim = vectors.shape
+    if dim % subvector_dim:
+        raise ValueError(f"subvector_dim {subvector_dim} does not divide the dimension {dim}.")
+    m = dim // subvector_dim
+    subvectors = np.ascontiguousarray(vectors.reshape(n, m, subvector_dim).transpose(1, 0, 2))
+    k = min(PQ_CENTROIDS, n)
+    rng = np.random.default_rng(seed)
+    centroids = subvectors[:, rng.choice(n, k, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = _pq_assign(subvectors, centroids)
+        for j in range(m):
+            counts = np.bincount(assignments[j], minlength=k)
+            filled = counts > 0  # Empty clusters keep their previous centroid
+            for t in range(subvector_dim):
+                sums = np.bincount(assignments[j], weights=subvectors[j, :, t], minlength=k)
+                centroids[j, filled, t] = sums[filled] / counts[filled]
+    return {"centroids": centroids.astype(np.float32)}
+
+
+def encode_pq(vectors, quantizer):
+    centroids = quantizer["centroids"]
+    m, _, subvector_dim = centroids.shape
+    subvectors = np.ascontiguousarray(
+        vectors.reshape(len(vectors), m, subvector_dim).transpose(1, 0, 2)
+    )
+    return _pq_assign(subvectors, centroids).T.astype(np.uint8)
+
+
+class QuantizedVectorStore(FlatVectorStore):
+    """
+    A vector store that searches int8 or product-quantized codes in memory and
+    re-ranks the best candidates with the full-precision vectors on disk.
+
+    Example:
+        db = QuantizedVectorStore("db/security_pq", embeddings, method="pq")
+        db.add_documents(chunks)
+        db.train()  # optional: learn the quantizer once the corpus is loaded
+        retriever = db.as_retriever(search_kwargs={"k": 5})
+    """
+
+    DIRECTORY_SUFFIX = "_quantized"
+
+    def __init__(
+        self,
+        persist_directory,
+        embedding_function=None,
+        method="int8",
+        pq_subvector_dim=4,
+        rerank_candidates=100,
+        training_size=10000,
+        **kwargs,
+    ):
+        """
+        :param persist_directory: Directory of the store.
+        :param embedding_function: The LangChain Embeddings used for queries.
+        :param method: "int8" (4x smaller) or "pq" (product quantization). Only used
+            when the store is created; an existing store keeps its method.
+        :param pq_subvector_dim: Values per PQ sub-vector (4 gives 16x smaller
+            codes, 8 gives 32x). Must divide the embedding dimension.
+        :param rerank_candidates: Number of candidates re-ranked with the
+            full-precision vectors (at least k is used). 0 ranks by the codes only.
+        :param training_size: Maximum number of vectors used to train the quantizer.
+        :param kwargs: Options of FlatVectorStore (e.g., dtype).
+        """
+        if method not in ("int8", "pq"):
+            raise ValueError(f"Unknown quantization method {method!r}; use 'int8' or 'pq'.")
+        super().__init__(persist_directory, embedding_function=embedding_function, **kwargs)
+        self._info.setdefault(
+            "quantization", {"method": method, "pq_subvector_dim": pq_subvector_dim}
+        )
+        self.rerank_candidates = rerank_candidates
+        self.training_size = training_size
+        self._quantizer = None
+        self._codes = None
+
+    @property
+    def method(self):
+        return self._info["quantization"]["method"]
+
+    def _code_dtype(self):
+        return np.int8 if self.method == "int8" else np.uint8
+
+    def _code_size(self):
+        if self.method == "int8":
+            return self._info["dim"]
+        return self._info["dim"] // self._info["quantization"]["pq_subvector_dim"]
+
+    def _encode(self, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.method == "int8":
+            return encode_int8(vectors, self._quantizer)
+        return encode_pq(vectors, self._quantizer)
+
+    def train(self):
+        """
+        Trains the quantizer on a sample of the stored vectors and encodes all of
+        them. Called automatically by the first search; call it again after adding
+        a large part of the corpus so the quantizer reflects the data.
+        """
+        vectors = self._vector_matrix()
+        if len(vectors) == 0:
+            raise ValueError("The store is empty; add chunks before training.")
+        rng = np.random.default_rng(42)
+        sample = np.sort(rng.choice(len(vectors), min(len(vectors), self.training_size), replace=False))
+        training_vectors = np.asarray(vectors[sample], dtype=np.float32)
+        if self.method == "int8":
+            self._quantizer = train_int8(training_vectors)
+        else:
+            self._quantizer = train_pq(
+                training_vectors, self._info["quantization"]["pq_subvector_dim"]
+            )
+
+        quantizer_path = self._path(QUANTIZER_FILENAME)
+        with open(quantizer_path + ".tmp", "wb") as f:
+            np.savez(f, **self._quantizer)
+        os.replace(quantizer_path + ".tmp", quantizer_path)
+        # Existing codes were created with the previous quantizer
+        if os.path.exists(self._path(CODES_FILENAME)):
+            os.remove(self._path(CODES_FILENAME))
+        self._codes = None
+        return self._sync_codes()
+
+    def _sync_codes(self):
+        # Loads the codes into memory, encoding the rows that do not have codes yet
+        count = self._info["count"]
+        if self._quantizer is None:
+            quantizer_path = self._path(QUANTIZER_FILENAME)
+            if not os.path.exists(quantizer_path):
+                return self.train()
+            with np.load(quantizer_path) as data:
+                self._quantizer = {name: data[name] for name in data.files}
+
+        if self._codes is not None and len(self._codes) == count:
+            return self._codes
+
+        codes_path = self._path(CODES_FILENAME)
+        code_size = self._code_size()
+        existing = os.path.getsize(codes_path) // code_size if os.path.exists(codes_path) else 0
+        existing = min(existing, count)
+        with open(codes_path, "ab") as f:
+            f.truncate(existing * code_size)
+            vectors = self._vector_matrix()
+            for start in range(existing, count, self.block_size):
+                f.write(self._encode(vectors[start:min(start + self.block_size, count)]).tobytes())
+        self._codes = np.fromfile(codes_path, dtype=self._code_dtype()).reshape(count, code_size)
+        return self._codes
+
+    def add_embeddings(self, texts, embeddings, metadatas=None, ids=None, **kwargs):
+        ids = super().add_embeddings(texts, embeddings, metadatas, ids, **kwargs)
+        # Encode the new rows right away once a quantizer exists
+        if self._quantizer is not None or os.path.exists(self._path(QUANTIZER_FILENAME)):
+            self._sync_codes()
+        return ids
+
+    def approximate_scores(self, query_vectors):
+        """
+        Estimates the cosine similarity of the queries with every chunk from the codes.
+
+        :return: A (queries, count) float32 array. Deleted rows score -inf.
+        """
+        codes = self._sync_codes()
+        queries = normalize_rows(np.atleast_2d(query_vectors))
+        scores = np.empty((len(queries), len(codes)), dtype=np.float32)
+        if self.method == "int8":
+            # Fold the scale into the queries instead of decoding the codes
+            # Small blocks keep the decoded block in the CPU cache
+            scaled_queries = queries * self._quantizer["scale"]
+            block_size = 1024
+            for start in range(0, len(codes), block_size):
+                block = codes[start:start + block_size].astype(np.float32)
+                scores[:, start:start + len(block)] = scaled_queries @ block.T
+        else:
+            # Asymmetric distance computation: a (sub-space, centroid) table of dot
+            # products per query, summed over the centroids each chunk uses
+            centroids = self._quantizer["centroids"]
+            m, k, subvector_dim = centroids.shape
+            tables = np.einsum(
+                "qmd,mkd->qmk", queries.reshape(len(queries), m, subvector_dim), centroids
+            ).reshape(len(queries), m * k)
+            offsets = np.arange(m, dtype=np.intp) * k
+            block_size = 4096
+            for start in range(0, len(codes), block_size):
+                indices = codes[start:start + block_size].astype(np.intp) + offsets
+                for row, table in enumerate(tables):
+                    scores[row, start:start + len(indices)] = table[indices].sum(axis=1)
+        if self._deleted:
+            scores[:, sorted(self._deleted)] = -np.inf
+        return scores
+
+    def _search_scores(self, query_vectors, k, mask=None):
+        # Rank by the codes, then replace the scores of the best candidates with
+        # exact scores from the vectors on disk (other chunks are left out). Rows
+        # outside the mask are dropped before the candidates are chosen.
+        approximate = self.approximate_scores(query_vectors)
+        if mask is not None:
+            approximate[:, ~mask] = -np.inf
+        if self.rerank_candidates == 0:
+            return approximate
+        queries = normalize_rows(np.atleast_2d(query_vectors))
+        vectors = self._vector_matrix()
+        scores = np.full_like(approximate, -np.inf)
+        candidates = top_k_indices(approximate, max(self.rerank_candidates, k))
+        for row, positions in enumerate(candidates):
+            # Sorted positions read the memory-mapped file sequentially
+            positions = np.sort(positions[np.isfinite(approximate[row, positions])])
+            scores[row, positions] = np.asarray(vectors[positions], dtype=np.float32) @ queries[row]
+        return scores
+
+    def memory_usage(self):
+        """Returns the size of the in-memory codes compared to float32 vectors."""
+        codes = self._sync_codes()
+        float32_bytes = self._info["count"] * self._info["dim"] * 4
+        return {
+            "float32_bytes": float32_bytes,
+            "code_bytes": int(codes.nbytes),
+            "compression": round(float32_bytes / codes.nbytes, 1) if codes.nbytes else None,
+        }
+
+
+def open_quantized_store(chroma_directory, embedding_function, quantized_directory=None, **kwargs):
+    """
+    Opens the quantized copy of a Chroma store, exporting it first if the copy is
+    missing or older than the Chroma store (see open_flat_store()).
+
+    :param chroma_directory: The persist directory of the Chroma store.
+    :param embedding_function: Embeddings used for queries.
+    :param quantized_directory: Directory of the copy. Defaults to the Chroma
+        directory with the method as suffix (e.g., "_int8").
+    :param kwargs: Options of QuantizedVectorStore (method, rerank_candidates, ...).
+    :return: A QuantizedVectorStore.
+    """
+    method = kwargs.get("method", "int8")
+    return open_flat_store(
+        chroma_directory,
+        embedding_function,
+        flat_directory=quantized_directory or chroma_directory.rstrip(os.sep) + f"_{method}",
+        store_class=QuantizedVectorStore,
+        **kwargs,
+    )
+
+
+def recall_check(store, query_vectors, k=10, rerank_values=(0, 20, 50, 100, 200)):
+    """
+    Measures recall@k and per-query latency for several numbers of re-ranked
+    candidates, using exact search over the full-precision vectors as the truth.
+
+    :param store: A QuantizedVectorStore.
+    :param query_vectors: A list or array of query embeddings.
+    :param k: Number of neighbours per query.
+    :param rerank_values: The rerank_candidates values to measure (0 = codes only).
+    :return: A list of result dictionaries, the first one for exact search.
+    """
+    query_vectors = normalize_rows(query_vectors)
+    k = min(k, len(store))
+    store._sync_codes()  # Train and encode before timing
+
+    def measure(score_fn):
+        seconds, top = [], []
+        for query in query_vectors:
+            start = time.perf_counter()
+            top.append(set(top_k_indices(score_fn(query), k)[0].tolist()))
+            seconds.append(time.perf_counter() - start)
+        seconds = np.asarray(seconds)
+        return top, {
+            "p50_ms": round(float(np.percentile(seconds, 50)) * 1000, 3),
+            "p95_ms": round(float(np.percentile(seconds, 95)) * 1000, 3),
+            "qps": round(len(seconds) / float(seconds.sum()), 1) if seconds.sum() else None,
+        }
+
+    truth, latency = measure(store.score_vectors)
+    rows = [{"method": "exact", "rerank_candidates": None, f"recall@{k}": 1.0, **latency}]
+    original = store.rerank_candidates
+    try:
+        for rerank in rerank_values:
+            store.rerank_candidates = rerank
+            found, latency = measure(lambda query: store._search_scores(query, k))
+            hits = sum(len(a & b) for a, b in zip(truth, found))
+            rows.append(
+                {
+                    "method": store.method,
+                    "rerank_candidates": rerank,
+                    f"recall@{k}": round(hits / (k * len(query_vectors)), 4),
+                    **latency,
+                }
+            )
+    finally:
+        store.rerank_candidates = original
+    return rows
+
+
+def print_recall_check(rows):
+    """Prints the rows of recall_check() as a table."""
+    recall_column = next(key for key in rows[0] if key.startswith("recall@"))
+    print(f"{'method':<8}{'rerank':>8}{recall_column:>12}{'p50 ms':>10}{'p95 ms':>10}{'QPS':>10}")
+    for row in rows:
+        rerank = row["rerank_candidates"]
+        print(
+            f"{row['method']:<8}{rerank if rerank is not None else '-':>8}"
+            f"{row[recall_column]:>12.4f}{row['p50_ms']:>10.3f}{row['p95_ms']:>10.3f}"
+            f"{row['qps'] or 0:>10.1f}"
+        )
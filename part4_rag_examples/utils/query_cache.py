@@ -0,0 +1,219 @@
+# This module caches query embeddings, so repeated questions do not pay an embedding
+# API round-trip on every retriever.invoke(query).
+#
+# utils/embedding_cache.py caches the embeddings of document chunks while a store is
+# built. Queries are different: they are short, they arrive one at a time on the
+# latency-critical path, and in practice a small set of questions makes up most of
+# the traffic. QueryEmbeddingCache wraps the embedding function passed to Chroma (or
+# to any other vector store) and keeps the query vectors in two tiers:
+#
+#   memory - an LRU dictionary bounded by ``max_entries``. Entries expire after
+#            ``ttl_seconds``, so a long-running process does not keep stale or rare
+#            queries forever.
+#   disk   - optional. The SQLite store of utils/embedding_cache.py, under a separate
+#            "query:" model key, so restarts and other processes start warm. It is
+#            bounded by size with LRU eviction.
+#
+# Keys combine the embedding model ID and the normalized query text (Unicode form
+# and whitespace), so two models never share vectors. stats() reports the hit rates
+# of both tiers and an estimate of the latency saved.
+
+# Instructor: Omar Santos @santosomar
+
+import threading
+import time
+from collections import OrderedDict
+
+from langchain_core.embeddings import Embeddings
+
+from utils.embedding_cache import EmbeddingCacheStore, model_id_for, text_hash
+
+
+class QueryEmbeddingCache(Embeddings):
+    """
+    A drop-in wrapper around any LangChain Embeddings object that caches query
+    embeddings. Document embeddings are passed through unchanged.
+
+    Example:
+        embeddings = QueryEmbeddingCache(OpenAIEmbeddings(model="text-embedding-3-small"))
+        db = Chroma(persist_directory=..., embedding_function=embeddings)
+        db.as_retriever().invoke("What is SSRF?")
+        embeddings.print_stats()
+    """
+
+    def __init__(self, embeddings, max_entries=1024, ttl_seconds=3600, disk_store=None, model_id=None):
+        """
+        :param embeddings: The LangChain Embeddings object to wrap.
+        :param max_entries: Maximum number of query vectors kept in memory.
+        :param ttl_seconds: Lifetime of an in-memory entry. None keeps entries until
+            they are evicted by the LRU policy.
+        :param disk_store: An EmbeddingCacheStore or a path to its SQLite file for
+            the disk tier. None keeps the cache in memory only.
+        :param model_id: Overrides the model ID used in the cache key.
+        """
+        self.embeddings = embeddings
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        if isinstance(disk_store, str):
+            disk_store = EmbeddingCacheStore(disk_store)
+        self.disk_store = disk_store
+        self.model_id = model_id or model_id_for(embeddings)
+        # Query vectors can differ from document vectors of the same text (e.g.,
+        # models with query instructions), so they get their own disk key
+        self._disk_model_id = f"query:{self.model_id}"
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self._hit_seconds = 0.0
+        self._miss_seconds = 0.0
+
+    def embed_documents(self, texts):
+        return self.embeddings.embed_documents(texts)
+
+    def _get_memory(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            vector, expires_at = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                return None
+            self._entries.move_to_end(key)
+            return vector
+
+    def _put_memory(self, key, vector):
+        expires_at = time.monotonic() + self.ttl_seconds if self.ttl_seconds is not None else None
+        with self._lock:
+            self._entries[key] = (vector, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def embed_query(self, text):
+        start = time.perf_counter()
+        key = text_hash(text)
+        vector = self._get_memory(key)
+        if vector is not None:
+            with self._lock:
+                self.memory_hits += 1
+                self._hit_seconds += time.perf_counter() - start
+            return list(vector)
+
+        if self.disk_store is not None:
+            vector = self.disk_store.get_many(self._disk_model_id, [key]).get(key)
+            if vector is not None:
+                self._put_memory(key, vector)
+                with self._lock:
+                    self.disk_hits += 1
+                    self._hit_seconds += time.perf_counter() - start
+                return list(vector)
+
+        vector = self.embeddings.embed_query(text)
+        self._put_memory(key, vector)
+        if self.disk_store is not None:
+            self.disk_store.put_many(self._disk_model_id, [(key, vector)])
+        with self._lock:
+            self.misses += 1
+            self._miss_seconds += time.perf_counter() - start
+        return list(vector)
+
+    def embed_queries(self, texts):
+        """
+        Embeds several queries at once: cached queries are served from the cache and
+        the others are sent to the model in one embed_documents() call.
+
+        Only use this with models that embed queries and documents the same way
+        (e.g., the OpenAI models); otherwise call embed_query() for each query.
+
+        :param texts: The query texts.
+        :return: One vector per text.
+        """
+        start = time.perf_counter()
+        keys = [text_hash(text) for text in texts]
+        vectors, memory_hits = {}, 0
+        for key in dict.fromkeys(keys):
+            vector = self._get_memory(key)
+            if vector is not None:
+                vectors[key] = vector
+                memory_hits += 1
+
+        disk_hits = 0
+        if self.disk_store is not None:
+            missing = [key for key in dict.fromkeys(keys) if key not in vectors]
+            for key, vector in self.disk_store.get_many(self._disk_model_id, missing).items():
+                self._put_memory(key, vector)
+                vectors[key] = vector
+                disk_hits += 1
+        hit_seconds = time.perf_counter() - start
+
+        # Embed each missing query only once, even if it repeats within the batch
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors and key not in missing:
+                missing[key] = text
+        if missing:
+            start = time.perf_counter()
+            new_items = list(zip(missing, self.embeddings.embed_documents(list(missing.values()))))
+            for key, vector in new_items:
+                self._put_memory(key, vector)
+            if self.disk_store is not None:
+                self.disk_store.put_many(self._disk_model_id, new_items)
+            vectors.update(new_items)
+            with self._lock:
+                self.misses += len(missing)
+                self._miss_seconds += time.perf_counter() - start
+        with self._lock:
+            self.memory_hits += memory_hits
+            self.disk_hits += disk_hits
+            self._hit_seconds += hit_seconds
+        return [list(vectors[key]) for key in keys]
+
+    def clear(self):
+        """Empties the in-memory tier (the disk tier is left as it is)."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """
+        Returns the hit counters of both tiers and the estimated latency saved.
+
+        The saved time is the number of hits times the average latency of a miss,
+        minus the time spent serving the hits. It stays 0 until this process has
+        measured at least one miss.
+
+        :return: A dictionary with the counters, hit rates and latencies.
+        """
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            total = hits + self.misses
+            miss_ms = self._miss_seconds / self.misses * 1000 if self.misses else None
+            hit_ms = self._hit_seconds / hits * 1000 if hits else None
+            saved = hits * self._miss_seconds / self.misses - self._hit_seconds if self.misses else 0.0
+            return {
+                "model": self.model_id,
+                "queries": total,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": hits / total if total else 0.0,
+                "memory_hit_rate": self.memory_hits / total if total else 0.0,
+                "expirations": self.expirations,
+                "entries": len(self._entries),
+                "avg_miss_ms": round(miss_ms, 3) if miss_ms is not None else None,
+                "avg_hit_ms": round(hit_ms, 3) if hit_ms is not None else None,
+                "saved_seconds": round(max(saved, 0.0), 3),
+            }
+
+    def print_stats(self):
+        stats = self.stats()
+        print(
+            f"Query embedding cache ({stats['model']}): {stats['queries']} queries, "
+            f"{stats['memory_hits']} memory hits, {stats['disk_hits']} disk hits, "
+            f"{stats['misses']} misses ({stats['hit_rate']:.0%} hit rate), "
+            f"~{stats['saved_seconds']:.2f}s saved"
+        )
@@ -0,0 +1,281 @@
+# This module serves a RAG chain from a long-lived asyncio process, so the
+# embeddings client, the vector store and the chain are created once instead of on
+# every question.
+#
+# Running a script per question (e.g., `python basic_rag_part3.py`) pays the full
+# startup each time: importing LangChain, creating the OpenAI clients, opening the
+# Chroma store and loading its index, before the question is even embedded.
+# RAGService keeps all of that warm and answers questions concurrently:
+#
+#   concurrency cap - at most ``max_concurrency`` chain executions run at once;
+#                     other questions wait for a slot.
+#   coalescing      - identical questions (after whitespace normalization) that
+#                     arrive while one of them is being answered share that single
+#                     execution, instead of each paying for retrieval and the LLM.
+#
+# Two transports are provided, both stdlib only:
+#
+#   serve_http()  - a minimal HTTP/1.1 server (keep-alive, JSON bodies):
+#                   POST /ask {"question": "..."}, GET /stats, GET /health.
+#   serve_stdio() - line-delimited JSON over stdin/stdout: one request per line,
+#                   {"id": 1, "question": "..."} or {"id": 2, "command": "stats"},
+#                   answered (possibly out of order) with the same "id".
+#
+# See rag_service.py for the command line and rag_client.py for a client and load
+# tester.
+
+# Instructor: Omar Santos @santosomar
+
+import asyncio
+import json
+import sys
+import time
+
+import numpy as np
+
+from utils.embedding_cache import normalize_text
+
+_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 500: "Internal Server Error"}
+
+
+def _percentiles(seconds):
+    if not seconds:
+        return {"p50_ms": None, "p95_ms": None}
+    milliseconds = np.asarray(seconds) * 1000
+    return {
+        "p50_ms": round(float(np.percentile(milliseconds, 50)), 3),
+        "p95_ms": round(float(np.percentile(milliseconds, 95)), 3),
+    }
+
+
+class RAGService:
+    """
+    Answers questions with a chain, with a concurrency cap and coalescing of
+    identical in-flight questions.
+
+    Example:
+        service = RAGService(cached_rag_chain, max_concurrency=8)
+        result = await service.ask("What is SSRF?")  # {"answer": ..., "coalesced": ...}
+    """
+
+    def __init__(self, chain, max_concurrency=8, max_history=10000):
+        """
+        :param chain: A runnable that maps a question string to an answer string.
+            Its ainvoke() is used, so a chain made of sync steps runs in the
+            event loop's executor (see rag_service.py, which sizes it).
+        :param max_concurrency: Maximum number of chain executions at a time.
+        :param max_history: Number of recent latencies kept for stats().
+        """
+        self.chain = chain
+        self.max_concurrency = max_concurrency
+        self.max_history = max_history
+        # Created on first use, inside the running event loop
+        self._semaphore = None
+        self._inflight = {}
+        self.requests = 0
+        self.executions = 0
+        self.coalesced = 0
+        self.errors = 0
+        self._latencies = []
+        self._started = time.time()
+
+    async def _execute(self, question):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        async with self._semaphore:
+            self.executions += 1
+            return await self.chain.ainvoke(question)
+
+    def _forget(self, key, future):
+        if self._inflight.get(key) is future:
+            del self._inflight[key]
+        # Marks the exception as retrieved when every waiter has gone away
+        if not future.cancelled():
+            future.exception()
+
+    async def ask(self, question):
+        """
+        Answers a question, sharing the execution of an identical in-flight one.
+
+        :param question: The question.
+        :return: A dictionary with the question, the answer, whether it was
+            coalesced with another request, and the latency in milliseconds.
+        """
+        start = time.perf_counter()
+        self.requests += 1
+        key = normalize_text(question)
+        future = self._inflight.get(key)
+        coalesced = future is not None
+        if coalesced:
+            self.coalesced += 1
+        else:
+            future = asyncio.ensure_future(self._execute(question))
+            self._inflight[key] = future
+            future.add_done_callback(lambda done: self._forget(key, done))
+        try:
+            # shield(): a client that disconnects does not cancel the shared execution
+            answer = await asyncio.shield(future)
+        except Exception:
+            self.errors += 1
+            raise
+        seconds = time.perf_counter() - start
+        self._latencies.append(seconds)
+        del self._latencies[:-self.max_history]
+        return {
+            "question": question,
+            "answer": answer,
+            "coalesced": coalesced,
+            "latency_ms": round(seconds * 1000, 3),
+        }
+
+    def stats(self):
+        """Returns the request, execution and coalescing counters and latencies."""
+        return {
+            "requests": self.requests,
+            "executions": self.executions,
+            "coalesced": self.coalesced,
+            "errors": self.errors,
+            "in_flight": len(self._inflight),
+            "max_concurrency": self.max_concurrency,
+            "uptime_s": round(time.time() - self._started, 1),
+            **_percentiles(self._latencies),
+        }
+
+    async def handle(self, request):
+        """
+        Handles one JSON request of either transport.
+
+        :param request: ``{"question": ...}`` or ``{"command": "stats" | "health"}``.
+        :return: A tuple ``(status, response dictionary)``.
+        """
+        if not isinstance(request, dict):
+            return 400, {"error": "The request must be a JSON object."}
+        command = request.get("command")
+        if command == "stats":
+            return 200, self.stats()
+        if command == "health":
+            return 200, {"status": "ok"}
+        question = request.get("question")
+        if not isinstance(question, str) or not question.strip():
+            return 400, {"error": 'The request needs a non-empty "question" string.'}
+        try:
+            return 200, await self.ask(question)
+        except Exception as e:
+            return 500, {"question": question, "error": repr(e)}
+
+
+async def _read_http_request(reader):
+    # Returns (method, path, headers, body), or None when the client closed
+    request_line = await reader.readline()
+    if not request_line.strip():
+        return None
+    method, path, _ = request_line.decode("latin-1").split(" ", 2)
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length", 0))
+    body = await reader.readexactly(length) if length else b""
+    return method, path, headers, body
+
+
+async def _route_http(service, method, path, body):
+    path = path.split("?", 1)[0]
+    if path == "/ask":
+        if method != "POST":
+            return 405, {"error": "Use POST /ask."}
+        try:
+            request = json.loads(body or b"{}")
+        except ValueError:
+            return 400, {"error": "The body is not valid JSON."}
+        return await service.handle(request)
+    if path in ("/stats", "/health"):
+        if method != "GET":
+            return 405, {"error": f"Use GET {path}."}
+        return await service.handle({"command": path[1:]})
+    return 404, {"error": f"Unknown path {path}; use POST /ask, GET /stats or GET /health."}
+
+
+async def _handle_http_connection(service, reader, writer):
+    try:
+        while True:
+            try:
+                request = await _read_http_request(reader)
+            except (ValueError, asyncio.IncompleteReadError):
+                request = None
+            if request is None:
+                break
+            method, path, headers, body = request
+            status, response = await _route_http(service, method, path, body)
+            payload = json.dumps(response).encode("utf-8")
+            keep_alive = headers.get("connection", "").lower() != "close"
+            writer.write(
+                f"HTTP/1.1 {status} {_REASONS[status]}\r\n"
+                f"Content-Type: application/json\r\n"
+                f"Content-Length: {len(payload)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1")
+                + payload
+            )
+            await writer.drain()
+            if not keep_alive:
+                break
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def serve_http(service, host="127.0.0.1", port=8765):
+    """
+    Serves the service over HTTP until the process is stopped.
+
+    :param service: A RAGService.
+    :param host: Interface to listen on (keep 127.0.0.1 for a local service).
+    :param port: TCP port.
+    """
+    server = await asyncio.start_server(
+        lambda reader, writer: _handle_http_connection(service, reader, writer), host, port
+    )
+    print(f"RAG service listening on http://{host}:{port} (max concurrency {service.max_concurrency})")
+    async with server:
+        await server.serve_forever()
+
+
+async def serve_stdio(service, stdin=None, stdout=None):
+    """
+    Serves line-delimited JSON requests from stdin until it is closed, writing one
+    JSON response line per request to stdout.
+
+    :param service: A RAGService.
+    :param stdin: The input file (defaults to sys.stdin).
+    :param stdout: The output file (defaults to sys.stdout).
+    """
+    stdin = stdin or sys.stdin
+    stdout = stdout or sys.stdout
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), stdin)
+
+    async def answer(line):
+        try:
+            request = json.loads(line)
+        except ValueError:
+            request_id, (status, response) = None, (400, {"error": "The line is not valid JSON."})
+        else:
+            request_id = request.get("id") if isinstance(request, dict) else None
+            status, response = await service.handle(request)
+        # Written from the event loop thread, one whole line at a time
+        stdout.write(json.dumps({"id": request_id, "status": status, **response}) + "\n")
+        stdout.flush()
+
+    tasks = set()
+    while line := await reader.readline():
+        if line.strip():
+            task = asyncio.ensure_future(answer(line))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+    if tasks:
+        await asyncio.gather(*tasks)
@@ -0,0 +1,304 @@
+# This module provides an optional second retrieval stage: a small cross-encoder
+# that re-scores the chunks found by the vector search and keeps only the best few.
+#
+# The embedding model (a bi-encoder) embeds the question and the chunks separately,
+# which is fast but approximate. A cross-encoder reads the question and a chunk
+# together and scores how well the chunk answers the question, which ranks much
+# better, but needs one model call per (question, chunk) pair. So the vector search
+# fetches a few dozen candidates and the cross-encoder picks the top_n for the
+# prompt. Fewer, better chunks make the LLM call, where most of the end-to-end
+# latency goes, cheaper and faster.
+#
+# CrossEncoderReranker runs a small model (cross-encoder/ms-marco-MiniLM-L-6-v2 by
+# default, about 22M parameters) on the CPU with sentence-transformers:
+#
+#   batching - the pairs are scored ``batch_size`` at a time.
+#   cache    - scores are cached by (question, chunk text), so repeated questions
+#              and chunks shared by similar questions are not scored again.
+#   budget   - scoring runs on a worker thread and the caller waits at most
+#              ``latency_budget_ms``. When the budget is exceeded, the chunks are
+#              returned in the order of the vector search (the first top_n), and
+#              the scores computed in the background still fill the cache.
+#
+# RerankingRetriever puts the reranker behind any retriever, and keeps the batch
+# retrieval of utils/batch_retrieval.py.
+
+# Instructor: Omar Santos @santosomar
+
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from utils.embedding_cache import text_hash
+
+try:
+    from sentence_transformers import CrossEncoder
+except ImportError:
+    CrossEncoder = None
+
+DEFAULT_RERANKER_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+
+
+class CrossEncoderReranker:
+    """
+    Re-scores (question, chunk) pairs with a cross-encoder on the CPU.
+
+    Example:
+        reranker = CrossEncoderReranker(top_n=4, latency_budget_ms=300)
+        documents = reranker.rerank("What is SSRF?", candidates)
+        reranker.print_stats()
+    """
+
+    def __init__(
+        self,
+        model_name=DEFAULT_RERANKER_MODEL,
+        top_n=4,
+        max_candidates=20,
+        batch_size=16,
+        latency_budget_ms=300,
+        cache_size=10000,
+        max_length=512,
+        model=None,
+    ):
+        """
+        :param model_name: The sentence-transformers cross-encoder to load.
+        :param top_n: Number of chunks kept for the prompt.
+        :param max_candidates: Only the first candidates of the vector search are
+            scored; the others are dropped.
+        :param batch_size: Number of pairs per model call.
+        :param latency_budget_ms: Maximum time spent waiting for the scores of one
+            question. None waits for them without a limit.
+        :param cache_size: Maximum number of cached scores.
+        :param max_length: Maximum number of tokens of a (question, chunk) pair.
+        :param model: An already loaded model with a CrossEncoder-like
+            ``predict(pairs, batch_size=...)`` method, instead of model_name.
+        """
+        if model is None:
+            if CrossEncoder is None:
+                raise ImportError(
+                    "CrossEncoderReranker requires the sentence-transformers package. "
+                    "Install it with `pip install sentence-transformers`."
+                )
+            # Loaded up front, so the first question does not pay for it
+            model = CrossEncoder(model_name, max_length=max_length, device="cpu")
+        self.model = model
+        self.model_name = model_name
+        self.top_n = top_n
+        self.max_candidates = max_candidates
+        self.batch_size = batch_size
+        self.latency_budget_ms = latency_budget_ms
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        # One worker: the model already uses several threads for a batch
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="reranker")
+        self.calls = 0
+        self.fallbacks = 0
+        self.cache_hits = 0
+        self.scored_pairs = 0
+        self._latencies = []
+
+    def _cache_key(self, query, document):
+        return text_hash(query), text_hash(document.page_content)
+
+    def _cached_scores(self, keys):
+        with self._lock:
+            scores = {}
+            for key in keys:
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+                    scores[key] = self._cache[key]
+            return scores
+
+    def _score_pairs(self, keys, pairs):
+        # Runs on the worker thread. Every batch is cached as soon as it is scored,
+        # so the work done after a timeout is not lost.
+        scores = {}
+        for start in range(0, len(pairs), self.batch_size):
+            batch = pairs[start:start + self.batch_size]
+            batch_scores = np.asarray(
+                self.model.predict(batch, batch_size=len(batch), show_progress_bar=False),
+                dtype=np.float32,
+            ).reshape(-1)
+            with self._lock:
+                for key, score in zip(keys[start:start + len(batch)], batch_scores):
+                    self._cache[key] = float(score)
+                    self._cache.move_to_end(key)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+                self.scored_pairs += len(batch)
+            scores.update(zip(keys[start:start + len(batch)], batch_scores.tolist()))
+        return scores
+
+    def score_batch(self, queries, candidate_lists, timeout=None):
+        """
+        Scores the candidates of several questions, from the cache or with the model.
+
+        :param queries: The questions.
+        :param candidate_lists: One list of Documents per question.
+        :param timeout: Seconds to wait for the model, or None to wait until done.
+        :return: One list of scores per question, or None for all questions if the
+            timeout was exceeded.
+        """
+        keys = [[self._cache_key(q, d) for d in docs] for q, docs in zip(queries, candidate_lists)]
+        scores = self._cached_scores({key for row in keys for key in row})
+        with self._lock:
+            self.cache_hits += len(scores)
+
+        # Each missing pair is scored once, even if it repeats across questions
+        missing = {}
+        for query, documents, row in zip(queries, candidate_lists, keys):
+            for document, key in zip(documents, row):
+                if key not in scores and key not in missing:
+                    missing[key] = (query, document.page_content)
+        missing_keys, missing_pairs = list(missing), list(missing.values())
+        if missing_pairs:
+            future = self._executor.submit(self._score_pairs, missing_keys, missing_pairs)
+            try:
+                scores.update(future.result(timeout=timeout))
+            except FutureTimeoutError:
+                # Drop the job if it has not started (e.g., behind a previous one);
+                # otherwise it finishes in the background and fills the cache
+                future.cancel()
+                return None
+        return [[scores[key] for key in row] for row in keys]
+
+    def rerank_batch(self, queries, candidate_lists):
+        """
+        Keeps the top_n candidates of each question by cross-encoder score.
+
+        The latency budget applies to the whole call and grows with the number of
+        questions. If it is exceeded, the candidates keep their vector search order.
+
+        :param queries: The questions.
+        :param candidate_lists: One list of Documents per question, best first.
+        :return: One list of at most top_n Documents per question. Reranked
+            documents carry their score in ``metadata["rerank_score"]``.
+        """
+        start = time.perf_counter()
+        candidate_lists = [list(documents)[:self.max_candidates] for documents in candidate_lists]
+        timeout = (
+            self.latency_budget_ms * len(queries) / 1000
+            if self.latency_budget_ms is not None
+            else None
+        )
+        scores = self.score_batch(queries, candidate_lists, timeout)
+        if scores is None:
+            results = [documents[:self.top_n] for documents in candidate_lists]
+        else:
+            results = []
+            for documents, document_scores in zip(candidate_lists, scores):
+                order = np.argsort(-np.asarray(document_scores), kind="stable")[:self.top_n]
+                results.append(
+                    [
+                        Document(
+                            id=documents[i].id,
+                            page_content=documents[i].page_content,
+                            metadata={
+                                **documents[i].metadata,
+                                "rerank_score": round(float(document_scores[i]), 4),
+                            },
+                        )
+                        for i in order
+                    ]
+                )
+        with self._lock:
+            self.calls += len(queries)
+            self.fallbacks += len(queries) if scores is None else 0
+            self._latencies.append((time.perf_counter() - start) / max(len(queries), 1))
+            del self._latencies[:-1000]
+        return results
+
+    def rerank(self, query, documents):
+        """Keeps the top_n of the documents for one question (see rerank_batch())."""
+        return self.rerank_batch([query], [documents])[0]
+
+    def stats(self):
+        """Returns the call, fallback and cache counters and the latency percentiles."""
+        with self._lock:
+            latencies = np.asarray(self._latencies) * 1000
+            return {
+                "model": self.model_name,
+                "questions": self.calls,
+                "fallbacks": self.fallbacks,
+                "scored_pairs": self.scored_pairs,
+                "cache_hits": self.cache_hits,
+                "cache_entries": len(self._cache),
+                "p50_ms": round(float(np.percentile(latencies, 50)), 3) if len(latencies) else None,
+                "p95_ms": round(float(np.percentile(latencies, 95)), 3) if len(latencies) else None,
+            }
+
+    def print_stats(self):
+        stats = self.stats()
+        print(
+            f"Reranker ({stats['model']}): {stats['questions']} questions, "
+            f"{stats['fallbacks']} over the latency budget, {stats['scored_pairs']} pairs "
+            f"scored, {stats['cache_hits']} cache hits, p50 {stats['p50_ms']} ms"
+        )
+
+    def close(self):
+        """Stops the worker thread (after the running job)."""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class RerankingRetriever(BaseRetriever):
+    """
+    A retriever that re-ranks the results of another retriever with a
+    CrossEncoderReranker.
+
+    Example:
+        candidates = BatchRetriever(vector_store=db, k=20)
+        retriever = RerankingRetriever(retriever=candidates, reranker=CrossEncoderReranker(top_n=4))
+        retriever.invoke("What is SSRF?")
+    """
+
+    retriever: BaseRetriever
+    reranker: CrossEncoderReranker
+
+    model_config = {"arbitrary_types_allowed": True}
+
+    def _get_relevant_documents(self, query, *, run_manager: CallbackManagerForRetrieverRun):
+        return self.reranker.rerank(query, self.retriever.invoke(query))
+
+    def batch(self, inputs, config=None, *, return_exceptions=False, **kwargs):
+        """Retrieves the candidates of all inputs at once, then re-ranks them together."""
+        if not inputs:
+            return []
+        inputs = list(inputs)
+        candidates = self.retriever.batch(inputs, config, return_exceptions=return_exceptions)
+        ok = [i for i, documents in enumerate(candidates) if not isinstance(documents, Exception)]
+        try:
+            reranked = self.reranker.rerank_batch([inputs[i] for i in ok], [candidates[i] for i in ok])
+        except Exception as e:
+            if return_exceptions:
+                return [e] * len(inputs)
+            raise
+        for i, documents in zip(ok, reranked):
+            candidates[i] = documents
+        return candidates
+
+    def retrieve_batch(self, queries):
+        """
+        Like BatchRetriever.retrieve_batch(): one list of ``(Document, score)`` pairs
+        per query, with the cross-encoder score (or the vector search relevance when
+        the latency budget was exceeded).
+        """
+        hits = self.retriever.retrieve_batch(queries)
+        reranked = self.reranker.rerank_batch(queries, [[d for d, _ in row] for row in hits])
+        results = []
+        for row, documents in zip(hits, reranked):
+            relevance = {id(d): score for d, score in row}
+            results.append(
+                [
+                    (d, d.metadata.get("rerank_score", relevance.get(id(d))))
+                    for d in documents
+                ]
+            )
+        return results
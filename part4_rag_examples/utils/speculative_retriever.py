@@ -0,0 +1,171 @@
+# This module provides a faster history-aware retriever for conversational RAG.
+#
+# create_history_aware_retriever() (LangChain) asks the LLM to rewrite the latest
+# question into a standalone question using the chat history, and only then
+# retrieves with the rewritten question. Retrieval waits for a full LLM round-trip
+# on every turn with history, although most follow-up questions are already
+# standalone and the rewrite returns them (almost) unchanged.
+#
+# SpeculativeHistoryAwareRetriever takes the same arguments (llm, retriever, prompt)
+# and removes that serial hop:
+#
+#   no history  - the question is used as is, without calling the LLM.
+#   history     - retrieval with the raw question starts at the same time as the
+#                 rewrite. When the rewrite is back, its content words are compared
+#                 with the raw question: if it adds none (it only drops words or
+#                 changes function words), the speculative results are used, so the
+#                 turn costs max(rewrite, retrieval) instead of rewrite + retrieval.
+#                 Otherwise the rewritten question is retrieved as usual (the
+#                 speculative search was wasted, but costs no more than one extra
+#                 search).
+#
+# A similarity score is not enough for this decision: resolving a pronoun ("exploit
+# it" -> "exploit SSRF") changes a single word, so the rewrite looks almost identical,
+# yet that word is the whole point of the rewrite. Any new content word therefore
+# means the raw question was missing context and its results cannot be reused.
+#
+# stats() reports how many turns skipped the rewrite, reused the speculative results
+# or had to retrieve again.
+
+# Instructor: Omar Santos @santosomar
+
+import asyncio
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.runnables import Runnable
+
+_WORD = re.compile(r"\w+")
+
+# Words a rewrite may add without changing what is searched for
+STOP_WORDS = frozenset(
+    "a about also an and any are as at be been being but by can could did do does "
+    "for from had has have how i if in is it its me my of on or please should so than "
+    "that the their them then there these they this those to was we were what when "
+    "where which who whom whose why will with would you your".split()
+)
+
+
+def new_content_words(question, rewritten):
+    """
+    Returns the content words of the rewritten question that are not in the raw
+    question (lowercase, stop words ignored).
+
+    Example (a pronoun resolved by the rewrite is a new content word):
+        >>> sorted(new_content_words(
+        ...     "Can you show how an attacker would exploit it against a cloud metadata service?",
+        ...     "Can you show how an attacker would exploit SSRF against a cloud metadata service?",
+        ... ))
+        ['ssrf']
+        >>> new_content_words("what about the mitigations", "What are the mitigations?")
+        set()
+    """
+    known = set(_WORD.findall(question.lower())) | STOP_WORDS
+    return set(_WORD.findall(rewritten.lower())) - known
+
+
+class SpeculativeHistoryAwareRetriever(Runnable):
+    """
+    A drop-in replacement for create_history_aware_retriever() that retrieves with
+    the raw question while the question is being rewritten.
+
+    Example:
+        history_aware_retriever = SpeculativeHistoryAwareRetriever(
+            llm, retriever, contextualize_q_prompt, max_new_words=0
+        )
+        rag_chain = create_retrieval_chain(history_aware_retriever, question_answer_chain)
+        history_aware_retriever.print_stats()
+    """
+
+    def __init__(self, llm, retriever, prompt, max_new_words=0, max_workers=4):
+        """
+        :param llm: The model that rewrites the question.
+        :param retriever: The retriever (any runnable from a string to documents).
+        :param prompt: The rewrite prompt, with an "input" variable (and usually a
+            "chat_history" placeholder).
+        :param max_new_words: The speculative results are reused when the rewrite
+            adds at most this many content words to the raw question (see
+            new_content_words()). Keep 0 unless the rewrites often add filler words.
+        :param max_workers: Threads running speculative searches in invoke().
+        """
+        if "input" not in prompt.input_variables:
+            raise ValueError(
+                "Expected `input` to be a prompt variable, "
+                f"but got {prompt.input_variables}"
+            )
+        self.retriever = retriever
+        self.rewrite_chain = prompt | llm | StrOutputParser()
+        self.max_new_words = max_new_words
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="speculative")
+        self._lock = threading.Lock()
+        self.skipped = 0
+        self.reused = 0
+        self.re_retrieved = 0
+
+    def _count(self, outcome):
+        with self._lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+
+    def _reuse(self, question, rewritten):
+        # True when the speculative results of the raw question can be used
+        reuse = len(new_content_words(question, rewritten)) <= self.max_new_words
+        self._count("reused" if reuse else "re_retrieved")
+        return reuse
+
+    def invoke(self, input, config=None, **kwargs):
+        """
+        :param input: A dictionary with "input" (the question) and "chat_history".
+        :return: The retrieved documents.
+        """
+        question = input["input"]
+        if not input.get("chat_history"):
+            self._count("skipped")
+            return self.retriever.invoke(question, config)
+        speculative = self._executor.submit(self.retriever.invoke, question, config)
+        rewritten = self.rewrite_chain.invoke(input, config)
+        if self._reuse(question, rewritten):
+            return speculative.result()
+        # The speculative search is not needed anymore (cancelled if not started)
+        speculative.cancel()
+        return self.retriever.invoke(rewritten, config)
+
+    async def ainvoke(self, input, config=None, **kwargs):
+        """Async version of invoke(): the rewrite and the search run concurrently."""
+        question = input["input"]
+        if not input.get("chat_history"):
+            self._count("skipped")
+            return await self.retriever.ainvoke(question, config)
+        speculative = asyncio.ensure_future(self.retriever.ainvoke(question, config))
+        try:
+            rewritten = await self.rewrite_chain.ainvoke(input, config)
+        except BaseException:
+            speculative.cancel()
+            raise
+        if self._reuse(question, rewritten):
+            return await speculative
+        speculative.cancel()
+        return await self.retriever.ainvoke(rewritten, config)
+
+    def stats(self):
+        """Returns the number of turns per outcome and the share of rewrites avoided."""
+        with self._lock:
+            turns = self.skipped + self.reused + self.re_retrieved
+            return {
+                "turns": turns,
+                "skipped_rewrite": self.skipped,
+                "reused_speculative": self.reused,
+                "re_retrieved": self.re_retrieved,
+                # Turns where retrieval did not wait for the rewrite
+                "fast_path_rate": round((self.skipped + self.reused) / turns, 4) if turns else 0.0,
+            }
+
+    def print_stats(self):
+        stats = self.stats()
+        print(
+            f"History-aware retrieval: {stats['turns']} turns, {stats['skipped_rewrite']} without "
+            f"history, {stats['reused_speculative']} reused the speculative search, "
+            f"{stats['re_retrieved']} retrieved the rewritten question "
+            f"({stats['fast_path_rate']:.0%} did not wait for the rewrite)"
+        )
@@ -0,0 +1,51 @@
+# This module defines the text splitters compared in text_splitting_deep_dive.py, so
+# the benchmark and comparison scripts can build exactly the same configurations.
+
+# Instructor: Omar Santos @santosomar
+
+from langchain.text_splitter import (
+    CharacterTextSplitter,
+    RecursiveCharacterTextSplitter,
+    SentenceTransformersTokenTextSplitter,
+    TextSplitter,
+    TokenTextSplitter,
+)
+
+from utils.offset_splitter import OffsetTextSplitter
+
+
+class CustomTextSplitter(TextSplitter):
+    # Same custom splitter as in text_splitting_deep_dive.py
+    def split_text(self, text):
+        return text.split("\n\n")  # Example: split by paragraphs
+
+
+def splitting_configurations():
+    """
+    Returns the splitters used by text_splitting_deep_dive.py, keyed by name.
+
+    Splitters that need a model or encoding that cannot be loaded (e.g., when
+    running offline) are returned as an error message instead, so callers can
+    report them as skipped.
+    """
+    factories = {
+        "char": lambda: CharacterTextSplitter(chunk_size=1000, chunk_overlap=100),
+        "sentence_transformers_token": lambda: SentenceTransformersTokenTextSplitter(
+            chunk_size=1000
+        ),
+        "token": lambda: TokenTextSplitter(chunk_overlap=0, chunk_size=512),
+        "recursive_char": lambda: RecursiveCharacterTextSplitter(
+            chunk_size=1000, chunk_overlap=100
+        ),
+        "custom": CustomTextSplitter,
+        "offset_recursive_char": lambda: OffsetTextSplitter(
+            chunk_size=1000, chunk_overlap=100
+        ),
+    }
+    configurations = {}
+    for name, factory in factories.items():
+        try:
+            configurations[name] = factory()
+        except Exception as e:  # noqa: BLE001
+            configurations[name] = f"{type(e).__name__}: {e}"
+    return configurations
@@ -0,0 +1,272 @@
+# This module implements a bounded-memory streaming ingestion pipeline:
+#
+#     load -> split -> batch -> embed -> upsert
+#
+# Each stage runs in its own thread and the stages are connected with bounded
+# queues, so only a few batches are in flight at any time. Loaders yield documents
+# lazily, the splitter yields chunks one document at a time, and the embedder and
+# the vector store writer consume fixed-size batches. Network-bound embedding calls
+# overlap with CPU-bound splitting, chunks are written as soon as they are embedded,
+# and peak memory no longer grows with the size of the corpus.
+
+# Instructor: Omar Santos @santosomar
+
+import queue
+import threading
+import time
+import uuid
+
+# Marks the end of a stream in the queues between stages
+_DONE = object()
+
+
+def iter_documents(loaders):
+    """
+    Chains the documents of several LangChain loaders lazily.
+
+    :param loaders: An iterable of LangChain document loaders.
+    :return: A generator of LangChain documents.
+    """
+    for loader in loaders:
+        yield from loader.lazy_load()
+
+
+def iter_chunks(documents, text_splitter):
+    """
+    Splits documents one at a time so only one document is held in memory.
+
+    :param documents: An iterable of LangChain documents.
+    :param text_splitter: A LangChain text splitter.
+    :return: A generator of chunks (LangChain documents).
+    """
+    for document in documents:
+        yield from text_splitter.split_documents([document])
+
+
+def iter_batches(items, batch_size):
+    """Groups an iterable into lists of at most ``batch_size`` items."""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def vector_store_writer(db):
+    """
+    Returns a function that writes pre-computed embeddings to a vector store.
+
+    Chroma stores are written through their collection, so the chunks are not
+    embedded a second time. Other stores that implement
+    ``add_embeddings(texts, embeddings, metadatas, ids)`` are also supported.
+
+    :param db: A LangChain vector store.
+    :return: A callable ``write(chunks, vectors, ids)``.
+    """
+    collection = getattr(db, "_collection", None)
+    if collection is not None:
+
+        def write(chunks, vectors, ids):
+            # Chroma rejects empty metadata dictionaries, so chunks with and
+            # without metadata are written separately (as LangChain's Chroma does)
+            with_metadata = [i for i, chunk in enumerate(chunks) if chunk.metadata]
+            without_metadata = [i for i, chunk in enumerate(chunks) if not chunk.metadata]
+            for indexes, has_metadata in ((with_metadata, True), (without_metadata, False)):
+                if not indexes:
+                    continue
+                collection.upsert(
+                    ids=[ids[i] for i in indexes],
+                    embeddings=[vectors[i] for i in indexes],
+                    metadatas=[chunks[i].metadata for i in indexes] if has_metadata else None,
+                    documents=[chunks[i].page_content for i in indexes],
+                )
+
+        return write
+
+    if hasattr(db, "add_embeddings"):
+
+        def write(chunks, vectors, ids):
+            db.add_embeddings(
+                texts=[chunk.page_content for chunk in chunks],
+                embeddings=vectors,
+                metadatas=[chunk.metadata for chunk in chunks],
+                ids=ids,
+            )
+
+        return write
+
+    raise TypeError(
+        f"{type(db).__name__} does not support writing pre-computed embeddings."
+    )
+
+
+class _Stage(threading.Thread):
+    # A daemon thread that records the first exception raised by its target
+
+    def __init__(self, name, target, pipeline):
+        super().__init__(name=name, daemon=True)
+        self._target_fn = target
+        self._pipeline = pipeline
+
+    def run(self):
+        try:
+            self._target_fn()
+        except BaseException as e:  # noqa: BLE001
+            self._pipeline._fail(e)
+
+
+class StreamingIngestionPipeline:
+    """
+    Streams chunks through embedding and vector store writes with bounded queues.
+
+    Example:
+        db = Chroma(persist_directory=..., embedding_function=embeddings)
+        pipeline = StreamingIngestionPipeline(embeddings, vector_store_writer(db))
+        stats = pipeline.run(iter_chunks(iter_documents(loaders), text_splitter))
+    """
+
+    def __init__(
+        self,
+        embeddings,
+        write_batch,
+        batch_size=64,
+        embed_workers=2,
+        max_pending_batches=4,
+        id_fn=None,
+        on_batch_written=None,
+    ):
+        """
+        :param embeddings: A LangChain Embeddings object used to embed the chunks.
+        :param write_batch: A callable ``write(chunks, vectors, ids)``, e.g. the one
+            returned by :func:`vector_store_writer`.
+        :param batch_size: Number of chunks per embedding request and write.
+        :param embed_workers: Number of threads calling the embedding model
+            concurrently.
+        :param max_pending_batches: Capacity of each queue between stages. Together
+            with ``batch_size`` this bounds the number of chunks held in memory.
+        :param id_fn: Optional callable returning the ID of a chunk. Random UUIDs
+            are used by default.
+        :param on_batch_written: Optional callback invoked with the number of
+            chunks after every write (e.g., for progress output).
+        """
+        self.embeddings = embeddings
+        self.write_batch = write_batch
+        self.batch_size = batch_size
+        self.embed_workers = embed_workers
+        self.max_pending_batches = max_pending_batches
+        self.id_fn = id_fn or (lambda chunk: str(uuid.uuid4()))
+        self.on_batch_written = on_batch_written
+        self._stop = threading.Event()
+        self._error = None
+        self._lock = threading.Lock()
+
+    def _fail(self, error):
+        with self._lock:
+            if self._error is None:
+                self._error = error
+        self._stop.set()
+
+    def _put(self, q, item):
+        # Blocks while the queue is full, unless another stage failed
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q):
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def run(self, chunks):
+        """
+        Runs the pipeline until all chunks are written.
+
+        :param chunks: An iterable (ideally a generator) of chunks.
+        :return: A dictionary with chunk and batch counts and the time spent in
+            each stage (embedding time is summed across the embedding workers).
+        """
+        self._stop.clear()
+        self._error = None
+        embed_queue = queue.Queue(maxsize=self.max_pending_batches)
+        write_queue = queue.Queue(maxsize=self.max_pending_batches)
+        stats = {
+            "chunks": 0,
+            "batches": 0,
+            "split_seconds": 0.0,
+            "embed_seconds": 0.0,
+            "write_seconds": 0.0,
+        }
+        start = time.perf_counter()
+
+        def produce():
+            iterator = iter_batches(chunks, self.batch_size)
+            while True:
+                t0 = time.perf_counter()
+                batch = next(iterator, None)
+                stats["split_seconds"] += time.perf_counter() - t0
+                if batch is None or not self._put(embed_queue, batch):
+                    break
+            for _ in range(self.embed_workers):
+                self._put(embed_queue, _DONE)
+
+        def embed():
+            while True:
+                batch = self._get(embed_queue)
+                if batch is _DONE:
+                    break
+                t0 = time.perf_counter()
+                vectors = self.embeddings.embed_documents(
+                    [chunk.page_content for chunk in batch]
+                )
+                with self._lock:
+                    stats["embed_seconds"] += time.perf_counter() - t0
+                if not self._put(write_queue, (batch, vectors)):
+                    break
+            self._put(write_queue, _DONE)
+
+        stages = [_Stage("split", produce, self)]
+        stages += [
+            _Stage(f"embed-{i}", embed, self) for i in range(self.embed_workers)
+        ]
+        for stage in stages:
+            stage.start()
+
+        # The vector store is written from the calling thread, one batch at a time
+        finished_workers = 0
+        try:
+            while finished_workers < self.embed_workers:
+                item = self._get(write_queue)
+                if item is _DONE:
+                    if self._stop.is_set():
+                        break
+                    finished_workers += 1
+                    continue
+                batch, vectors = item
+                t0 = time.perf_counter()
+                self.write_batch(batch, vectors, [self.id_fn(chunk) for chunk in batch])
+                stats["write_seconds"] += time.perf_counter() - t0
+                stats["chunks"] += len(batch)
+                stats["batches"] += 1
+                if self.on_batch_written:
+                    self.on_batch_written(len(batch))
+        except BaseException as e:
+            self._fail(e)
+        finally:
+            self._stop.set()
+            for stage in stages:
+                stage.join()
+
+        if self._error is not None:
+            raise self._error
+        stats["total_seconds"] = time.perf_counter() - start
+        return stats
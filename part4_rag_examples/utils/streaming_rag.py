@@ -0,0 +1,255 @@
+# This module streams the answer of a RAG chain token by token, with the retrieved
+# sources sent first, and measures the latency of every stage of a request.
+#
+# rag_chain.invoke() returns only when the LLM has generated the whole answer, so a
+# user waits for the full generation (often several seconds) before seeing
+# anything. What a user perceives is the time to the first token: retrieval takes
+# a fraction of a second, and the LLM starts producing tokens long before it is
+# done. StreamingRAG runs the same steps as the chain of basic_rag_part3.py and
+# yields events as soon as they are available:
+#
+#   {"type": "sources", "sources": [...], "retrieval_ms": ...}
+#       the retrieved chunks (ID, source, score and the beginning of the text),
+#       before the LLM is called, so a UI can show them right away.
+#   {"type": "token", "text": ...}
+#       one piece of the answer, as the LLM streams it.
+#   {"type": "done", "answer": ..., "metrics": {...}}
+#       the full answer and the latency of the request: retrieval_ms,
+#       ttft_ms (from the question to the first token), generation_ms (from the
+#       LLM call to the last token) and total_ms.
+#
+# stream() is a generator for scripts and threads; astream() is an async generator
+# for async web servers, which runs retrieval in a worker thread and streams the
+# LLM with its async API, so the event loop keeps serving other requests.
+# With a SemanticAnswerCache (utils/answer_cache.py), a cache hit is sent as a
+# single token without retrieval, and a generated answer is stored once complete.
+# stats() reports the p50/p95 of every latency over the recent requests.
+
+# Instructor: Omar Santos @santosomar
+
+import asyncio
+import threading
+import time
+from collections import deque
+
+import numpy as np
+from langchain_core.output_parsers import StrOutputParser
+
+from utils.embedding_cache import normalize_text
+
+
+def _milliseconds(seconds):
+    return round(seconds * 1000, 3)
+
+
+def _percentiles(values):
+    if not values:
+        return {"p50_ms": None, "p95_ms": None}
+    return {
+        "p50_ms": round(float(np.percentile(values, 50)), 3),
+        "p95_ms": round(float(np.percentile(values, 95)), 3),
+    }
+
+
+def describe_sources(hits, preview_chars=200):
+    """
+    Describes the retrieved chunks for the "sources" event.
+
+    :param hits: A list of ``(Document, score)`` pairs (score may be None).
+    :param preview_chars: Number of characters of text included per chunk.
+    :return: A list of dictionaries with id, source, score and preview.
+    """
+    sources = []
+    for document, score in hits:
+        score = document.metadata.get("rerank_score", score)
+        sources.append(
+            {
+                "id": document.id,
+                "source": document.metadata.get("source"),
+                "score": round(float(score), 4) if score is not None else None,
+                "preview": document.page_content[:preview_chars],
+            }
+        )
+    return sources
+
+
+class StreamingRAG:
+    """
+    Streams RAG answers, sources first, with time-to-first-token metrics.
+
+    Example:
+        streaming_rag = StreamingRAG(retriever, format_docs, prompt, llm)
+        for event in streaming_rag.stream("What is SSRF?"):
+            if event["type"] == "token":
+                print(event["text"], end="", flush=True)
+        streaming_rag.print_stats()
+    """
+
+    def __init__(self, retriever, format_fn, prompt, llm, answer_cache=None, max_history=1000):
+        """
+        :param retriever: A LangChain retriever. BatchRetriever and
+            RerankingRetriever also report the score of every source.
+        :param format_fn: Turns the retrieved documents into the context string.
+        :param prompt: A prompt with "context" and "question" variables.
+        :param llm: A chat model that supports streaming (e.g., ChatOpenAI).
+        :param answer_cache: An optional SemanticAnswerCache.
+        :param max_history: Number of recent requests kept for stats().
+        """
+        self.retriever = retriever
+        self.format_fn = format_fn
+        self.answer_chain = prompt | llm | StrOutputParser()
+        self.answer_cache = answer_cache
+        self._history = deque(maxlen=max_history)
+        self._lock = threading.Lock()
+
+    def _retrieve(self, question):
+        # Returns (Document, score) pairs, with the scores when the retriever has them
+        if hasattr(self.retriever, "retrieve_batch"):
+            return self.retriever.retrieve_batch([question])[0]
+        return [(document, None) for document in self.retriever.invoke(question)]
+
+    def _cache_lookup(self, question):
+        # Returns (cached answer or None, question vector, store version)
+        if self.answer_cache is None:
+            return None, None, None
+        version = self.answer_cache.version_fn()
+        vector = self.answer_cache.embeddings.embed_query(normalize_text(question))
+        cached = self.answer_cache.lookup(question, vector)
+        return (cached[0] if cached else None), vector, version
+
+    def _finish(self, question, answer, start, retrieved, generation_start, first_token, cached, cache_state):
+        # Stores the answer in the cache and records the metrics of the request
+        end = time.perf_counter()
+        if self.answer_cache is not None:
+            if not cached:
+                self.answer_cache.store(question, answer, cache_state[1], cache_state[2])
+            self.answer_cache.record(cached, end - start)
+        metrics = {
+            "cached": cached,
+            "retrieval_ms": _milliseconds(retrieved - start) if retrieved else None,
+            "ttft_ms": _milliseconds((first_token or end) - start),
+            "generation_ms": _milliseconds(end - generation_start) if generation_start else None,
+            "total_ms": _milliseconds(end - start),
+        }
+        with self._lock:
+            self._history.append(metrics)
+        return {"type": "done", "answer": answer, "metrics": metrics}
+
+    def stream(self, question):
+        """
+        Answers a question, yielding the events described in the module comment.
+
+        :param question: The question.
+        :return: A generator of event dictionaries.
+        """
+        start = time.perf_counter()
+        cache_state = self._cache_lookup(question)
+        if cache_state[0] is not None:
+            yield {"type": "sources", "sources": [], "retrieval_ms": 0.0, "cached": True}
+            yield {"type": "token", "text": cache_state[0]}
+            yield self._finish(question, cache_state[0], start, None, None, None, True, cache_state)
+            return
+
+        hits = self._retrieve(question)
+        retrieved = time.perf_counter()
+        yield {
+            "type": "sources",
+            "sources": describe_sources(hits),
+            "retrieval_ms": _milliseconds(retrieved - start),
+            "cached": False,
+        }
+
+        inputs = {"context": self.format_fn([d for d, _ in hits]), "question": question}
+        generation_start = time.perf_counter()
+        first_token, parts = None, []
+        for text in self.answer_chain.stream(inputs):
+            if not text:
+                continue
+            if first_token is None:
+                first_token = time.perf_counter()
+            parts.append(text)
+            yield {"type": "token", "text": text}
+        yield self._finish(
+            question, "".join(parts), start, retrieved, generation_start, first_token, False, cache_state
+        )
+
+    async def astream(self, question):
+        """
+        Async version of stream(): retrieval and the cache run in a worker thread,
+        and the LLM is streamed with its async API.
+
+        :param question: The question.
+        :return: An async generator of event dictionaries.
+        """
+        start = time.perf_counter()
+        cache_state = await asyncio.to_thread(self._cache_lookup, question)
+        if cache_state[0] is not None:
+            yield {"type": "sources", "sources": [], "retrieval_ms": 0.0, "cached": True}
+            yield {"type": "token", "text": cache_state[0]}
+            yield await asyncio.to_thread(
+                self._finish, question, cache_state[0], start, None, None, None, True, cache_state
+            )
+            return
+
+        hits = await asyncio.to_thread(self._retrieve, question)
+        retrieved = time.perf_counter()
+        yield {
+            "type": "sources",
+            "sources": describe_sources(hits),
+            "retrieval_ms": _milliseconds(retrieved - start),
+            "cached": False,
+        }
+
+        inputs = {"context": self.format_fn([d for d, _ in hits]), "question": question}
+        generation_start = time.perf_counter()
+        first_token, parts = None, []
+        async for text in self.answer_chain.astream(inputs):
+            if not text:
+                continue
+            if first_token is None:
+                first_token = time.perf_counter()
+            parts.append(text)
+            yield {"type": "token", "text": text}
+        # Storing in the cache embeds nothing new, but writes to SQLite
+        yield await asyncio.to_thread(
+            self._finish,
+            question,
+            "".join(parts),
+            start,
+            retrieved,
+            generation_start,
+            first_token,
+            False,
+            cache_state,
+        )
+
+    def invoke(self, question):
+        """Answers a question without streaming; returns the answer string."""
+        for event in self.stream(question):
+            if event["type"] == "done":
+                return event["answer"]
+
+    def stats(self):
+        """Returns the p50/p95 latencies of the recent requests, in milliseconds."""
+        with self._lock:
+            history = list(self._history)
+        generated = [m for m in history if not m["cached"]]
+        return {
+            "requests": len(history),
+            "cached": len(history) - len(generated),
+            "retrieval": _percentiles([m["retrieval_ms"] for m in generated]),
+            "ttft": _percentiles([m["ttft_ms"] for m in history]),
+            "generation": _percentiles([m["generation_ms"] for m in generated]),
+            "total": _percentiles([m["total_ms"] for m in history]),
+        }
+
+    def print_stats(self):
+        stats = self.stats()
+        print(
+            f"Streaming: {stats['requests']} requests ({stats['cached']} from the answer cache), "
+            f"retrieval p50 {stats['retrieval']['p50_ms']} ms, "
+            f"time to first token p50 {stats['ttft']['p50_ms']} ms "
+            f"(p95 {stats['ttft']['p95_ms']} ms), "
+            f"generation p50 {stats['generation']['p50_ms']} ms, "
+            f"total p50 {stats['total']['p50_ms']} ms"
+        )
@@ -0,0 +1,215 @@
+# This script helps choosing between the vector index options and their parameters:
+#
+#   hnsw - the HNSW graph of utils/hnsw_index.py. For each ef_search value it reports
+#          recall@k against exact search together with the per-query latency
+#          (p50/p95) and queries per second.
+#   int8 - int8 scalar-quantized codes (utils/quantized_index.py).
+#   pq   - product-quantized codes (utils/quantized_index.py). For both quantization
+#          methods it reports recall@k and latency for each number of re-ranked
+#          candidates, and the memory used by the codes.
+#   mmr  - not an index: the latency added by MMR diversity re-ranking
+#          (utils/mmr.py) for pools of --pool-sizes candidates, compared with
+#          langchain_core's implementation.
+#
+# For every index it also reports the build time, the time to open the store and
+# run a first query, and the size of the index on disk.
+#
+# By default a synthetic corpus of clustered vectors is used, so no API key is
+# needed. Use --chroma-dir to measure the vectors of an existing Chroma store
+# instead (queries are then stored vectors with a little noise added).
+#
+# Examples:
+#   python vector_index_benchmark.py
+#   python vector_index_benchmark.py --methods hnsw --synthetic 200000 --M 32 --ef-search 32 64 128
+#   python vector_index_benchmark.py --methods int8 pq --rerank 0 50 200
+#   python vector_index_benchmark.py --chroma-dir db/chroma_db_security --k 5
+#   python vector_index_benchmark.py --methods mmr --dim 1536 --k 5 --pool-sizes 20 100 300
+
+# Instructor: Omar Santos @santosomar
+
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from utils.benchmarking import environment_info
+from utils.flat_index import FlatVectorStore
+from utils.hnsw_index import GRAPH_FILENAME, HNSWVectorStore, print_report, recall_latency_report
+from utils.mmr import mmr_latency_report, print_mmr_report
+from utils.quantized_index import (
+    CODES_FILENAME,
+    QuantizedVectorStore,
+    print_recall_check,
+    recall_check,
+)
+
+
+def make_clustered_vectors(count, dim, clusters, seed=42):
+    """
+    Creates vectors grouped around random centers, which resembles real embeddings
+    more closely than uniform noise (and is harder for the index).
+
+    :return: A tuple (vectors, queries_generator) where queries_generator(n) draws
+        new vectors from the same distribution.
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim)).astype(np.float32)
+
+    def draw(n):
+        noise = rng.normal(scale=0.6, size=(n, dim)).astype(np.float32)
+        return centers[rng.integers(0, clusters, n)] + noise
+
+    return draw(count), draw
+
+
+def load_vectors(work_dir, args):
+    """Returns the (vectors, queries) arrays to benchmark."""
+    if not args.chroma_dir:
+        vectors, draw = make_clustered_vectors(args.synthetic, args.dim, args.clusters)
+        return vectors, draw(args.queries)
+
+    # Imported here so the synthetic benchmark does not require chromadb
+    from langchain_chroma import Chroma
+
+    flat = FlatVectorStore.from_chroma(
+        Chroma(persist_directory=args.chroma_dir), os.path.join(work_dir, "flat")
+    )
+    vectors = np.asarray(flat._vector_matrix(), dtype=np.float32)
+    rng = np.random.default_rng(42)
+    queries = vectors[rng.integers(0, len(vectors), args.queries)]
+    return vectors, queries + rng.normal(scale=0.01, size=queries.shape).astype(np.float32)
+
+
+def add_vectors(store, vectors, batch_size=10000):
+    for start in range(0, len(vectors), batch_size):
+        batch = vectors[start:start + batch_size]
+        ids = [str(i) for i in range(start, start + len(batch))]
+        store.add_embeddings(ids, batch, ids=ids)
+
+
+def benchmark_method(method, vectors, queries, work_dir, args):
+    """Builds the index of one method, prints its report and returns the results."""
+    if method == "mmr":
+        print(f"\n--- mmr (k={args.k}) ---")
+        rows = mmr_latency_report(queries, vectors, pool_sizes=args.pool_sizes, k=args.k)
+        print_mmr_report(rows)
+        return {"method": method, "results": rows}
+
+    store_dir = os.path.join(work_dir, method)
+    start = time.perf_counter()
+    if method == "hnsw":
+        store = HNSWVectorStore(
+            store_dir, M=args.M, ef_construction=args.ef_construction, autosave=False
+        )
+        add_vectors(store, vectors)
+        store.persist()
+        index_file = GRAPH_FILENAME
+    else:
+        store = QuantizedVectorStore(store_dir, method=method)
+        add_vectors(store, vectors)
+        store.persist()
+        store.train()
+        index_file = CODES_FILENAME
+    build_seconds = time.perf_counter() - start
+
+    # Open the saved store and run a first query, as a new process would
+    start = time.perf_counter()
+    reopened = HNSWVectorStore(store_dir) if method == "hnsw" else QuantizedVectorStore(store_dir)
+    reopened.similarity_search_with_score_by_vector(queries[0], k=args.k)
+    open_seconds = time.perf_counter() - start
+
+    result = {
+        "method": method,
+        "build_seconds": round(build_seconds, 3),
+        "open_and_first_query_ms": round(open_seconds * 1000, 3),
+        "index_bytes": os.path.getsize(os.path.join(store_dir, index_file)),
+    }
+    print(
+        f"\n--- {method} ---\n"
+        f"Build: {build_seconds:.2f}s  open + first query: {open_seconds * 1000:.1f} ms  "
+        f"index size: {result['index_bytes'] / (1024 * 1024):.1f} MB"
+    )
+    if method == "hnsw":
+        print(f"M: {args.M}  ef_construction: {args.ef_construction}\n")
+        result["results"] = recall_latency_report(
+            reopened, queries, k=args.k, ef_values=args.ef_search
+        )
+        print_report(result["results"])
+    else:
+        result["memory"] = reopened.memory_usage()
+        print(
+            f"Codes in memory: {result['memory']['code_bytes'] / (1024 * 1024):.1f} MB "
+            f"({result['memory']['compression']}x smaller than float32)\n"
+        )
+        result["results"] = recall_check(reopened, queries, k=args.k, rerank_values=args.rerank)
+        print_recall_check(result["results"])
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure recall@k, latency and memory of the vector index options."
+    )
+    parser.add_argument(
+        "--methods",
+        nargs="+",
+        default=["hnsw", "int8", "pq"],
+        choices=["hnsw", "int8", "pq", "mmr"],
+    )
+    parser.add_argument("--chroma-dir", help="Use the vectors of this Chroma store.")
+    parser.add_argument("--synthetic", type=int, default=50000, help="Number of synthetic vectors.")
+    parser.add_argument("--dim", type=int, default=384, help="Dimension of the synthetic vectors.")
+    parser.add_argument("--clusters", type=int, default=100, help="Clusters in the synthetic data.")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--M", type=int, default=16)
+    parser.add_argument("--ef-construction", type=int, default=200)
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[16, 32, 64, 128, 256])
+    parser.add_argument(
+        "--rerank",
+        type=int,
+        nargs="+",
+        default=[0, 20, 50, 100, 200],
+        help="Numbers of re-ranked candidates measured for int8 and pq.",
+    )
+    parser.add_argument(
+        "--pool-sizes",
+        type=int,
+        nargs="+",
+        default=[20, 100, 300],
+        help="Candidate pool sizes (fetch_k) measured for mmr.",
+    )
+    parser.add_argument("--output", help="Write the results to this JSON file.")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="vector_index_benchmark_")
+    try:
+        vectors, queries = load_vectors(work_dir, args)
+        print(f"--- {len(vectors)} vectors of dimension {vectors.shape[1]}, {len(queries)} queries ---")
+        results = [
+            benchmark_method(method, vectors, queries, work_dir, args) for method in args.methods
+        ]
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "environment": environment_info(),
+                    "arguments": vars(args),
+                    "vectors": len(vectors),
+                    "methods": results,
+                },
+                f,
+                indent=2,
+            )
+        print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -15,6 +15,15 @@ from langchain_core.output_parsers import StrOutputParser
 from langchain_core.runnables import RunnablePassthrough
 from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 
+from utils.context_packer import ContextPacker
+from utils.embedding_cache import CachedEmbeddings
+from utils.embedding_executor import EmbeddingExecutor
+from utils.streaming_pipeline import (
+    StreamingIngestionPipeline,
+    iter_chunks,
+    vector_store_writer,
+)
+
 # Load environment variables from .env
 load_dotenv()
 
@@ -28,29 +37,53 @@ persistent_directory = os.path.join(db_dir, "hacker_training")
 urls = ["https://hackertraining.org"]
 
 # Create a loader for web content
+# The pages are loaded lazily (one at a time) by the ingestion pipeline below
 loader = WebBaseLoader(urls)
-documents = loader.load()
 
 # Step 2: Split the scraped content into chunks
 # CharacterTextSplitter splits the text into smaller chunks
 text_splitter = CharacterTextSplitter(chunk_size=1000, chunk_overlap=50)
-docs = text_splitter.split_documents(documents)
-
-# Display information about the split documents
-print("\n--- Document Chunks Information ---")
-print(f"Number of document chunks: {len(docs)}")
-print(f"Sample chunk:\n{docs[0].page_content}\n")
 
 # Step 3: Create embeddings for the document chunks
 # OpenAIEmbeddings turns text into numerical vectors that capture semantic meaning
-embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
+# CachedEmbeddings keeps the vectors on disk so unchanged pages are not embedded again
+# EmbeddingExecutor batches the requests by token count, runs them concurrently within
+# the rate limits, and retries rate-limited requests with jittered backoff
+executor = EmbeddingExecutor(
+    OpenAIEmbeddings(model="text-embedding-3-small", chunk_size=2048, max_retries=0),
+    max_concurrency=4,
+    requests_per_minute=3000,
+    tokens_per_minute=1_000_000,
+)
+embeddings = CachedEmbeddings(executor)
 
 # Step 4: Create and persist the vector store with the embeddings
 # Chroma stores the embeddings for efficient searching
 if not os.path.exists(persistent_directory):
     print(f"\n--- Creating vector store in {persistent_directory} ---")
-    db = Chroma.from_documents(docs, embeddings, persist_directory=persistent_directory)
+    db = Chroma(persist_directory=persistent_directory, embedding_function=embeddings)
+
+    # Stream the pages through load -> split -> embed -> upsert with bounded queues,
+    # so large crawls never need to fit in memory and writes start right away
+    sample_chunks = []
+
+    def remember_sample(chunks):
+        for chunk in chunks:
+            if not sample_chunks:
+                sample_chunks.append(chunk)
+            yield chunk
+
+    pipeline = StreamingIngestionPipeline(embeddings, vector_store_writer(db))
+    stats = pipeline.run(remember_sample(iter_chunks(loader.lazy_load(), text_splitter)))
+
+    # Display information about the split documents
+    print("\n--- Document Chunks Information ---")
+    print(f"Number of document chunks: {stats['chunks']}")
+    if sample_chunks:
+        print(f"Sample chunk:\n{sample_chunks[0].page_content}\n")
     print(f"--- Finished creating vector store in {persistent_directory} ---")
+    embeddings.print_stats()
+    executor.print_stats()
 else:
     print(f"Vector store {persistent_directory} already exists. No need to initialize.")
     db = Chroma(persist_directory=persistent_directory, embedding_function=embeddings)
@@ -93,8 +126,13 @@ prompt = ChatPromptTemplate.from_template(template)
 
 
 # Define a function to format the documents
+# The context packer merges chunks that overlap (chunk_overlap=50) into one passage
+# and keeps the context within a token budget (see utils/context_packer.py)
+context_packer = ContextPacker(max_tokens=2000, model_name="gpt-4.1-mini")
+
+
 def format_docs(docs):
-    return "\n\n".join(doc.page_content for doc in docs)
+    return context_packer.pack(docs)
 
 
 # Create the RAG chain
@@ -109,3 +147,4 @@ rag_chain = (
 print("\n--- AI-Generated Answer ---")
 answer = rag_chain.invoke(query)
 print(answer)
+context_packer.print_stats()
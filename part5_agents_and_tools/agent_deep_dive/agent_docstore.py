@@ -7,11 +7,12 @@
 # Instructor: Omar Santos @santosomar
 
 import os
+import sys
 
 from dotenv import load_dotenv
 from langchain import hub
 from langchain.agents import AgentExecutor, create_react_agent
-from langchain.chains import create_history_aware_retriever, create_retrieval_chain
+from langchain.chains import create_retrieval_chain
 from langchain.chains.combine_documents import create_stuff_documents_chain
 from langchain_community.vectorstores import Chroma
 from langchain_core.messages import AIMessage, HumanMessage
@@ -27,6 +28,13 @@ current_dir = os.path.dirname(os.path.abspath(__file__))
 db_dir = os.path.join(current_dir, "..", "..", "part4_rag_examples", "db")
 persistent_directory = os.path.join(db_dir, "chroma_db_with_metadata")
 
+# Reuse the shared helpers from part4_rag_examples (e.g., the query embedding cache)
+sys.path.append(os.path.join(current_dir, "..", "..", "part4_rag_examples"))
+from utils.context_compressor import CompressingRetriever, ExtractiveCompressor  # noqa: E402
+from utils.embedding_cache import DEFAULT_CACHE_PATH, CachedEmbeddings  # noqa: E402
+from utils.query_cache import QueryEmbeddingCache  # noqa: E402
+from utils.speculative_retriever import SpeculativeHistoryAwareRetriever  # noqa: E402
+
 # Check if the Chroma vector store already exists
 if os.path.exists(persistent_directory):
     print("Loading existing vector store...")
@@ -38,7 +46,11 @@ else:
     )
 
 # Define the embedding model
-embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
+# Every retriever call embeds the (reformulated) question; repeated questions are
+# answered from the query embedding cache instead of calling the embedding API again.
+embeddings = QueryEmbeddingCache(
+    OpenAIEmbeddings(model="text-embedding-3-small"), disk_store=DEFAULT_CACHE_PATH
+)
 
 # Load the existing vector store with the embedding function
 db = Chroma(persist_directory=persistent_directory,
@@ -52,6 +64,21 @@ retriever = db.as_retriever(
     search_kwargs={"k": 3},
 )
 
+# Optional: keep only the sentences of the retrieved chunks that are closest to the
+# question (and their neighbours), up to half of their tokens. The sentences are
+# scored with the same embedding model as the retrieval, through the shared
+# embedding cache, so no LLM call is added. Turned off by default.
+use_context_compression = False
+context_compressor = None
+if use_context_compression:
+    context_compressor = ExtractiveCompressor(
+        CachedEmbeddings(embeddings, store=embeddings.disk_store),
+        ratio=0.5,
+        neighbours=1,
+        model_name="gpt-4.1-mini",
+    )
+    retriever = CompressingRetriever(retriever=retriever, compressor=context_compressor)
+
 # Create a ChatOpenAI model
 llm = ChatOpenAI(model="gpt-4.1-mini")
 
@@ -76,9 +103,14 @@ contextualize_q_prompt = ChatPromptTemplate.from_messages(
 )
 
 # Create a history-aware retriever
-# This uses the LLM to help reformulate the question based on chat history
-history_aware_retriever = create_history_aware_retriever(
-    llm, retriever, contextualize_q_prompt
+# This uses the LLM to help reformulate the question based on chat history.
+# Like create_history_aware_retriever(), but the raw question is retrieved while the
+# LLM rewrites it: if the rewrite adds no content word to the question (the usual
+# case for standalone follow-ups), those results are used and retrieval no longer
+# waits for the rewrite. A rewrite that resolves "it" or "that" adds a word, so the
+# rewritten question is retrieved. Without chat history, the question is used as is.
+history_aware_retriever = SpeculativeHistoryAwareRetriever(
+    llm, retriever, contextualize_q_prompt, max_new_words=0
 )
 
 # Answer question prompt
@@ -141,6 +173,10 @@ chat_history = []
 while True:
     query = input("You: ")
     if query.lower() == "exit":
+        embeddings.print_stats()
+        history_aware_retriever.print_stats()
+        if context_compressor is not None:
+            context_compressor.print_stats()
         break
     response = agent_executor.invoke(
         {"input": query, "chat_history": chat_history})
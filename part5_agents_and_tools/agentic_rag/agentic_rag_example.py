@@ -6,6 +6,7 @@
 # Instructor: Omar Santos @santosomar
 
 import os
+import sys
 from typing import TypedDict, List
 
 from dotenv import load_dotenv
@@ -23,11 +24,21 @@ load_dotenv()
 
 # Define paths for the dataset and persistent vector store
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
-DATA_PATH = os.path.join(
-    os.path.dirname(CURRENT_DIR), "..", "part4_rag_examples", "data", "ssrf.txt"
-)
+PART4_DIR = os.path.join(os.path.dirname(CURRENT_DIR), "..", "part4_rag_examples")
+DATA_PATH = os.path.join(PART4_DIR, "data", "ssrf.txt")
 PERSIST_PATH = os.path.join(CURRENT_DIR, "db", "chroma_db")
 
+# Reuse the shared helpers from part4_rag_examples (e.g., the embedding cache)
+sys.path.append(PART4_DIR)
+from utils.embedding_cache import DEFAULT_CACHE_PATH, CachedEmbeddings  # noqa: E402
+from utils.query_cache import QueryEmbeddingCache  # noqa: E402
+
+# Chunks that were already embedded by other scripts are read from the shared cache,
+# and repeated search queries are answered from the query embedding cache
+embeddings = QueryEmbeddingCache(
+    CachedEmbeddings(OpenAIEmbeddings()), disk_store=DEFAULT_CACHE_PATH
+)
+
 
 # Initialize or load the Chroma vector store
 if not os.path.exists(PERSIST_PATH):
@@ -36,10 +47,9 @@ if not os.path.exists(PERSIST_PATH):
     documents = loader.load()
     splitter = CharacterTextSplitter(chunk_size=1000, chunk_overlap=10)
     docs = splitter.split_documents(documents)
-    embeddings = OpenAIEmbeddings()
     vectordb = Chroma.from_documents(docs, embeddings, persist_directory=PERSIST_PATH)
 else:
-    vectordb = Chroma(persist_directory=PERSIST_PATH, embedding_function=OpenAIEmbeddings())
+    vectordb = Chroma(persist_directory=PERSIST_PATH, embedding_function=embeddings)
 
 retriever = vectordb.as_retriever()
 
@@ -97,3 +107,4 @@ if __name__ == "__main__":
             message = event["messages"][-1]
             if isinstance(message, AIMessage):
                 print(message.content)
+    embeddings.print_stats()